@@ -36,10 +36,15 @@ def value_of_bikeability():
 
 # %%
 FACTOR_NAME = 'Bikeability'
+WEIGHT = value_of_bikeability
+
+
+def raw_metric(loc):
+    return walkscore.bike_score(loc) / 100
 
 
 def annual_value(loc):
-    return value_of_bikeability() * walkscore.bike_score(loc) / 100
+    return WEIGHT() * raw_metric(loc)
 
 
 # %% tags=["active-ipynb"]
@@ -0,0 +1,72 @@
+"""
+Break-even weights: how much would you need to value a factor for one location to overtake another?
+
+Each location's total is linear in the weight of each linear factor (see city_result.is_linear),
+with the raw metrics as slopes. So the weight at which two locations swap places can be solved for
+exactly from a single ResultSet, without recomputing any factor data.
+
+Configvars that aren't weights of linear factors (e.g. annual_income) aren't covered; see
+sensitivity.py for a way to explore those.
+"""
+
+import numpy as np
+
+
+def breakeven(results):
+    """
+    Find, for each weight and each pair of locations, the value of the weight at which the
+    locations swap places, with every other configvar unchanged.
+
+    Args:
+        results: A ResultSet.
+
+    Return: A DataFrame with a row per (weight, pair of locations) whose ranking changes at some
+        value of the weight, sorted by weight and then by how far the break-even value is from the
+        current one. Its columns are:
+
+            Weight: The configvar name.
+            Current: Its current value.
+            Leader: The name of the location that currently has the higher total.
+            Trailer: The name of the location that would overtake it.
+            Direction: 'above' if Trailer overtakes Leader when the weight goes above Break-even,
+                'below' if it does when the weight goes below it.
+            Break-even: The value of the weight at which both totals are equal.
+    """
+    import pandas as pd
+
+    totals = results.totals
+    names = [loc.name for loc in results.locs]
+    # Only pairs where the first location is strictly ahead
+    leader, trailer = np.nonzero(totals[:, None] > totals[None, :])
+
+    rows = []
+    for name, weight in results.weights.items():
+        slopes = results.weight_slopes(name)
+        # leader's lead shrinks by (slopes[trailer] - slopes[leader]) per unit of weight
+        gain = slopes[trailer] - slopes[leader]
+        flips = gain != 0
+        lead = totals[leader[flips]] - totals[trailer[flips]]
+        thresholds = weight + lead / gain[flips]
+        for i, j, g, threshold in zip(
+            leader[flips], trailer[flips], gain[flips], thresholds
+        ):
+            rows.append(
+                {
+                    'Weight': name,
+                    'Current': weight,
+                    'Leader': names[i],
+                    'Trailer': names[j],
+                    'Direction': 'above' if g > 0 else 'below',
+                    'Break-even': threshold,
+                }
+            )
+
+    df = pd.DataFrame(
+        rows,
+        columns=['Weight', 'Current', 'Leader', 'Trailer', 'Direction', 'Break-even'],
+    )
+    distance = (df['Break-even'] - df['Current']).abs()
+    order = df.assign(distance=distance).sort_values(
+        ['Weight', 'distance'], kind='stable'
+    )
+    return df.loc[order.index].reset_index(drop=True)
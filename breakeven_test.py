@@ -0,0 +1,83 @@
+import pytest
+import types
+
+from common import override_configvars
+from breakeven import breakeven
+from city_result import CityResult
+from fake_factors import linear_module
+import location
+from result_set import ResultSet
+
+_LOCS = [location.Location(name, 0, 0) for name in ['a', 'b', 'c']]
+_LINEAR = linear_module()
+_OTHER = types.SimpleNamespace(__name__='other', FACTOR_NAME='Y')
+
+
+def _results(weight):
+    # Totals are 10 + w, 4 + 2w and 3w
+    with override_configvars({'fake_factor_weight': weight}):
+        return ResultSet.from_cells(
+            _LOCS, [_LINEAR, _OTHER], [[1.0, 10.0], [2.0, 4.0], [3.0, 0.0]]
+        )
+
+
+def test_breakeven():
+    df = breakeven(_results(2))
+    assert df.to_dict('records') == [
+        # c overtakes b at w = 4 and a at w = 5, and b overtakes a at w = 6
+        {
+            'Weight': 'fake_factor_weight',
+            'Current': 2,
+            'Leader': 'b',
+            'Trailer': 'c',
+            'Direction': 'above',
+            'Break-even': 4,
+        },
+        {
+            'Weight': 'fake_factor_weight',
+            'Current': 2,
+            'Leader': 'a',
+            'Trailer': 'c',
+            'Direction': 'above',
+            'Break-even': 5,
+        },
+        {
+            'Weight': 'fake_factor_weight',
+            'Current': 2,
+            'Leader': 'a',
+            'Trailer': 'b',
+            'Direction': 'above',
+            'Break-even': 6,
+        },
+    ]
+
+
+def test_breakeven_matches_recomputation():
+    df = breakeven(_results(7))
+    assert len(df) == 3
+    for row in df.to_dict('records'):
+        results = _results(row['Break-even'])
+        totals = dict(zip([loc.name for loc in results.locs], results.totals))
+        assert totals[row['Leader']] == pytest.approx(totals[row['Trailer']])
+
+
+def test_breakeven_parallel():
+    # Equal metrics never change the ranking
+    with override_configvars({'fake_factor_weight': 1}):
+        results = ResultSet.from_cells(
+            _LOCS[:2], [_LINEAR, _OTHER], [[1.0, 0.0], [1.0, 5.0]]
+        )
+    assert breakeven(results).empty
+
+
+def test_breakeven_unsupported():
+    # b's unsupported metric counts as 0, so a overtakes it once the weight is above 20
+    with override_configvars({'fake_factor_weight': 1}):
+        results = ResultSet.from_cells(
+            _LOCS[:2], [_LINEAR, _OTHER], [[1.0, 0.0], [CityResult.UNSUPPORTED, 20.0]]
+        )
+    df = breakeven(results)
+    assert df[['Leader', 'Trailer', 'Direction']].values.tolist() == [
+        ['b', 'a', 'above']
+    ]
+    assert df['Break-even'].tolist() == [20]
@@ -1,11 +1,7 @@
 from common import UnsupportedCityException, MissingConfigVarException, configvar, locs
-import functools
-import pandas as pd
-
-
-class Imputed(float):
-    def __repr__(self):
-        return f'{self.__class__.__name__}({float(self)})'
+import service_area
+import math
+import tracing
 
 
 class Proxy(float):
@@ -27,15 +23,42 @@ def proxies():
     """
 
 
-@functools.total_ordering
+def is_linear(module):
+    """
+    Check whether a factor module's value is a weight times a raw metric of the location.
+
+    Such modules define raw_metric(loc), e.g. the location's Walk Score / 100, and WEIGHT, the
+    configvar that gives the annual dollar value of one unit of the metric. Their annual_value(loc)
+    must equal WEIGHT() * raw_metric(loc). Like annual_values for other modules, they can define a
+    batch raw_metrics(locs) that returns a numpy array with NaN for unsupported locations, and an
+    approximate grid_raw_metrics(locs) for grids (see main.compute_results).
+
+    For these modules we store the raw metric and apply the weight at the end, so changing the
+    weight doesn't require recomputing anything.
+    """
+    return hasattr(module, 'raw_metric') and hasattr(module, 'WEIGHT')
+
+
 class CityResult:
+    """
+    Computes the annual value of each factor module for one location.
+
+    The values of many locations are collected into a result_set.ResultSet.
+    """
+
     UNSUPPORTED = 'UNSUPPORTED'
 
-    def __init__(self, loc, value_modules):
+    def __init__(self, loc, value_modules, precomputed_values=None):
+        """
+        Args:
+            precomputed_values: Optional dict of {module name: annual value} with values that have
+                already been computed for this location, e.g. by a module's batch annual_values
+                function. For linear modules these are raw metrics, e.g. from a batch raw_metrics
+                function. NaN means the location is unsupported.
+        """
         self.loc = loc
         self.value_modules = value_modules
-        self.annual_values = {}
-        self.total_annual_value = 0
+        self.precomputed_values = precomputed_values or {}
 
     def _get_proxy_value(self, module):
         try:
@@ -44,93 +67,43 @@ class CityResult:
             return None
 
         proxy_loc = locs.__dict__[proxy_loc_name]
+        if is_linear(module):
+            return Proxy(module.raw_metric(proxy_loc))
         return Proxy(module.annual_value(proxy_loc))
 
-    def compute(self):
-        annual_values = {}
-        for module in self.value_modules:
+    def compute_value(self, module):
+        """
+        Compute the annual value of a single module for this location.
+
+        For linear modules (see is_linear), this computes the raw metric instead of the value.
+
+        Return: The annual value, a Proxy if it was borrowed from another location, or UNSUPPORTED.
+        """
+        with tracing.span(
+            module.__name__,
+            tracing.CELL,
+            module=module.__name__,
+            location=self.loc.name,
+        ):
             annual_value = self._get_proxy_value(module)
+            if annual_value is None and module.__name__ in self.precomputed_values:
+                annual_value = self.precomputed_values[module.__name__]
+                if math.isnan(annual_value):
+                    annual_value = self.UNSUPPORTED
             if annual_value is None:
                 try:
-                    annual_value = module.annual_value(self.loc)
+                    service_area.check_module(module, self.loc)
+                    if is_linear(module):
+                        annual_value = module.raw_metric(self.loc)
+                    else:
+                        annual_value = module.annual_value(self.loc)
                 except UnsupportedCityException:
                     annual_value = self.UNSUPPORTED
 
-            annual_values.setdefault(module.FACTOR_NAME, []).append(annual_value)
-
-        for k in annual_values:
-            if len(annual_values[k]) == 1:
-                # If it's a Proxy preserve it
-                annual_value = annual_values[k][0]
-            else:
-                annual_values_k = [
-                    v for v in annual_values[k] if v is not self.UNSUPPORTED
-                ]
-                if annual_values_k:
-                    annual_value = sum(annual_values_k) / len(annual_values_k)
-                else:
-                    annual_value = self.UNSUPPORTED
+        return annual_value
 
-            self.annual_values[k] = annual_value
-            if annual_value is not self.UNSUPPORTED:
-                self.total_annual_value += annual_value
-
-    def print(self):
-        print(self.loc.name.upper())
-        for value_name, annual_value in self.annual_values.items():
-            print(f'{value_name + ":":16} ', end='')
-            if annual_value == self.UNSUPPORTED:
-                print('UNSUPPORTED (total will be inaccurate)')
-                continue
-            print(f'{annual_value:8,.0f}', end='')
-            if isinstance(annual_value, Imputed):
-                print(' (IMPUTED)')
-            elif isinstance(annual_value, Proxy):
-                print(' (PROXY)')
-            else:
-                print()
-
-        print(f'{"Total:":16} {self.total_annual_value:8,.0f}')
-        print()
-
-    def __le__(self, other):
-        return self.total_annual_value < other.total_annual_value
-
-    def __eq__(self, other):
-        return self.total_annual_value == other.total_annual_value
-
-    def to_pandas(self):
-        d = self.annual_values.copy()
-        d['Total'] = self.total_annual_value
-        for key in d:
-            if d[key] is self.UNSUPPORTED:
-                d[key] = float('nan')
-        return pd.DataFrame(d, index=[self.loc.name.upper()])
-
-
-# TODO maybe it's better to do this using Pandas?
-def impute_missing_values_with_mean(city_results):
-    sums = {}
-    counts = {}
-    for city_result in city_results:
-        for key, value in city_result.annual_values.items():
-            if value is CityResult.UNSUPPORTED:
-                continue
-            if isinstance(value, Imputed):
-                raise ValueError('Should not re-impute on already imputed results')
-
-            sums.setdefault(key, 0)
-            counts.setdefault(key, 0)
-            sums[key] += value
-            counts[key] += 1
-
-    for city_result in city_results:
-        for key, value in city_result.annual_values.items():
-            if value is CityResult.UNSUPPORTED:
-                mean = sums[key] / counts[key]
-                city_result.annual_values[key] = Imputed(mean)
-                city_result.total_annual_value += mean
-
-
-def to_pandas(city_results: list[CityResult]):
-    return pd.concat(r.to_pandas() for r in city_results)
+    def compute_values(self):
+        """
+        Return: A list with compute_value of each of self.value_modules.
+        """
+        return [self.compute_value(module) for module in self.value_modules]
@@ -13,14 +13,16 @@
 # ---
 
 # %%
-from common import configvar
-from climate import joggability
-import requests
+from common import UnsupportedCityException, configvar
+from climate import joggability, noaa, noaa_best
+import collections
+import geo
+import geohash
+from location import Location
+import numpy as np
 
-# %%
-# This dumb hack seems necessary when tethering on my phone.
-# https://stackoverflow.com/a/46972341/785404
-requests.packages.urllib3.util.connection.HAS_IPV6 = False
+# Geohash precision of the blocks that grid_raw_metrics looks up stations for
+_STATION_BLOCK_PRECISION = 5
 
 
 # %%
@@ -51,10 +53,62 @@ def value_of_good_weather_day():
     """
 
 
+def raw_metric(loc):
+    """Returns the expected number of good weather days in a year at the location."""
+    summary = joggability.can_jog_summary(loc, n=(365 * 5))
+    return 365 * summary.normalized().num_yes
+
+
+def grid_raw_metrics(locs):
+    """
+    Approximate batch version of raw_metric, for dense grids of locations (see
+    main.compute_results).
+
+    Nearby locations are usually served by the same weather station, so the best stations are only
+    looked up once per geohash block of about 5km x 5km, at the block's center. Locations are then
+    grouped by their block's stations and their timezone, and each group's joggable days are
+    counted once, at its first location. Within a group, only sunrise and sunset differ, by a few
+    minutes at most, but that can still change the count slightly. Near the edge of a station's
+    range, a block's center can also get a different station than some of its locations would. So
+    named locations are computed one at a time.
+
+    Return: A numpy array with the raw metric of each location, or NaN where raw_metric would raise
+        UnsupportedCityException.
+    """
+    locs = list(locs)
+    ret = np.full(len(locs), np.nan)
+    tzs = geo.timezone_names([loc.latlon for loc in locs])
+    blocks = collections.defaultdict(list)
+    for i, loc in enumerate(locs):
+        block = geohash.encode(loc.lat, loc.lon, precision=_STATION_BLOCK_PRECISION)
+        blocks[block].append(i)
+
+    groups = collections.defaultdict(list)
+    for block, block_idxs in blocks.items():
+        min_lat, min_lon, max_lat, max_lon = geohash.bounds(block)
+        center = Location(block, (min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+        try:
+            stations = noaa_best.get_best_stations(center)
+        except UnsupportedCityException:
+            continue
+        for i in block_idxs:
+            groups[tuple(stations), tzs[i]].append(i)
+
+    for idxs in groups.values():
+        try:
+            ret[idxs] = raw_metric(locs[idxs[0]])
+        except UnsupportedCityException:
+            pass
+    return ret
+
+
 def annual_value(loc):
     """Returns annualized dollar value of the city's climate."""
-    summary = joggability.can_jog_summary(loc, n=(365 * 5))
-    return value_of_good_weather_day() * 365 * summary.normalized().num_yes
+    return WEIGHT() * raw_metric(loc)
 
 
 FACTOR_NAME = 'Climate'
+WEIGHT = value_of_good_weather_day
+# Parsing NOAA data and checking joggability is CPU-bound, so parallelize over processes
+EXECUTOR = 'process'
+DATASETS = [noaa.noaa_isd_history_csv_parsed, geo._timezone_grid]
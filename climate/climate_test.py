@@ -0,0 +1,30 @@
+import numpy as np
+
+import climate
+from climate import noaa_best
+from common import UnsupportedCityException
+import geo
+import location
+
+
+def test_grid_raw_metrics_looks_up_stations_per_block(monkeypatch):
+    lookups = []
+
+    def get_best_stations(loc):
+        lookups.append(loc.name)
+        if loc.lat < 0:
+            raise UnsupportedCityException()
+        return ['station']
+
+    monkeypatch.setattr(noaa_best, 'get_best_stations', get_best_stations)
+    monkeypatch.setattr(geo, 'timezone_names', lambda latlons: ['tz'] * len(latlons))
+    monkeypatch.setattr(climate, 'raw_metric', lambda loc: loc.lat)
+    # Two points 100m apart share a block, and the third is far away
+    locs = [
+        location.Location('a', 47.6, -122.3),
+        location.Location('b', 47.601, -122.3),
+        location.Location('c', -33.9, 151.2),
+    ]
+    values = climate.grid_raw_metrics(locs)
+    assert len(lookups) == 2
+    np.testing.assert_array_equal(values, [47.6, 47.6, np.nan])
@@ -21,15 +21,8 @@ import collections
 import copy
 import geo
 import more_itertools
-import requests
-import suntime
 import util
 
-# %%
-# This dumb hack seems necessary when tethering on my phone.
-# https://stackoverflow.com/a/46972341/785404
-requests.packages.urllib3.util.connection.HAS_IPV6 = False
-
 
 # %%
 def _sunrises_sunsets(loc, since, until):
@@ -38,6 +31,8 @@ def _sunrises_sunsets(loc, since, until):
 
     Sunrises and sunsets are returned in local time.
     """
+    import suntime
+
     sun = suntime.Sun(*loc)
     tz = geo.city_timezone(loc)
 
@@ -19,17 +19,10 @@ import io
 import gzip
 from haversine import haversine
 import numpy as np
-import pandas as pd
 import re
-import requests
 from typing import Optional, Union
-import functools
 import util
-
-# %%
-# This dumb hack seems necessary when tethering on my phone.
-# https://stackoverflow.com/a/46972341/785404
-requests.packages.urllib3.util.connection.HAS_IPV6 = False
+import tracing
 
 
 # %%
@@ -51,7 +44,8 @@ def _parse_isd_latlon(s):
     return float(s)
 
 
-@functools.cache
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def noaa_isd_history_csv_parsed():
     with util.web_get_to_file(
         'https://noaa-isd-pds.s3.amazonaws.com/isd-history.csv'
@@ -107,6 +101,7 @@ def _combine_noaa_dfs(dfa, dfb):
 
 
 # %%
+@tracing.traced(tracing.DATASET)
 def _noaa_df_for_year(station_id: str, year: int):
     """
     Internal routine to download NOAA data for a single station and year.
@@ -115,6 +110,8 @@ def _noaa_df_for_year(station_id: str, year: int):
     - city_or_stations: e.g. ['997271-99999'] for Manhattan - Battery Park or NEW_YORK to average
       all stations configured for New York.
     """
+    import pandas as pd
+
     UNKNOWN = -9999
     # We use this S3 mirror of https://www1.ncdc.noaa.gov/pub/data/noaa/isd-lite because the original site
     # has reliability problems.
@@ -180,6 +177,8 @@ def noaa_df(
     - begin_year: First year to download data for.
     - end_year: Last year to download data for (inclusive). If None, only data for begin_year will be returned.
     """
+    import pandas as pd
+
     if isinstance(station_ids, str):
         station_ids = [station_ids]
 
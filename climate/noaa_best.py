@@ -21,7 +21,7 @@ while also having good data availability/quality.
 """
 
 # %%
-from common import logger
+from common import UnsupportedCityException, logger
 from climate.noaa import (
     noaa_df as orig_noaa_df,
     closest_noaa_stations,
@@ -29,7 +29,6 @@ from climate.noaa import (
     annual_rainfall as orig_annual_rainfall,
 )
 import functools
-import requests
 from typing import Optional, Union
 import location
 from time_util import today
@@ -39,17 +38,15 @@ from climate._util import parse_since_until_n
 import geo
 import util
 
-# %%
-# This dumb hack seems necessary when tethering on my phone.
-# https://stackoverflow.com/a/46972341/785404
-requests.packages.urllib3.util.connection.HAS_IPV6 = False
-
 # %%
 today().year
 
 
 # %%
-@util.cache_on_disk
+# Keyed on the lat/lon so that renaming a location keeps its stations. Results for nearby points
+# aren't reused: checking that a nearby point's station is still the best one for this point would
+# mean loading the data of every station closer to it, which is most of the work.
+@util.cache_on_disk_spatially()
 def get_best_stations(loc):
     """
     Get best stations near a location.
@@ -121,7 +118,7 @@ def get_best_stations(loc):
             )
             return [station_id]
 
-    raise RuntimeError("Didn't find any good stations")
+    raise UnsupportedCityException(f"Didn't find any good stations near {loc}")
 
 
 # %% tags=["active-ipynb"]
@@ -12,7 +12,9 @@
 # ---
 
 # %%
-from common import UnsupportedCityException
+from common import UnsupportedCityException, config_cache
+import service_area
+import finance
 from finance import (
     annual_income,
     DISCOUNT_RATE_PCT,
@@ -20,21 +22,25 @@ from finance import (
     annual_us_real_gdp_per_capita_growth,
 )
 import geo
-import pandas as pd
+import numpy as np
 from io import StringIO
 import functools
 import itertools
 from time_util import today
 import util
+import tracing
 
 
 # %%
-@functools.cache
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def _get_hsiang_impactlab_df_inner(path):
     """Get estimated economic impact of climate change.
 
     Get a dataframe corresponding to graphic 2i in the 2017 paper "Estimating economic damage from climate change in the United States" by Hsiang et al.
     """
+    import pandas as pd
+
     data = util.web_get(f'http://impactlab.org/wp-content/uploads/{path}').text
     # strip some weird garbage off the start of the file
     for i, c in enumerate(data):
@@ -55,8 +61,10 @@ get_hsiang_decile_damage_df = functools.partial(
 )
 
 
-@functools.cache
+@util.locked_cache
 def get_hsiang_regional_weights_df():
+    import pandas as pd
+
     record_id = 581238
     filename = 'allweights.csv'
     data = util.web_get(
@@ -68,6 +76,7 @@ def get_hsiang_regional_weights_df():
 
 # %%
 def _get_hsiang_sector_damage_row(loc):
+    service_area.check_region(SUPPORTED_REGION, loc)
     state_code = geo.city_to_state_code(loc)
     county_name = geo.city_to_county(loc)
     df = get_hsiang_sector_damage_df()
@@ -107,7 +116,7 @@ def gdp_per_capita_2012(loc):
 
 
 # %%
-@functools.cache
+@config_cache
 def _scale_factor():
     current_year = today().year
     pv_tot = 0
@@ -133,6 +142,14 @@ def _scale_factor():
 
 # %%
 FACTOR_NAME = 'Climate Change'
+SUPPORTED_REGION = 'us'
+DATASETS = [
+    get_hsiang_sector_damage_df,
+    geo._counties_index,
+    service_area._us_outline,
+    finance._gdp_growth_df,
+    finance._population_df,
+]
 
 
 # TODO this is pretty bad in many ways
@@ -141,18 +158,46 @@ FACTOR_NAME = 'Climate Change'
 #   - most of the damages are mortality, and the value you assign to your life is proportional to
 #     income, so this is not bad, but we could improve by using some config var for microlife or compute it somehow
 # - probably shoddy finance math, should double-check by picking coworkers' brains
-# - lots of uncertainty (need to build a mechanism for sensitivity analysis)
+# - lots of uncertainty (see main.py sensitivity for a way to explore it)
 #
 # One specific weird thing that this does is assign a value of -1.6k / year to SF and -6.3k / year to Berkeley;
 # it seems like their values should be more similar.
 def annual_value(loc):
     try:
         return -median_climate_damage_2090_pct(loc) * _scale_factor()
-    except ValueError:
+    except (ValueError, geo.NoCountyException):
         # TODO: This ValueError catch is kinda broad
         raise UnsupportedCityException(f"Can't compute climate change value for {loc}")
 
 
+def annual_values(locs):
+    """
+    Batch version of annual_value.
+
+    Counties for all locations are looked up together, and each county's damage is found once, so
+    this is much faster than calling annual_value for each location.
+
+    Return: A numpy array with the annual value of each location, or NaN where annual_value would
+        raise UnsupportedCityException.
+    """
+    latlons = np.array([loc.latlon for loc in locs], dtype=float).reshape(-1, 2)
+    ret = np.full(len(latlons), np.nan)
+
+    points = np.flatnonzero(service_area.covers(SUPPORTED_REGION, latlons))
+    df = get_hsiang_sector_damage_df()
+    damages = (
+        df.groupby(['State Code', 'County Name'])['Total damages (% county income)']
+        # Like _get_hsiang_sector_damage_row, don't guess between multiple matches
+        .agg(lambda rows: rows.iloc[0] if len(rows) == 1 else np.nan)
+        .to_dict()
+    )
+    scale_factor = _scale_factor()
+    for i, county in zip(points, geo.counties(latlons[points])):
+        if county is not None:
+            ret[i] = -damages.get(county, np.nan) * scale_factor
+    return ret
+
+
 # %% tags=["active-ipynb"]
 # print(f'{annual_value(locs.des_moines)=}')
 # print(f'{annual_value(locs.new_york)=}')
@@ -1,6 +1,9 @@
+import contextlib
+import contextvars
 import logging
 from ruamel.yaml import YAML
 import io
+import types
 
 logger = logging.getLogger('where_to_live')
 logger.setLevel(logging.INFO)
@@ -66,6 +69,177 @@ def _yaml_dumps(v):
 _NO_DEFAULT = 'NO_DEFAULT'
 
 
+def config_dir():
+    """
+    Return: The directory with the config files. It's config/ in the repo, unless the
+        WHERE_TO_LIVE_CONFIG_DIR environment variable names another one, e.g. in tests.
+    """
+    import os
+    from pathlib import Path
+
+    return Path(
+        os.environ.get('WHERE_TO_LIVE_CONFIG_DIR') or Path(__file__).parent / 'config'
+    )
+
+
+def _config_paths(name):
+    yaml_path = config_dir() / (name + '.yaml')
+    return yaml_path, yaml_path.with_suffix('.py')
+
+
+def config_fingerprint(name):
+    """
+    Hash the config files that determine the value of a configvar.
+
+    Return: A hex digest, which changes whenever the configvar's file is created, edited or
+        deleted. A .py config can read other configs, so it is hashed together with the rest of the
+        config directory.
+    """
+    import hashlib
+
+    yaml_path, py_path = _config_paths(name)
+    paths = [yaml_path, py_path]
+    if py_path.exists():
+        paths += sorted(p for p in py_path.parent.iterdir() if p.is_file())
+
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(str(path).encode() + b'\0')
+        if path.exists():
+            h.update(path.read_bytes())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+# Set of names of the configvars read in the current context, see record_configvar_reads
+_configvar_reads = contextvars.ContextVar('_configvar_reads', default=None)
+
+
+@contextlib.contextmanager
+def record_configvar_reads():
+    """
+    Record the names of the (non-eager) configvars read inside the with block.
+
+    Example usage:
+        with record_configvar_reads() as reads:
+            value = module.annual_value(loc)
+        # reads is now e.g. {'value_of_walkability'}
+
+    Reads are recorded per thread, so this can be used from several threads at once. Reads inside
+    a nested with block also count for the enclosing one.
+    """
+    reads = set()
+    token = _configvar_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _configvar_reads.reset(token)
+        mark_configvars_read(reads)
+
+
+# Read-only dict of {configvar name: value} used instead of config files, see override_configvars
+_configvar_overrides = contextvars.ContextVar(
+    '_configvar_overrides', default=types.MappingProxyType({})
+)
+
+
+@contextlib.contextmanager
+def override_configvars(overrides):
+    """
+    Use the given values for configvars inside the with block, instead of reading config files.
+
+    Values are given as they would be written in the configvar's YAML file, e.g.
+    {'value_of_walkability': 5000}. Like record_configvar_reads, overrides only apply to the current
+    thread (and to threads running a copy of its context), so concurrent requests can each use
+    their own overrides. They don't apply to eager configvars.
+    """
+    token = _configvar_overrides.set(
+        types.MappingProxyType(_configvar_overrides.get() | dict(overrides))
+    )
+    try:
+        yield
+    finally:
+        _configvar_overrides.reset(token)
+
+
+def overridden_configvars():
+    """
+    Return: The names of the configvars overridden in the current context.
+    """
+    return _configvar_overrides.get().keys()
+
+
+def mark_configvars_read(names):
+    """
+    Count the given configvars as read for record_configvar_reads, e.g. when reusing a value that
+    was computed from them elsewhere.
+    """
+    if (reads := _configvar_reads.get()) is not None:
+        reads.update(names)
+
+
+# Functions that drop cached state derived from a set of configvars, see invalidate_configvars
+_invalidators = []
+
+
+def invalidate_configvars(names):
+    """
+    Reload the given configvars the next time they are read, e.g. after their files are edited.
+
+    Entries of config_cache functions that read any of them are dropped too. Eager configvars
+    are reloaded immediately; their values are updated in place if they are namespaces (like
+    locs), and otherwise a restart is needed to see the new value.
+    """
+    names = set(names)
+    for invalidate in _invalidators:
+        invalidate(names)
+
+
+def on_invalidate_configvars(f):
+    """
+    Decorator that registers f(names) to be called by invalidate_configvars, to drop state that
+    may be derived from the given configvars.
+    """
+    _invalidators.append(f)
+    return f
+
+
+def config_cache(f):
+    """
+    Like functools.cache, for functions whose results are derived from configvars.
+
+    Entries are dropped by invalidate_configvars when a configvar they read changes, and cache hits
+    still count as reads of those configvars for record_configvar_reads. Results that depend on
+    overridden configvars (see override_configvars) are not cached.
+    """
+    import functools
+
+    cache = {}
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        entry = cache.get(key)
+        if entry is None or entry[1] & overridden_configvars():
+            with record_configvar_reads() as reads:
+                value = f(*args, **kwargs)
+            if not reads & overridden_configvars():
+                cache[key] = value, reads
+        else:
+            value, reads = entry
+        mark_configvars_read(reads)
+        return value
+
+    def invalidate(names):
+        for key, (_, reads) in list(cache.items()):
+            if reads & names:
+                cache.pop(key, None)
+
+    _invalidators.append(invalidate)
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
 def _config(
     name,
     *,
@@ -77,13 +251,9 @@ def _config(
     """
     Evaluate a configvar.
     """
-    from pathlib import Path
-    import inspect
-
     globals = globals or {}
 
-    yaml_path = Path(__file__).parent / 'config' / (name + '.yaml')
-    py_path = yaml_path.with_suffix('.py')
+    yaml_path, py_path = _config_paths(name)
 
     yaml_path_exists = yaml_path.exists()
     py_path_exists = py_path.exists()
@@ -95,6 +265,8 @@ def _config(
         yaml_path_exists = True
 
     if not yaml_path_exists and not py_path_exists:
+        import inspect
+
         doc = doc_fn()
         doc = inspect.cleandoc(doc)
 
@@ -165,21 +337,57 @@ def configvar(
     globals = globals or {}
 
     def decorator(f):
-        @functools.wraps(f)
         @functools.lru_cache()
-        def decorated():
+        def load():
             def doc_fn():
                 if return_doc:
                     return f()
                 else:
                     return f.__doc__
 
-            return _config(
-                f.__name__, doc_fn=doc_fn, type=type, default=default, globals=globals
-            )
+            try:
+                return _config(
+                    f.__name__,
+                    doc_fn=doc_fn,
+                    type=type,
+                    default=default,
+                    globals=globals,
+                ), None
+            except MissingConfigVarException as e:
+                # Optional configvars (e.g. proxies) are read for every location, so cache that
+                # they're missing too. invalidate_configvars clears this when the file is created.
+                return None, str(e)
+
+        @functools.wraps(f)
+        def decorated():
+            mark_configvars_read([f.__name__])
+            overrides = _configvar_overrides.get()
+            if f.__name__ in overrides:
+                return type(overrides[f.__name__])
+            value, missing = load()
+            if missing is not None:
+                raise MissingConfigVarException(missing)
+            return value
+
+        decorated.cache_clear = load.cache_clear
+
+        def invalidate(names):
+            if f.__name__ not in names:
+                return
+            load.cache_clear()
+            if not eager:
+                return
+            if isinstance(value, types.SimpleNamespace):
+                vars(value).clear()
+                vars(value).update(vars(decorated()))
+            else:
+                logger.warning(f'{f.__name__} changed; restart to use the new value')
+
+        _invalidators.append(invalidate)
 
         if eager:
-            return decorated()
+            value = decorated()
+            return value
         else:
             return decorated
 
@@ -196,7 +404,6 @@ def configvar(
 
 
 def _process_locations(locations_dict):
-    import types
     import location
 
     ret = types.SimpleNamespace()
@@ -228,5 +435,14 @@ __all__ = [
     'UnsupportedCityException',
     'MissingConfigVarException',
     'configvar',
+    'config_dir',
+    'config_fingerprint',
+    'record_configvar_reads',
+    'mark_configvars_read',
+    'invalidate_configvars',
+    'on_invalidate_configvars',
+    'override_configvars',
+    'overridden_configvars',
+    'config_cache',
     'locs',
 ]
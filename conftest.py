@@ -0,0 +1,19 @@
+"""
+Point the configvars at a temporary config directory, so that tests don't depend on config/.
+"""
+
+import os
+import pathlib
+import shutil
+import tempfile
+
+# Set before any test module imports common, which reads the locs configvar on import
+_config_dir = pathlib.Path(tempfile.mkdtemp(prefix='where_to_live_test_config.'))
+(_config_dir / 'locs.yaml').write_text(
+    'seattle: [47.60743693357695, -122.33797497331248]\n'
+)
+os.environ['WHERE_TO_LIVE_CONFIG_DIR'] = str(_config_dir)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_config_dir, ignore_errors=True)
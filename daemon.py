@@ -0,0 +1,229 @@
+"""
+Serve scores from a long-lived process, so that datasets are loaded once rather than by every
+notebook and script.
+
+Start the server with `./main.sh daemon`, then from a notebook or script:
+
+    import daemon
+    daemon.score([(47.61, -122.34), locs.new_york], overrides={'value_of_walkability': 5000})
+
+The server only listens on localhost. It has these endpoints:
+
+    GET /health returns {"ok": true}.
+
+    POST /score takes a JSON object like
+
+        {
+            "locations": [[47.61, -122.34], {"name": "new_york", "lat": 40.71, "lon": -74.01}],
+            "overrides": {"value_of_walkability": 5000},
+            "impute": false
+        }
+
+    where overrides (configvar values, as they would be written in YAML) and impute are optional.
+    It returns {"results": [...]} with one object per location, in the order given, like
+
+        {
+            "name": "new_york", "lat": 40.71, "lon": -74.01, "total": -41000.0,
+            "values": {"Housing": -46000.0, "Walkability": 5000.0, "Climate Change": null},
+            "status": {"Housing": "ok", "Walkability": "ok", "Climate Change": "unsupported"}
+        }
+
+    GET /tiles/LAYER/Z/X/Y.png?vmin=...&vmax=... returns a PNG map tile of a factor (or the total,
+    if LAYER is Total) from tiles.py, colored from red at vmin to green at vmax. Use
+    tiles.folium_layer to show tiles on a folium map.
+
+    Errors are returned as {"error": "..."} with a 4xx or 5xx status.
+"""
+
+from common import logger, override_configvars
+import http.server
+import json
+import location
+from result_set import Status
+import tiles
+import traceback
+import urllib.parse
+
+DEFAULT_PORT = 8765
+DEFAULT_URL = f'http://127.0.0.1:{DEFAULT_PORT}'
+
+
+def _parse_location(obj):
+    if isinstance(obj, dict):
+        lat, lon = float(obj['lat']), float(obj['lon'])
+        return location.Location(obj.get('name') or f'{lat},{lon}', lat, lon)
+    lat, lon = map(float, obj)
+    return location.Location(f'{lat},{lon}', lat, lon)
+
+
+def _results_json(results):
+    return [
+        {
+            'name': loc.name,
+            'lat': loc.lat,
+            'lon': loc.lon,
+            'total': float(total),
+            'values': {
+                factor: None if s == Status.UNSUPPORTED else float(value)
+                for factor, value, s in zip(results.factors, values, status)
+            },
+            'status': {
+                factor: Status(s).name.lower()
+                for factor, s in zip(results.factors, status)
+            },
+        }
+        for loc, values, status, total in zip(
+            results.locs, results.values, results.status, results.totals
+        )
+    ]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def _send(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path)
+        if path.path == '/health':
+            self._send(200, {'ok': True})
+        elif path.path.startswith('/tiles/') and self.server.tile is not None:
+            self._send_tile(path)
+        else:
+            self._send(404, {'error': f'No such endpoint {self.path}'})
+
+    def _send_tile(self, path):
+        try:
+            layer, z, x, y = path.path.removeprefix('/tiles/').split('/')
+            layer = urllib.parse.unquote(layer)
+            z, x, y = int(z), int(x), int(y.removesuffix('.png'))
+            query = urllib.parse.parse_qs(path.query)
+            vmin, vmax = float(query['vmin'][0]), float(query['vmax'][0])
+        except (KeyError, ValueError) as e:
+            self._send(400, {'error': f'Bad request: {e!r}'})
+            return
+
+        try:
+            results = self.server.tile(z, x, y)
+        except Exception as e:
+            # Tell the client what went wrong, and let _Server.handle_error log it
+            self._send(500, {'error': ''.join(traceback.format_exception_only(e))})
+            raise
+        if layer != 'Total' and layer not in results.factors:
+            self._send(400, {'error': f'No such layer {layer!r}'})
+            return
+
+        body = tiles.tile_png(results, layer, vmin, vmax)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._send(404, {'error': f'No such endpoint {self.path}'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            locs = [_parse_location(obj) for obj in request['locations']]
+            overrides = dict(request.get('overrides') or {})
+            impute = bool(request.get('impute', False))
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {'error': f'Bad request: {e!r}'})
+            return
+
+        try:
+            with override_configvars(overrides):
+                results = self.server.compute(locs, impute=impute)
+        except Exception as e:
+            self._send(500, {'error': ''.join(traceback.format_exception_only(e))})
+            raise
+
+        # Results come back sorted by value, so put them back in request order
+        self._send(200, {'results': _results_json(results.select(locs))})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Called while handling an exception raised by _Handler, instead of printing it to stderr
+        logger.exception('Error handling a request from %s:%s', *client_address)
+
+
+def make_server(compute, port=DEFAULT_PORT, tile=None):
+    """
+    Create a server on localhost that scores locations with compute.
+
+    Args:
+        compute: A function like main.compute_results, called as compute(locs, impute=impute), that
+            returns a ResultSet.
+        port: Port to listen on. 0 picks a free port, which is then available as
+            server.server_port.
+        tile: Optional function like tiles.tile, called as tile(z, x, y), that returns the
+            ResultSet of a map tile. Without it, the /tiles endpoint isn't served.
+    """
+    server = _Server(('127.0.0.1', port), _Handler)
+    server.compute = compute
+    server.tile = tile
+    return server
+
+
+def serve(compute, port=DEFAULT_PORT, tile=None):
+    """
+    Serve requests until interrupted. See make_server for the arguments.
+    """
+    with make_server(compute, port, tile) as server:
+        logger.info(f'Serving scores on http://127.0.0.1:{server.server_port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def score(locations, overrides=None, impute=False, url=DEFAULT_URL):
+    """
+    Score locations with a running daemon.
+
+    Args:
+        locations: Location objects or (lat, lon) pairs.
+        overrides: Optional dict of {configvar name: value} to use instead of the daemon's config,
+            for this request only.
+        impute: If True, impute unsupported values using the mean of the given locations.
+
+    Return: A DataFrame in the same format as main.compute_results_pd, but with rows in the order
+        given: one row per location, a column per factor with NaN where the factor is
+        unsupported, and a Total column.
+    """
+    import pandas as pd
+    import requests
+
+    request = {
+        'locations': [
+            {'name': loc.name, 'lat': loc.lat, 'lon': loc.lon}
+            if isinstance(loc, location.Location)
+            else list(loc)
+            for loc in locations
+        ],
+        'overrides': overrides or {},
+        'impute': impute,
+    }
+    resp = requests.post(f'{url}/score', json=request)
+    if not resp.ok:
+        raise RuntimeError(
+            f'Daemon returned {resp.status_code}: {resp.json()["error"]}'
+        )
+
+    results = resp.json()['results']
+    return pd.DataFrame(
+        [result['values'] | {'Total': result['total']} for result in results],
+        index=[result['name'].upper() for result in results],
+        dtype=float,
+    )
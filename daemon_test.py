@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+import requests
+
+import city_result
+from common import override_configvars
+import daemon
+from fake_factors import linear_module
+from result_set import ResultSet
+import tiles
+
+
+def _raw_metric(loc):
+    if loc.lat < 0:
+        raise city_result.UnsupportedCityException('Southern hemisphere')
+    return loc.lat
+
+
+_MODULE = linear_module('daemon_test_module', 'Test', raw_metric=_raw_metric)
+
+
+def _compute(locs, impute=False):
+    cells = [city_result.CityResult(loc, [_MODULE]).compute_values() for loc in locs]
+    results = ResultSet.from_cells(locs, [_MODULE], cells)
+    if impute:
+        results = results.impute_missing_values_with_mean()
+    return results.sorted()
+
+
+@pytest.fixture
+def url():
+    with daemon.make_server(_compute, port=0) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield f'http://127.0.0.1:{server.server_port}'
+        server.shutdown()
+        thread.join()
+
+
+def test_score(url):
+    df = daemon.score(
+        [(2, 0), (-1, 5), (1, 0)], overrides={'fake_factor_weight': 10}, url=url
+    )
+    assert df.index.tolist() == ['2.0,0.0', '-1.0,5.0', '1.0,0.0']
+    assert df.Test.tolist()[::2] == [20, 10]
+    assert df.Test.isna().tolist() == [False, True, False]
+
+    df = daemon.score(
+        [(2, 0), (-1, 5)], overrides={'fake_factor_weight': 1}, impute=True, url=url
+    )
+    assert df.Total.tolist() == [2, 2]
+
+
+def test_score_error(url):
+    # The configvar has no config file, so it must be overridden
+    with pytest.raises(RuntimeError, match='MissingConfigVarException'):
+        daemon.score([(1, 0)], url=url)
+
+
+def test_tiles():
+    def tile(z, x, y):
+        locs = tiles.tile_locations(z, x, y)
+        with override_configvars({'fake_factor_weight': 1}):
+            return _compute(locs).select(locs)
+
+    with daemon.make_server(_compute, port=0, tile=tile) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            resp = requests.get(f'{url}/tiles/Test/3/1/2.png?vmin=0&vmax=90')
+            assert resp.status_code == 200
+            assert resp.headers['Content-Type'] == 'image/png'
+            assert resp.content.startswith(b'\x89PNG')
+
+            resp = requests.get(f'{url}/tiles/Nope/3/1/2.png?vmin=0&vmax=90')
+            assert resp.status_code == 400
+            resp = requests.get(f'{url}/tiles/Test/3/1/2.png')
+            assert resp.status_code == 400
+        finally:
+            server.shutdown()
+            thread.join()
@@ -0,0 +1,257 @@
+"""
+Compute the values of CityResults in parallel.
+
+Each (location, module) cell is independent, so cells are spread over a pool of workers. Modules
+that are I/O-bound (web APIs, downloads) run on threads. CPU-bound modules can declare
+EXECUTOR = 'process' to run in worker processes instead. Each worker process loads those modules'
+DATASETS (see prefetch.py) when it starts, so the parent process doesn't need to load them.
+"""
+
+from city_result import CityResult
+from common import (
+    mark_configvars_read,
+    on_invalidate_configvars,
+    overridden_configvars,
+    record_configvar_reads,
+)
+import concurrent.futures
+import contextvars
+import functools
+import importlib
+import prefetch
+import result_store
+import threading
+import tracing
+
+BACKENDS = ['auto', 'thread', 'process']
+
+
+def runs_in_processes(module, jobs=1, backend='auto'):
+    """
+    Return: Whether compute_all computes the module's cells in worker processes, unless they're
+        precomputed. See compute_all for the meaning of jobs and backend.
+    """
+    # Configvar overrides don't reach worker processes
+    if jobs == 1 or overridden_configvars():
+        return False
+    if backend == 'auto':
+        return getattr(module, 'EXECUTOR', 'thread') == 'process'
+    return backend == 'process'
+
+
+def _compute_value(result, module):
+    """
+    Return: The value of the cell, the names of the configvars read to compute it, and None (see
+        _compute_value_in_subprocess).
+    """
+    with record_configvar_reads() as reads:
+        value = result.compute_value(module)
+    return value, reads, None
+
+
+def _compute_value_in_subprocess(module_name, loc, precomputed_values, record_spans):
+    """
+    Like _compute_value, but also return the tracing spans recorded while computing the cell, if
+    record_spans is True.
+    """
+    module = importlib.import_module(module_name)
+    result = CityResult(loc, [module], precomputed_values)
+    if not record_spans:
+        return _compute_value(result, module)
+    with tracing.record() as trace:
+        value, reads, _ = _compute_value(result, module)
+    return value, reads, trace.spans
+
+
+def _completed(value):
+    future = concurrent.futures.Future()
+    future.set_result(value)
+    return future
+
+
+class _Deferred:
+    """A task that runs in the calling thread once its result is asked for, like a Future."""
+
+    def __init__(self, fn, /, *args):
+        self._call = functools.partial(fn, *args)
+
+    def result(self):
+        return self._call()
+
+    def cancel(self):
+        return False
+
+
+class _SerialExecutor:
+    def submit(self, fn, /, *args):
+        return _Deferred(fn, *args)
+
+
+# Worker pools by number of workers. They live as long as this process, so that commands that
+# compute many times (like watch and daemon) don't pay for starting workers, and worker processes
+# keep the datasets they've loaded.
+_pools_lock = threading.Lock()
+_thread_pools = {}
+# Values are (sorted names of the modules whose datasets the workers load, pool)
+_process_pools = {}
+
+
+def _thread_pool(jobs):
+    with _pools_lock:
+        if jobs not in _thread_pools:
+            _thread_pools[jobs] = concurrent.futures.ThreadPoolExecutor(jobs)
+        return _thread_pools[jobs]
+
+
+def _load_datasets(module_names):
+    prefetch.prefetch(
+        prefetch.module_datasets(
+            [importlib.import_module(name) for name in module_names]
+        )
+    )
+
+
+def _process_pool(jobs, module_names):
+    """
+    Return: A process pool with jobs workers that have loaded the datasets of the given modules.
+    """
+    import multiprocessing
+
+    with _pools_lock:
+        names, pool = _process_pools.get(jobs, (None, None))
+        if names != module_names:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            # Use spawn rather than fork because the HTTP and computation caches hold sqlite
+            # connections that must not be shared with a child process.
+            pool = concurrent.futures.ProcessPoolExecutor(
+                jobs,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_load_datasets,
+                initargs=(module_names,),
+            )
+            _process_pools[jobs] = module_names, pool
+        return pool
+
+
+def _drop_process_pools():
+    """
+    Start new worker processes the next time they're needed. Cells already submitted to the old
+    ones still finish.
+    """
+    with _pools_lock:
+        pools = [pool for _, pool in _process_pools.values()]
+        _process_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False)
+
+
+@on_invalidate_configvars
+def _drop_stale_process_pools(names):
+    # Worker processes keep the configvars they've read, and don't hear about edits
+    _drop_process_pools()
+
+
+def compute_all(
+    city_results, jobs=1, backend='auto', store=None, precomputed_reads=None
+):
+    """
+    Compute the value of each module for each of the given CityResults.
+
+    Results are identical to computing serially. If any cell raises, the exception from the first
+    failing cell (in city then module order) is re-raised with a note saying which cell it was.
+
+    Args:
+        jobs: Number of worker threads and (separately) worker processes. 1 computes everything
+            serially in this thread. Workers are started on first use and reused by later calls.
+        backend: One of BACKENDS. 'auto' uses each module's EXECUTOR attribute, defaulting to
+            'thread'. Everything runs on threads while configvars are overridden (see
+            common.override_configvars), since overrides don't reach worker processes.
+        store: Optional result_store.ResultStore. Cells with an up-to-date value in the store are
+            not recomputed, and recomputed cells are written back to it.
+        precomputed_reads: Optional dict of {module name: set of configvar names} that were read
+            while computing the CityResults' precomputed_values for that module.
+
+    Return: For each CityResult, the list of values returned by its compute_values().
+    """
+    precomputed_reads = precomputed_reads or {}
+    threads = _SerialExecutor() if jobs == 1 else _thread_pool(jobs)
+    # Worker processes are started when the first cell is submitted to them
+    processes = None
+    process_modules = sorted(
+        {
+            module.__name__
+            for result in city_results
+            for module in result.value_modules
+            if module.__name__ not in result.precomputed_values
+            and runs_in_processes(module, jobs, backend)
+        }
+    )
+    cells = []
+    try:
+        for result in city_results:
+            row = []
+            for module in result.value_modules:
+                stored = (
+                    result_store.MISSING
+                    if store is None
+                    else store.get(module.__name__, result.loc)
+                )
+                if stored is not result_store.MISSING:
+                    future = _completed((stored, None, None))
+                elif module.__name__ in result.precomputed_values:
+                    future = threads.submit(
+                        contextvars.copy_context().run, _compute_value, result, module
+                    )
+                elif runs_in_processes(module, jobs, backend):
+                    if processes is None:
+                        processes = _process_pool(jobs, process_modules)
+                    future = processes.submit(
+                        _compute_value_in_subprocess,
+                        module.__name__,
+                        result.loc,
+                        result.precomputed_values,
+                        tracing.recording(),
+                    )
+                else:
+                    future = threads.submit(
+                        contextvars.copy_context().run, _compute_value, result, module
+                    )
+                row.append(future)
+            cells.append(row)
+
+        ret = []
+        for result, row in zip(city_results, cells):
+            values = []
+            for module, future in zip(result.value_modules, row):
+                try:
+                    value, reads, spans = future.result()
+                except Exception as e:
+                    # i.e. a BrokenProcessPool, since thread pools have no initializer to fail
+                    if isinstance(e, concurrent.futures.BrokenExecutor):
+                        # Don't fail every later call too
+                        _drop_process_pools()
+                    e.add_note(f'while computing {module.__name__} for {result.loc}')
+                    raise
+                if spans is not None:
+                    # Likewise, spans in worker processes aren't seen by tracing.record here
+                    tracing.add(spans)
+                if reads is not None:
+                    # Reads in worker processes aren't seen by record_configvar_reads here
+                    mark_configvars_read(reads)
+                if store is not None and reads is not None:
+                    if module.__name__ in result.precomputed_values:
+                        reads |= precomputed_reads.get(module.__name__, set())
+                    store.put(module.__name__, result.loc, value, reads)
+                # The UNSUPPORTED sentinel is compared by identity, so restore it after pickling
+                if value == CityResult.UNSUPPORTED:
+                    value = CityResult.UNSUPPORTED
+                values.append(value)
+            ret.append(values)
+
+        return ret
+    finally:
+        # After an error, don't leave the rest of the cells occupying the shared pools
+        for row in cells:
+            for future in row:
+                future.cancel()
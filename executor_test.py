@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import types
+
+import pytest
+
+from city_result import CityResult
+from common import UnsupportedCityException, invalidate_configvars
+import executor
+import location
+
+# This module doubles as a factor module whose cells run in worker processes
+FACTOR_NAME = 'Worker pid'
+EXECUTOR = 'process'
+_loaded_datasets = []
+
+
+def _load_dataset():
+    _loaded_datasets.append(os.getpid())
+
+
+DATASETS = [_load_dataset]
+
+
+def annual_value(loc):
+    # Worker processes load the datasets before computing any cells
+    assert _loaded_datasets == [os.getpid()]
+    return os.getpid()
+
+
+def _lat(loc):
+    # Later cells finish first
+    time.sleep((5 - loc.lat) / 100)
+    if loc.lat > 3:
+        raise UnsupportedCityException()
+    return loc.lat
+
+
+def _fail(loc):
+    if loc.lat > 1:
+        raise ValueError(loc.name)
+    return 0
+
+
+_LAT = types.SimpleNamespace(__name__='lat', FACTOR_NAME='Lat', annual_value=_lat)
+_FAIL = types.SimpleNamespace(__name__='fail', FACTOR_NAME='Fail', annual_value=_fail)
+_LOCS = [location.Location(name, i, 0.0) for i, name in enumerate('abcde')]
+
+
+def _compute(modules, **kwargs):
+    return executor.compute_all(
+        [CityResult(loc, modules) for loc in _LOCS], backend='thread', **kwargs
+    )
+
+
+def test_parallel_matches_serial():
+    expected = [[0], [1], [2], [3], [CityResult.UNSUPPORTED]]
+    assert _compute([_LAT], jobs=1) == expected
+    for _ in range(3):
+        values = _compute([_LAT], jobs=4)
+        assert values == expected
+        assert values[-1][0] is CityResult.UNSUPPORTED
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_first_failing_cell_is_raised(jobs):
+    with pytest.raises(ValueError) as exc_info:
+        _compute([_LAT, _FAIL], jobs=jobs)
+    assert str(exc_info.value) == 'c'
+    assert exc_info.value.__notes__ == ['while computing fail for c']
+
+
+def test_process_workers_are_reused():
+    module = sys.modules[__name__]
+    city_results = [CityResult(loc, [module]) for loc in _LOCS]
+
+    def pids():
+        values = executor.compute_all(city_results, jobs=2)
+        return {value for (value,) in values}
+
+    first = pids()
+    assert os.getpid() not in first
+    assert pids() <= first
+    # Workers don't see config edits, so they're replaced
+    invalidate_configvars(['_executor_test_var'])
+    assert not pids() & first
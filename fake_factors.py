@@ -0,0 +1,28 @@
+"""
+Fake factor modules for tests, so that they don't depend on datasets or web services.
+"""
+
+import types
+
+from common import configvar
+
+
+@configvar(type=float)
+def fake_factor_weight():
+    """The weight of linear_module()s. Only set by overrides in tests."""
+
+
+def linear_module(name='linear', factor_name='X', raw_metric=None):
+    """
+    Return: A fake linear factor module (see city_result.is_linear), weighted by fake_factor_weight.
+
+    Args:
+        raw_metric: The module's raw_metric(loc). Leave it out for modules whose cells are passed
+            to ResultSet.from_cells directly.
+    """
+    return types.SimpleNamespace(
+        __name__=name,
+        FACTOR_NAME=factor_name,
+        raw_metric=raw_metric,
+        WEIGHT=fake_factor_weight,
+    )
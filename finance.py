@@ -15,10 +15,9 @@
 # %%
 import math
 from common import configvar
-import pandas as pd
 import io
-import functools
 import util
+import tracing
 
 
 # %%
@@ -54,6 +53,8 @@ def capital_to_annual_dollars(c):
 
 # %%
 def _gdp_growth_df_raw():
+    import pandas as pd
+
     return pd.read_csv(
         io.StringIO(
             util.web_get('https://a.usafacts.org/api/v4/Metrics/csv/116290').text
@@ -61,7 +62,8 @@ def _gdp_growth_df_raw():
     )
 
 
-@functools.cache
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def _gdp_growth_df():
     df = _gdp_growth_df_raw()[:1].set_index('Years').T
     df.index = df.index.astype('int')
@@ -71,7 +73,7 @@ def _gdp_growth_df():
     return df
 
 
-@functools.cache
+@util.locked_cache
 def annual_us_real_gdp_growth():
     """
     Compute the average annual US real GDP growth, where e.g. 0.03 means 3% annual growth.
@@ -83,6 +85,8 @@ def annual_us_real_gdp_growth():
 
 # %%
 def _inflation_df_raw():
+    import pandas as pd
+
     return pd.read_csv(
         io.StringIO(
             util.web_get('https://a.usafacts.org/api/v4/Metrics/csv/27246').text
@@ -90,7 +94,8 @@ def _inflation_df_raw():
     )
 
 
-@functools.cache
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def _inflation_df():
     df = _inflation_df_raw()[:1].set_index('Years').T
     df.index = df.index.astype('int')
@@ -98,7 +103,7 @@ def _inflation_df():
     return df
 
 
-@functools.cache
+@util.locked_cache
 def annual_us_inflation_rate():
     """
     Compute the average annual US inflation rate, where e.g. 0.02 means 2% inflation rate.
@@ -110,6 +115,8 @@ def annual_us_inflation_rate():
 
 # %%
 def _population_df_raw():
+    import pandas as pd
+
     return pd.read_csv(
         io.StringIO(
             util.web_get('https://a.usafacts.org/api/v4/Metrics/csv/12818').text
@@ -117,7 +124,8 @@ def _population_df_raw():
     )
 
 
-@functools.cache
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def _population_df():
     df = _population_df_raw()[:1].set_index('Years').T
     df.index = df.index.astype('int')
@@ -127,7 +135,7 @@ def _population_df():
     return df
 
 
-@functools.cache
+@util.locked_cache
 def annual_us_pop_growth_rate():
     """
     Compute the average annual US population growth rate, where e.g. 0.01 means 1% growth rate.
@@ -140,7 +148,7 @@ def annual_us_pop_growth_rate():
     ) ** (1 / (end_year - start_year)) - 1
 
 
-@functools.cache
+@util.locked_cache
 def annual_us_real_gdp_per_capita_growth():
     return (1 + annual_us_real_gdp_growth()) / (1 + annual_us_pop_growth_rate()) - 1
 
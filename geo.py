@@ -15,55 +15,356 @@
 # %%
 """Geography and geometry."""
 
-import pytz
-import functools
-import geopy
-import geopandas
-import shapely
+import json
+import math
+import pathlib
+import prefetch
 import util
+import tracing
 
 
 # %%
-@functools.cache
-def _census_block_api(loc):
-    return util.web_get(
-        f'https://geo.fcc.gov/api/census/block/find?latitude={loc.lat}&longitude={loc.lon}&censusYear=2020&showall=false&format=json'
-    ).json()
+class PolygonIndex:
+    """
+    Batch point-in-polygon lookups against a polygon dataset.
+
+    Besides an STR-tree, each polygon gets two simplified tiers computed once at construction: an
+    inner polygon that lies entirely inside it and an outer polygon that entirely contains it. A
+    point outside the outer tier is rejected by the tree query and a point inside the inner tier is
+    accepted, so only points within a couple of tolerances of a polygon's boundary are tested against
+    the full-resolution geometry. All three tiers are prepared.
+    """
+
+    def __init__(self, geometries, tolerance=0.001):
+        """
+        Args:
+            geometries: Sequence of shapely (multi)polygons, e.g. the geometry column of a
+                GeoDataFrame.
+            tolerance: Simplification tolerance in degrees.
+        """
+        import numpy as np
+        import shapely
+
+        self.geometries = np.asarray(geometries, dtype=object)
+        simplified = shapely.simplify(self.geometries, tolerance)
+        # The simplified polygon is within tolerance of the original, so shrinking/growing it by
+        # twice that is guaranteed to land inside/outside the original.
+        self.inner = shapely.buffer(simplified, -2 * tolerance, quad_segs=2)
+        self.outer = shapely.buffer(simplified, 2 * tolerance, quad_segs=2)
+        for geoms in [self.geometries, self.inner, self.outer]:
+            shapely.prepare(geoms)
+        self.tree = shapely.STRtree(self.outer)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def may_contain(self, latlons):
+        """
+        Cheaply check whether each point is inside or near any polygon, using only the outer tier.
+
+        Return: A numpy bool array that is True for every point that is inside a polygon, and also for
+            some points that are within a few tolerances outside one.
+        """
+        import numpy as np
+        import shapely
+
+        latlons = np.asarray(latlons, dtype=float).reshape(-1, 2)
+        points = shapely.points(latlons[:, 1], latlons[:, 0])
+        point_idxs, _ = self.tree.query(points, predicate='within')
+        ret = np.zeros(len(points), dtype=bool)
+        ret[point_idxs] = True
+        return ret
+
+    def intersecting(self, boxes):
+        """
+        Find the polygons that may intersect each of the given boxes, using only the outer tier.
+
+        Args:
+            boxes: Sequence of (south, west, north, east) in degrees.
+
+        Return: (box_idxs, poly_idxs), numpy arrays of the positions of each (box, polygon) pair.
+            Every polygon that intersects a box is included, along with some that are within a few
+            tolerances of it.
+        """
+        import numpy as np
+        import shapely
+
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        geoms = shapely.box(boxes[:, 1], boxes[:, 0], boxes[:, 3], boxes[:, 2])
+        return self.tree.query(geoms, predicate='intersects')
+
+    def query(self, latlons):
+        """
+        Find the first polygon that contains each of the given points.
+
+        Return: A numpy array holding the position of the containing polygon for each point (the
+            lowest position if several contain it, to match df[df.geometry.contains(p)].iloc[0]), or
+            -1 if no polygon contains the point.
+        """
+        import numpy as np
+        import shapely
+
+        latlons = np.asarray(latlons, dtype=float).reshape(-1, 2)
+        points = shapely.points(latlons[:, 1], latlons[:, 0])
+        point_idxs, poly_idxs = self.tree.query(points, predicate='within')
+
+        hit = shapely.contains(self.inner[poly_idxs], points[point_idxs])
+        near_boundary = ~hit
+        hit[near_boundary] = shapely.contains(
+            self.geometries[poly_idxs[near_boundary]],
+            points[point_idxs[near_boundary]],
+        )
+
+        ret = np.full(len(points), len(self))
+        np.minimum.at(ret, point_idxs[hit], poly_idxs[hit])
+        ret[ret == len(self)] = -1
+        return ret
+
+
+# %%
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
+def _counties_df():
+    import geopandas
+
+    with util.web_get_to_file(
+        'https://www2.census.gov/geo/tiger/GENZ2020/shp/cb_2020_us_county_500k.zip',
+        suffix='.zip',
+    ) as f:
+        return geopandas.read_file('zip://' + str(f.name))
+
+
+@prefetch.depends_on(_counties_df)
+@util.locked_cache
+def _counties_index():
+    return PolygonIndex(_counties_df().geometry)
+
+
+class NoCountyException(Exception):
+    pass
+
+
+def counties(latlons):
+    """
+    Look up the US county containing each of the given points.
+
+    Return: A list with a (state code, county name) pair for each point, e.g.
+        ('CA', 'San Francisco County'), or None for points that are not in a US county.
+    """
+    df = _counties_df()
+    state_codes = df['STUSPS'].to_numpy()
+    names = df['NAMELSAD'].to_numpy()
+    return [
+        None if i < 0 else (state_codes[i], names[i])
+        for i in _counties_index().query(latlons)
+    ]
+
+
+_NO_COUNTY = '_NO_COUNTY'
+
+
+@util.cache_on_disk
+def _get_county(latlon):
+    # Like _get_zipcode, return a special value instead of raising so that the result is cached.
+    (ret,) = counties([latlon])
+    if ret is None:
+        return _NO_COUNTY
+    return ret
+
+
+def _county(loc):
+    ret = _get_county(loc.latlon)
+    if ret == _NO_COUNTY:
+        raise NoCountyException(f'{loc} is not in a US county')
+    return ret
 
 
 # %%
 def city_to_state_code(city):
-    return _census_block_api(city)['State']['code']
+    """
+    Note: Raises NoCountyException if city is not in the USA.
+
+    Return:
+        Two-letter state code, e.g. "CA".
+    """
+    return _county(city)[0]
 
 
 # %%
 def city_to_county(city):
     """
-    Note: Raises KeyError if city is not in the USA.
+    Note: Raises NoCountyException if city is not in the USA.
 
     Return:
         Name of the county including the word "County", e.g. "San Francisco County".
     """
-    return _census_block_api(city)['County']['name']
+    return _county(city)[1]
+
+
+# %% tags=["active-ipynb"]
+# counties([locs.berkeley.latlon, locs.seattle.latlon])
 
 
 # %%
-@functools.cache
+_TIMEZONES_RELEASE = '2023d'
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def _timezones_df():
+    import geopandas
+
     with util.web_get_to_file(
-        'https://github.com/evansiroky/timezone-boundary-builder/releases/download/2023d/timezones.shapefile.zip',
+        f'https://github.com/evansiroky/timezone-boundary-builder/releases/download/{_TIMEZONES_RELEASE}/timezones.shapefile.zip',
         suffix='.zip',
     ) as f:
         return geopandas.read_file('zip://' + str(f.name))
 
 
+@prefetch.depends_on(_timezones_df)
+@util.locked_cache
+def _timezones_index():
+    return PolygonIndex(_timezones_df().geometry)
+
+
+# %%
+_TZ_GRID_CELLS_PER_DEGREE = 10
+# Special values in the timezone grid. Non-negative values are indexes into the list of tzids.
+_TZ_GRID_NO_TZ = -1
+_TZ_GRID_BOUNDARY = -2
+
+
+def _timezone_grid_paths():
+    cache_dir = pathlib.Path(__file__).parent / '.cache'
+    stem = f'timezone_grid_{_TIMEZONES_RELEASE}_{_TZ_GRID_CELLS_PER_DEGREE}'
+    return cache_dir / (stem + '.npy'), cache_dir / (stem + '.json')
+
+
+def _mark_timezone_cells(cells, tz_idx, covered, touched):
+    """
+    Record that timezone tz_idx fully covers or partially touches some cells of the grid.
+
+    Cells touched by more than one timezone, or only partially covered by one, become boundary cells.
+    """
+    empty = cells == _TZ_GRID_NO_TZ
+    cells[touched & ~empty] = _TZ_GRID_BOUNDARY
+    cells[touched & empty & covered] = tz_idx
+    cells[touched & empty & ~covered] = _TZ_GRID_BOUNDARY
+
+
+def build_timezone_grid():
+    """
+    Rasterize the timezone boundary polygons into a lat/lon grid of timezone IDs.
+
+    Each cell holds the index of the timezone that covers the whole cell, _TZ_GRID_NO_TZ if no
+    timezone touches the cell, or _TZ_GRID_BOUNDARY if the cell straddles a boundary and points in
+    it need an exact polygon check. This needs the full timezone dataset and takes a few minutes,
+    but only has to be done once per timezone-boundary-builder release.
+    """
+    import numpy as np
+    import shapely
+
+    n = _TZ_GRID_CELLS_PER_DEGREE
+    df = _timezones_df()
+    grid = np.full((180 * n, 360 * n), _TZ_GRID_NO_TZ, dtype=np.int16)
+
+    for tz_idx, geom in enumerate(df.geometry):
+        shapely.prepare(geom)
+        minx, miny, maxx, maxy = geom.bounds
+        # Walk the polygon's bounding box in 1-degree blocks so that blocks entirely inside or
+        # outside the polygon are decided with a single test.
+        for block_lat in range(math.floor(miny), math.ceil(maxy)):
+            for block_lon in range(math.floor(minx), math.ceil(maxx)):
+                block = shapely.box(block_lon, block_lat, block_lon + 1, block_lat + 1)
+                if not geom.intersects(block):
+                    continue
+
+                row0 = (block_lat + 90) * n
+                col0 = (block_lon + 180) * n
+                cells = grid[row0 : row0 + n, col0 : col0 + n]
+                if geom.contains(block):
+                    full = np.ones(cells.shape, dtype=bool)
+                    _mark_timezone_cells(cells, tz_idx, full, full)
+                    continue
+
+                lats, lons = np.meshgrid(
+                    block_lat + np.arange(n) / n,
+                    block_lon + np.arange(n) / n,
+                    indexing='ij',
+                )
+                boxes = shapely.box(lons, lats, lons + 1 / n, lats + 1 / n)
+                _mark_timezone_cells(
+                    cells,
+                    tz_idx,
+                    shapely.contains(geom, boxes),
+                    shapely.intersects(geom, boxes),
+                )
+
+    grid_path, tzids_path = _timezone_grid_paths()
+    grid_path.parent.mkdir(exist_ok=True)
+    # Write the names first, so that a grid on disk always comes with its names
+    with util.atomic_write_path(tzids_path) as tmp_path, open(tmp_path, 'w') as h:
+        json.dump(df.tzid.tolist(), h)
+    with util.atomic_write_path(grid_path) as tmp_path:
+        np.save(tmp_path, grid)
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
+def _timezone_grid():
+    import numpy as np
+
+    grid_path, tzids_path = _timezone_grid_paths()
+    if not grid_path.exists() or not tzids_path.exists():
+        build_timezone_grid()
+
+    with open(tzids_path) as h:
+        tzids = json.load(h)
+    return np.load(grid_path, mmap_mode='r'), tzids
+
+
 @util.cache_on_disk
+def _exact_timezone_name(latlon):
+    (row,) = _timezones_index().query([latlon])
+    return None if row < 0 else _timezones_df().iloc[row].tzid
+
+
+def timezone_names(latlons):
+    """
+    Look up the tz database name (e.g. "America/Los_Angeles") for each of the given points.
+
+    Points are resolved with the precomputed timezone grid. Only points in cells that straddle a
+    timezone boundary fall back to an exact test against the timezone polygons.
+
+    Return: A list with a tz name for each point, or None for points that are not in any timezone.
+    """
+    import numpy as np
+
+    n = _TZ_GRID_CELLS_PER_DEGREE
+    grid, tzids = _timezone_grid()
+    latlons = np.asarray(latlons, dtype=float).reshape(-1, 2)
+    rows = np.clip(np.floor((latlons[:, 0] + 90) * n).astype(int), 0, 180 * n - 1)
+    cols = np.floor((latlons[:, 1] + 180) * n).astype(int) % (360 * n)
+
+    ret = []
+    for latlon, cell in zip(latlons, grid[rows, cols]):
+        if cell == _TZ_GRID_BOUNDARY:
+            ret.append(_exact_timezone_name((float(latlon[0]), float(latlon[1]))))
+        elif cell == _TZ_GRID_NO_TZ:
+            ret.append(None)
+        else:
+            ret.append(tzids[cell])
+    return ret
+
+
 def city_timezone(loc):
-    rows = _timezones_df()[lambda df: df.geometry.contains(shapely.Point(loc.lonlat))]
-    if not len(rows):
+    import pytz
+
+    (tzid,) = timezone_names([loc.latlon])
+    if tzid is None:
         raise RuntimeError(f'Could not find timezone for {loc}')
 
-    return pytz.timezone(rows.iloc[0].tzid)
+    return pytz.timezone(tzid)
 
 
 # %% tags=["active-ipynb"]
@@ -75,6 +376,8 @@ def city_timezone(loc):
 def _nominatim_reverse(latlon):
     # We cache to comply with Nominatim's terms of service
     # https://operations.osmfoundation.org/policies/nominatim/
+    import geopy
+
     geolocator = geopy.Nominatim(user_agent='NestCB')
     return geolocator.reverse(latlon)
 
@@ -101,15 +404,26 @@ def get_state(latlon):
 
 
 # %%
-@functools.cache
-def _zipcodes_df():
-    with util.web_get_to_file(
-        'https://www2.census.gov/geo/tiger/GENZ2020/shp/cb_2020_us_zcta520_500k.zip',
-        suffix='.zip',
-    ) as f:
+ZIPCODES_URL = (
+    'https://www2.census.gov/geo/tiger/GENZ2020/shp/cb_2020_us_zcta520_500k.zip'
+)
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
+def zipcodes_df():
+    import geopandas
+
+    with util.web_get_to_file(ZIPCODES_URL, suffix='.zip') as f:
         return geopandas.read_file('zip://' + str(f.name))
 
 
+@prefetch.depends_on(zipcodes_df)
+@util.locked_cache
+def _zipcodes_index():
+    return PolygonIndex(zipcodes_df().geometry)
+
+
 class NoZipCodeException(Exception):
     pass
 
@@ -119,15 +433,24 @@ _NO_ZIP_CODE = '_NO_ZIP_CODE'
 
 @util.cache_on_disk
 def _get_zipcode(latlon):
-    lat, lon = latlon
-    rows = _zipcodes_df()[lambda df: df.geometry.contains(shapely.Point(lon, lat))]
+    (row,) = _zipcodes_index().query([latlon])
 
     # Note: We can't directly raise an exception from here because it won't be cached. Instead, we
     # return a special value and have a wrapper function that can raise an exception.
-    if not len(rows):
+    if row < 0:
         return _NO_ZIP_CODE
 
-    return rows.iloc[0]['NAME20']
+    return zipcodes_df().iloc[row]['NAME20']
+
+
+def get_zipcodes(latlons):
+    """
+    Batch version of get_zipcode.
+
+    Return: A list with the ZIP code of each point, or None for points that aren't in a ZIP code.
+    """
+    names = zipcodes_df()['NAME20'].to_numpy()
+    return [None if row < 0 else names[row] for row in _zipcodes_index().query(latlons)]
 
 
 def get_zipcode(latlon):
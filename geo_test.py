@@ -0,0 +1,29 @@
+import numpy as np
+import shapely
+
+import common  # noqa: F401 (import before geo to avoid a circular import via util)
+import geo
+
+
+def test_polygon_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    polygons = [
+        # A jagged "coastline" polygon so that points near the boundary need exact checks
+        shapely.Polygon(
+            [(x, 1 + 0.05 * rng.standard_normal()) for x in np.linspace(0, 2, 200)]
+            + [(2, 0), (0, 0)]
+        ),
+        shapely.box(1.5, 0.5, 3, 1.5),
+        shapely.box(5, 5, 6, 6),
+    ]
+    index = geo.PolygonIndex(polygons)
+
+    latlons = rng.uniform([-0.5, -0.5], [2, 3.5], size=(2000, 2))
+    expected = []
+    for lat, lon in latlons:
+        matches = [
+            i for i, p in enumerate(polygons) if p.contains(shapely.Point(lon, lat))
+        ]
+        expected.append(matches[0] if matches else -1)
+
+    assert index.query(latlons).tolist() == expected
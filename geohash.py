@@ -0,0 +1,84 @@
+"""
+Geohash encoding.
+
+A geohash identifies a rectangular lat/lon cell; each extra character of precision splits a cell into
+32 smaller cells. See https://en.wikipedia.org/wiki/Geohash.
+"""
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(lat, lon, precision=6):
+    """
+    Compute the geohash of the cell containing (lat, lon).
+
+    Precision 5 cells are roughly 5km x 5km and precision 6 cells are roughly 1.2km x 0.6km.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    nbits = 0
+    even = True
+    while len(chars) < precision:
+        rng, val = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            bits = bits * 2 + 1
+            rng[0] = mid
+        else:
+            bits = bits * 2
+            rng[1] = mid
+        even = not even
+        nbits += 1
+        if nbits == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            nbits = 0
+
+    return ''.join(chars)
+
+
+def bounds(geohash):
+    """
+    Return: The (min_lat, min_lon, max_lat, max_lon) of the geohash cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for c in geohash:
+        bits = _BASE32.index(c)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def neighbors(geohash):
+    """
+    Return: The geohashes of the (up to 8) cells of the same precision that surround the given cell.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds(geohash)
+    dlat = max_lat - min_lat
+    dlon = max_lon - min_lon
+    center_lat = (min_lat + max_lat) / 2
+    center_lon = (min_lon + max_lon) / 2
+
+    ret = []
+    for i in [-1, 0, 1]:
+        for j in [-1, 0, 1]:
+            lat = center_lat + i * dlat
+            if (i, j) == (0, 0) or not -90 < lat < 90:
+                continue
+            lon = (center_lon + j * dlon + 180) % 360 - 180
+            neighbor = encode(lat, lon, len(geohash))
+            if neighbor not in ret:
+                ret.append(neighbor)
+
+    return ret
@@ -0,0 +1,19 @@
+import geohash
+
+
+def test_encode():
+    assert geohash.encode(57.64911, 10.40744, precision=11) == 'u4pruydqqvj'
+
+
+def test_bounds_contains_point():
+    min_lat, min_lon, max_lat, max_lon = geohash.bounds(geohash.encode(47.6, -122.3))
+    assert min_lat <= 47.6 < max_lat
+    assert min_lon <= -122.3 < max_lon
+
+
+def test_neighbors():
+    neighbors = geohash.neighbors('9q8yy')
+    assert len(neighbors) == 8
+    assert '9q8yy' not in neighbors
+    assert '9q8yz' in neighbors
+    assert all(len(n) == 5 for n in neighbors)
@@ -0,0 +1,221 @@
+"""
+Score a regular lat/lon grid over a bounding box, to see where in a region you'd most like to live.
+
+Start with `./main.sh heatmap --bbox SOUTH WEST NORTH EAST`, or from a notebook:
+
+    import functools, heatmap, main
+    compute = functools.partial(main.compute_results, grid=True)
+    hm = heatmap.score_grid(compute, (47.4, -122.5, 47.8, -122.1), resolution=0.01)
+    hm  # Renders as a folium map
+
+Grids are scored with main.compute_results(..., grid=True), so factor modules with batch functions
+(annual_values, or raw_metrics for linear modules, or their approximate grid_ versions) handle every
+cell in one call. Modules that only have annual_value, e.g. the ones that query a web service per
+location, are called once per cell, so leave them out of factor_modules for large grids.
+
+Rasters are saved as .npz files with the bounds and a GDAL-style geotransform, so they can be
+loaded with Heatmap.load or turned into a GeoTIFF with e.g. rasterio.
+"""
+
+from common import logger
+import location
+import numpy as np
+
+# Colors from worst to best (ColorBrewer RdYlGn)
+_COLORS = ['#d7191c', '#fdae61', '#ffffbf', '#a6d96a', '#1a9641']
+
+
+def grid_locations(bounds, resolution):
+    """
+    Lay out a grid of square cells over a bounding box.
+
+    Args:
+        bounds: (south, west, north, east) in degrees.
+        resolution: Size of each cell in degrees. The grid extends south and east to fit a whole
+            number of cells.
+
+    Return: (lats, lons, locs), where lats are the latitudes of the cell centers from north to
+        south, lons are the longitudes from west to east, and locs has a Location for each cell in
+        row-major order.
+    """
+    south, west, north, east = bounds
+    if not (south < north and west < east and resolution > 0):
+        raise ValueError(f'Bad grid bounds {bounds} or resolution {resolution}')
+
+    # Tolerate floating point error in bounds that are a whole number of cells wide
+    n_rows = int(np.ceil((north - south) / resolution - 1e-9))
+    n_cols = int(np.ceil((east - west) / resolution - 1e-9))
+    lats = north - (np.arange(n_rows) + 0.5) * resolution
+    lons = west + (np.arange(n_cols) + 0.5) * resolution
+    locs = [
+        location.Location(f'{lat:.6f},{lon:.6f}', float(lat), float(lon))
+        for lat in lats
+        for lon in lons
+    ]
+    return lats, lons, locs
+
+
+class Heatmap:
+    """
+    Attributes:
+        bounds: (south, west, north, east) of the outer edges of the grid.
+        resolution: Size of each cell in degrees.
+        factors: List of the factor names.
+        values: Array of shape (len(factors), rows, cols) with the annual value of each factor in
+            each cell, with the northwest cell first, and NaN where the factor is unsupported.
+        total: Array of shape (rows, cols) with the total annual value of each cell, or NaN where
+            any factor is unsupported.
+    """
+
+    def __init__(self, bounds, resolution, factors, values, total):
+        self.bounds = tuple(float(x) for x in bounds)
+        self.resolution = float(resolution)
+        self.factors = list(factors)
+        self.values = np.asarray(values, dtype=float)
+        self.total = np.asarray(total, dtype=float)
+
+    @property
+    def transform(self):
+        """
+        The GDAL geotransform of the rasters: (west, resolution, 0, north, 0, -resolution).
+        """
+        _, west, north, _ = self.bounds
+        return (west, self.resolution, 0.0, north, 0.0, -self.resolution)
+
+    def raster(self, layer='Total'):
+        """
+        Return: The raster of a factor, or of the total if layer is 'Total'.
+        """
+        if layer == 'Total':
+            return self.total
+        return self.values[self.factors.index(layer)]
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            bounds=np.array(self.bounds),
+            resolution=self.resolution,
+            transform=np.array(self.transform),
+            factors=np.array(self.factors),
+            values=self.values,
+            total=self.total,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(
+                f['bounds'],
+                f['resolution'],
+                f['factors'].tolist(),
+                f['values'],
+                f['total'],
+            )
+
+    def to_folium(self, layer='Total', locs=(), opacity=0.6):
+        """
+        Draw a raster over a map, with a legend.
+
+        Args:
+            layer: A factor name, or 'Total'.
+            locs: Optional Locations to mark on the map, e.g. the ones in config/locs.yaml.
+        """
+        import folium
+
+        raster = self.raster(layer)
+        if np.isnan(raster).all():
+            vmin, vmax = 0.0, 1.0
+        else:
+            vmin, vmax = float(np.nanmin(raster)), float(np.nanmax(raster))
+
+        my_map = location.folium_map(locs, bounds=self.bounds)
+        south, west, north, east = self.bounds
+        folium.raster_layers.ImageOverlay(
+            colorize(raster, vmin, vmax),
+            bounds=[[south, west], [north, east]],
+            opacity=opacity,
+            mercator_project=True,
+            name=layer,
+        ).add_to(my_map)
+        legend(layer, vmin, vmax).add_to(my_map)
+        return my_map
+
+    def _repr_html_(self):
+        return self.to_folium()._repr_html_()
+
+
+def legend(layer, vmin, vmax):
+    """
+    Return: A branca colormap matching colorize, to add to a folium map as a legend.
+    """
+    import branca.colormap
+
+    colormap = branca.colormap.LinearColormap(_COLORS, vmin=vmin, vmax=vmax)
+    colormap.caption = f'{layer} (annual $)'
+    return colormap
+
+
+def layer_values(results, layer='Total'):
+    """
+    Return: The value of a factor, or the total if layer is 'Total', at each location of a
+        ResultSet. Values are NaN where the factor is unsupported, and totals are NaN where any
+        factor is, since they would be misleading.
+    """
+    if layer == 'Total':
+        return np.where(results.unsupported.any(axis=1), np.nan, results.totals)
+    return results.values[:, results.factors.index(layer)]
+
+
+def colorize(raster, vmin, vmax):
+    """
+    Color a raster from red (vmin) to green (vmax).
+
+    Return: A uint8 array of shape raster.shape + (4,), transparent where raster is NaN.
+    """
+    colors = np.array(
+        [[int(c[i : i + 2], 16) for i in (1, 3, 5)] for c in _COLORS], dtype=float
+    )
+    stops = np.linspace(0, 1, len(_COLORS))
+    scaled = (raster - vmin) / ((vmax - vmin) or 1.0)
+    rgba = np.zeros(raster.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(
+            np.nan_to_num(scaled), stops, colors[:, channel]
+        ).round()
+    rgba[..., 3] = np.where(np.isnan(raster), 0, 255)
+    return rgba
+
+
+def score_grid(compute, bounds, resolution):
+    """
+    Score every cell of a grid.
+
+    Args:
+        compute: A function like main.compute_results, called as compute(locs), that returns a
+            ResultSet.
+        bounds, resolution: See grid_locations.
+
+    Return: A Heatmap.
+    """
+    lats, lons, locs = grid_locations(bounds, resolution)
+    logger.info(f'Scoring {len(locs):,} grid cells ({len(lats)} x {len(lons)})')
+
+    # Results come back sorted by value, so put them back in grid order
+    results = compute(locs).select(locs)
+    shape = (len(lats), len(lons))
+    values = results.values.T.reshape((len(results.factors),) + shape)
+    total = layer_values(results)
+
+    _, west, north, _ = bounds
+    return Heatmap(
+        (
+            north - len(lats) * resolution,
+            west,
+            north,
+            west + len(lons) * resolution,
+        ),
+        resolution,
+        results.factors,
+        values,
+        total.reshape(shape),
+    )
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from city_result import CityResult
+import heatmap
+from result_set import ResultSet
+import types
+
+
+def test_grid_locations():
+    lats, lons, locs = heatmap.grid_locations((10, 20, 10.3, 20.2), 0.1)
+    np.testing.assert_allclose(lats, [10.25, 10.15, 10.05])
+    np.testing.assert_allclose(lons, [20.05, 20.15])
+    assert [loc.latlon for loc in locs[:3]] == pytest.approx(
+        [(10.25, 20.05), (10.25, 20.15), (10.15, 20.05)]
+    )
+
+    with pytest.raises(ValueError):
+        heatmap.grid_locations((10, 20, 9, 21), 0.1)
+
+
+def _compute(locs):
+    # X is the latitude and Y is unsupported west of 20.1
+    modules = [
+        types.SimpleNamespace(__name__='x', FACTOR_NAME='X'),
+        types.SimpleNamespace(__name__='y', FACTOR_NAME='Y'),
+    ]
+    cells = [
+        [loc.lat, CityResult.UNSUPPORTED if loc.lon < 20.1 else 1.0] for loc in locs
+    ]
+    return ResultSet.from_cells(locs, modules, cells).sorted()
+
+
+def test_score_grid(tmp_path):
+    hm = heatmap.score_grid(_compute, (10.01, 20, 10.3, 20.2), 0.1)
+    assert hm.bounds == pytest.approx((10, 20, 10.3, 20.2))
+    assert hm.transform == pytest.approx((20, 0.1, 0, 10.3, 0, -0.1))
+    np.testing.assert_allclose(hm.raster('X'), [[10.25] * 2, [10.15] * 2, [10.05] * 2])
+    np.testing.assert_allclose(
+        hm.raster(), [[np.nan, 11.25], [np.nan, 11.15], [np.nan, 11.05]]
+    )
+
+    hm.save(tmp_path / 'hm.npz')
+    loaded = heatmap.Heatmap.load(tmp_path / 'hm.npz')
+    assert loaded.bounds == hm.bounds
+    assert loaded.factors == ['X', 'Y']
+    np.testing.assert_array_equal(loaded.values, hm.values)
+
+
+def test_colorize():
+    rgba = heatmap.colorize(np.array([[0, 5, np.nan]]), 0, 10)
+    assert rgba.shape == (1, 3, 4)
+    assert rgba[0, 0].tolist() == [0xD7, 0x19, 0x1C, 255]
+    assert rgba[0, 1].tolist() == [0xFF, 0xFF, 0xBF, 255]
+    assert rgba[0, 2, 3] == 0
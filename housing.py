@@ -15,13 +15,17 @@
 # %%
 from common import logger, UnsupportedCityException, configvar
 import functools
-import pandas as pd
-import geopandas
-import shapely
+import hashlib
+import service_area
 import geo
 import numpy as np
 import finance
+import pathlib
+import prefetch
+import re
 import util
+import warnings
+import tracing
 
 
 # %%
@@ -61,58 +65,243 @@ def download_zillow_data(fname):
 
 
 # %%
-@functools.cache
-def load_zillow_df(aggregation, type):
+# Number of trailing months of ZHVI data to keep by default. home_prices only uses the latest month.
+ZILLOW_TRAILING_MONTHS = 12
+
+_ZILLOW_CACHE_DIR = pathlib.Path(__file__).parent / '.cache' / 'zillow'
+
+
+def _zillow_url(aggregation, type):
+    fname = f'{aggregation}_zhvi_{type}_uc_sfrcondo_tier_0.33_0.67_sm_sa_month.csv'
+    return f'https://files.zillowstatic.com/research/public_csvs/zhvi/{fname}'
+
+
+def _is_month_column(column):
+    return re.fullmatch(r'\d{4}-\d{2}-\d{2}', column) is not None
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
+def load_zillow_df(aggregation, type, n_months=ZILLOW_TRAILING_MONTHS):
     """
     Load dataframe for Zillow Home Value Index.
 
+    Only the region ID columns and the last n_months monthly columns are parsed. The projected,
+    compactly typed dataframe is cached on disk keyed by the source URL and its ETag, so the CSV is
+    only parsed again when Zillow publishes a new version.
+
     :param aggregation: One of "City", "Zip", "Neighborhood".
     :param type: e.g. "bdrmcnt_4" for 4-bedroom.
+    :param n_months: Number of trailing months to keep, or None to keep all of them.
     """
-    fname = f'{aggregation}_zhvi_{type}_uc_sfrcondo_tier_0.33_0.67_sm_sa_month.csv'
-    url = f'https://files.zillowstatic.com/research/public_csvs/zhvi/{fname}'
+    import pandas as pd
+
+    url = _zillow_url(aggregation, type)
+    key = repr((url, util.web_version(url), n_months))
+    cache_path = _ZILLOW_CACHE_DIR / (hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+    if cache_path.exists():
+        return pd.read_pickle(cache_path)
+
     with util.web_get_to_file(url) as f:
-        return pd.read_csv(f.name)
+        columns = pd.read_csv(f.name, nrows=0).columns
+        id_columns = [c for c in columns if not _is_month_column(c)]
+        month_columns = [c for c in columns if _is_month_column(c)]
+        if n_months is not None:
+            month_columns = month_columns[-n_months:]
 
+        df = pd.read_csv(
+            f.name,
+            usecols=id_columns + month_columns,
+            dtype={'RegionID': 'int32'} | {c: 'float32' for c in month_columns},
+        )
 
-# %%
-load_zillow_df('Zip', 'bdrmcnt_1')
+    for column in id_columns:
+        if pd.api.types.is_string_dtype(df[column]):
+            df[column] = df[column].astype('category')
+
+    _ZILLOW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with util.atomic_write_path(cache_path) as tmp_path:
+        df.to_pickle(tmp_path)
+    return df
+
+
+# %% tags=["active-ipynb"]
+# load_zillow_df('Zip', 'bdrmcnt_1')
 
 
 # %%
-@functools.cache
+_ZILLOW_NEIGHBORHOODS_URL = (
+    'https://edg.epa.gov/data/PUBLIC/OEI/ZILLOW_NEIGHBORHOODS/Zillow_Neighborhoods.zip'
+)
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
 def zillow_neighborhoods_df():
-    with util.web_get_to_file(
-        'https://edg.epa.gov/data/PUBLIC/OEI/ZILLOW_NEIGHBORHOODS/Zillow_Neighborhoods.zip',
-        suffix='.zip',
-    ) as f:
+    import geopandas
+
+    with util.web_get_to_file(_ZILLOW_NEIGHBORHOODS_URL, suffix='.zip') as f:
         return geopandas.read_file('zip://' + str(f.name) + '!ZillowNeighborhoods.gdb')
 
 
+@prefetch.depends_on(zillow_neighborhoods_df)
+@util.locked_cache
+def _zillow_neighborhoods_index():
+    return geo.PolygonIndex(zillow_neighborhoods_df().geometry)
+
+
 # %% tags=["active-ipynb"]
 # zillow_neighborhoods_df()[lambda df: df.City == 'San Francisco'][lambda df: df.geometry.contains(shapely.Point(-122.4, 37.8))].geometry.iloc[0]
 
 
 # %%
+@util.locked_cache
 @util.cache_on_disk
-def zillow_neighborhood(latlon):
+def _overlapping_neighborhood_ids():
+    """
+    Return: The set of RegionIDs of the Zillow neighborhoods whose interior overlaps another one's.
+    """
+    import shapely
+
+    df = zillow_neighborhoods_df()
+    geoms = np.asarray(df.geometry, dtype=object)
+    idxs, other_idxs = shapely.STRtree(geoms).query(geoms, predicate='intersects')
+    idxs, other_idxs = idxs[idxs != other_idxs], other_idxs[idxs != other_idxs]
+    # Touching along a border is fine; only shared interior makes a point ambiguous
+    overlap = shapely.relate_pattern(geoms[idxs], geoms[other_idxs], 'T********')
+    return set(df.RegionID.astype(int).to_numpy()[idxs[overlap]].tolist())
+
+
+def _in_same_neighborhood(latlon, cached_latlon, cached_nb):
+    import shapely
+
     lat, lon = latlon
-    rows = zillow_neighborhoods_df()[
-        lambda df: df.geometry.contains(shapely.Point(lon, lat))
-    ]
-    if len(rows):
-        return rows.iloc[0]
+    # A point inside overlapping neighborhoods gets the first one in the dataset, which needn't be
+    # the cached one
+    return (
+        cached_nb is not None
+        and cached_nb.geometry.contains(shapely.Point(lon, lat))
+        and int(cached_nb.RegionID) not in _overlapping_neighborhood_ids()
+    )
+
+
+@util.cache_on_disk_spatially(
+    precision=6, tolerance_km=1, same_result=_in_same_neighborhood
+)
+def zillow_neighborhood(latlon):
+    (row,) = _zillow_neighborhoods_index().query([latlon])
+    if row >= 0:
+        return zillow_neighborhoods_df().iloc[row]
     else:
         return None
 
 
+def zillow_neighborhood_ids(latlons):
+    """
+    Batch lookup of the RegionID of the Zillow neighborhood containing each point.
+
+    Return: A numpy int array with the RegionID for each point, or -1 for points not in a
+        neighborhood.
+    """
+    rows = _zillow_neighborhoods_index().query(latlons)
+    region_ids = zillow_neighborhoods_df().RegionID.astype(int).to_numpy()
+    return np.where(rows >= 0, region_ids[rows], -1)
+
+
 # %% tags=["active-ipynb"]
 # print(zillow_neighborhood(locs.minneapolis))
 # zillow_neighborhood(locs.minneapolis).geometry
 
 
 # %%
-def home_prices(loc):
+# Column that identifies a region within each Zillow aggregation. Neighborhoods are matched by the
+# RegionID of the Zillow neighborhood polygon, ZIPs by the ZIP code itself.
+_ZILLOW_REGION_KEY_COLUMNS = {
+    'Neighborhood': 'RegionID',
+    'Zip': 'RegionName',
+}
+
+
+@prefetch.depends_on(
+    *(
+        functools.partial(load_zillow_df, aggregation, f'bdrmcnt_{nbed}')
+        for aggregation in _ZILLOW_REGION_KEY_COLUMNS
+        for nbed in range(1, 6)
+    )
+)
+def zillow_prices_long(as_of=None, trailing_months=1):
+    """
+    Build a long-format table of the latest Zillow Home Value Index for every region.
+
+    By default this uses the latest month of data. Passing as_of (a date) or trailing_months > 1
+    instead reads prices from the housing_history store, to back-test against an earlier date or to
+    smooth prices with a trailing average.
+
+    Return: A dataframe with columns aggregation, region_id, bedrooms and price, where region_id is
+        an int (the RegionID for neighborhoods and the ZIP code for ZIPs). Regions whose latest value
+        is missing are left out, so lookups for them fall through as if the region didn't exist.
+    """
+    return _zillow_prices_long(as_of, trailing_months)
+
+
+# The cached functions below take their arguments positionally so that e.g. housing_table() and
+# housing_table(None, 1) share a cache entry.
+@util.locked_cache
+def _zillow_prices_long(as_of, trailing_months):
+    import pandas as pd
+
+    if as_of is not None or trailing_months != 1:
+        import housing_history
+
+        return housing_history.history().prices_long(as_of, trailing_months)
+
+    dfs = []
+    for aggregation, key_column in _ZILLOW_REGION_KEY_COLUMNS.items():
+        for nbed in range(1, 6):
+            df = load_zillow_df(aggregation, f'bdrmcnt_{nbed}')
+            latest = df.iloc[:, -1]
+            # Keep the first row for each region to match the old df[...].iloc[0] lookups
+            keep = ~df[key_column].duplicated() & latest.notna()
+            dfs.append(
+                pd.DataFrame(
+                    {
+                        'aggregation': aggregation,
+                        'region_id': df[key_column][keep].astype(int).to_numpy(),
+                        'bedrooms': nbed,
+                        'price': latest[keep].astype(float).to_numpy(),
+                    }
+                )
+            )
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+@prefetch.depends_on(zillow_prices_long)
+def zillow_latest_prices(as_of=None, trailing_months=1):
+    """
+    Index of zillow_prices_long() as a dict of {(aggregation, region_id, bedrooms): price}.
+    """
+    return _zillow_latest_prices(as_of, trailing_months)
+
+
+@util.locked_cache
+def _zillow_latest_prices(as_of, trailing_months):
+    df = zillow_prices_long(as_of, trailing_months)
+    return dict(
+        zip(zip(df.aggregation, df.region_id, df.bedrooms), df.price, strict=True)
+    )
+
+
+# %%
+def home_prices(loc, as_of=None, trailing_months=1):
+    """
+    Get the price of a home with 1-5 bedrooms at a location.
+
+    See zillow_prices_long for the meaning of as_of and trailing_months.
+
+    Return: A dict of {bedrooms: price}, with NaN prices where there is no data.
+    """
+    service_area.check_region(SUPPORTED_REGION, loc)
     nb = zillow_neighborhood(loc)
 
     try:
@@ -120,23 +309,21 @@ def home_prices(loc):
     except geo.NoZipCodeException:
         raise UnsupportedCityException('Not in USA')
 
+    prices = zillow_latest_prices(as_of, trailing_months)
     ret = {}
     for nbed in range(1, 6):
-        df = load_zillow_df('Neighborhood', f'bdrmcnt_{nbed}')
-        if nb is not None and len(
-            rows := df[lambda df: df.RegionID == int(nb.RegionID)]
+        if nb is not None and (
+            (price := prices.get(('Neighborhood', int(nb.RegionID), nbed))) is not None
         ):
             logger.debug(
                 f'loc {loc.name} {nbed}-bed was priced using neighborhood {nb}'
             )
-            ret[nbed] = round(rows.iloc[0].iloc[-1])
+            ret[nbed] = round(price)
             continue
 
-        df = load_zillow_df('Zip', f'bdrmcnt_{nbed}')
-        rows = df[lambda df: df.RegionName == int(zipcode)]
-        if len(rows):
+        if (price := prices.get(('Zip', int(zipcode), nbed))) is not None:
             logger.debug(f'loc {loc.name} {nbed}-bed was priced using ZIP {zipcode}')
-            ret[nbed] = round(rows.iloc[0].iloc[-1])
+            ret[nbed] = round(price)
             continue
 
         ret[nbed] = np.nan
@@ -148,16 +335,27 @@ def home_prices(loc):
 # logger.setLevel('DEBUG')
 # print(home_prices(locs.minneapolis))
 
+
 # %%
-tweak = {
-    i: finance.annual_dollars_to_capital(12 * housing_marginal_utility_per_month()[i])
-    for i in range(1, 6)
-}
+def tweak():
+    """
+    Capitalized value of the marginal utility of each number of bedrooms.
+
+    This is a function rather than a module-level dict so that importing this module doesn't
+    require the housing_marginal_utility_per_month configvar.
+    """
+    return {
+        i: finance.annual_dollars_to_capital(
+            12 * housing_marginal_utility_per_month()[i]
+        )
+        for i in range(1, 6)
+    }
 
 
-def home_shadow_prices(loc):
-    hp = home_prices(loc)
-    return {i: hp[i] - tweak[i] for i in range(1, 6)}
+def home_shadow_prices(loc, as_of=None, trailing_months=1):
+    hp = home_prices(loc, as_of, trailing_months)
+    tweak_ = tweak()
+    return {i: hp[i] - tweak_[i] for i in range(1, 6)}
 
 
 # %% tags=["active-ipynb"]
@@ -169,15 +367,266 @@ def home_shadow_prices(loc):
 # %% tags=["active-ipynb"]
 # home_shadow_prices(locs.seattle)
 
+
 # %%
-FACTOR_NAME = 'Housing'
+_HOUSING_TABLE_DIR = pathlib.Path(__file__).parent / '.cache' / 'housing_table'
+
+
+def _resolve_prices(pairs, prices):
+    """
+    Price each (neighborhood, zip) pair the same way home_prices does: use the neighborhood's
+    price for a bedroom count if Zillow has one, and otherwise the ZIP's price.
+
+    Args:
+        pairs: Dataframe with int columns neighborhood (-1 for none) and zip.
+        prices: Dataframe in the format returned by zillow_prices_long.
+
+    Return: A dataframe indexed by (neighborhood, zip) with a column of rounded prices for each
+        bedroom count 1-5, and NaN where neither region has a price.
+    """
+    import pandas as pd
+
+    nb_prices = prices[prices.aggregation == 'Neighborhood'].rename(
+        columns={'region_id': 'neighborhood', 'price': 'nb_price'}
+    )
+    zip_prices = prices[prices.aggregation == 'Zip'].rename(
+        columns={'region_id': 'zip', 'price': 'zip_price'}
+    )
+
+    df = (
+        pairs.merge(pd.DataFrame({'bedrooms': range(1, 6)}), how='cross')
+        .merge(
+            nb_prices[['neighborhood', 'bedrooms', 'nb_price']],
+            on=['neighborhood', 'bedrooms'],
+            how='left',
+        )
+        .merge(
+            zip_prices[['zip', 'bedrooms', 'zip_price']],
+            on=['zip', 'bedrooms'],
+            how='left',
+        )
+    )
+    df['price'] = df.nb_price.fillna(df.zip_price).round()
+    return df.pivot(index=['neighborhood', 'zip'], columns='bedrooms', values='price')
+
+
+def build_housing_table(as_of=None, trailing_months=1):
+    """
+    Precompute the price of each bedroom count for every place a point can land.
+
+    A point's prices only depend on which Zillow neighborhood (if any) and which ZCTA it is in, so we
+    enumerate every (neighborhood, ZCTA) pair whose polygons intersect, plus (-1, ZCTA) for points
+    outside any neighborhood, and resolve the neighborhood -> ZIP fallback for each pair up front.
+
+    See zillow_prices_long for the meaning of as_of and trailing_months.
+
+    Return: A dataframe in the format returned by _resolve_prices.
+    """
+    import pandas as pd
+    import shapely
+
+    nbs = zillow_neighborhoods_df()
+    zips = geo.zipcodes_df()
+    nb_idxs, zip_idxs = shapely.STRtree(zips.geometry).query(
+        nbs.geometry, predicate='intersects'
+    )
+    nb_ids = nbs.RegionID.astype(int).to_numpy()
+    zip_ids = zips.NAME20.astype(int).to_numpy()
+    pairs = pd.concat(
+        [
+            pd.DataFrame({'neighborhood': nb_ids[nb_idxs], 'zip': zip_ids[zip_idxs]}),
+            pd.DataFrame({'neighborhood': -1, 'zip': zip_ids}),
+        ]
+    ).drop_duplicates()
+
+    return _resolve_prices(pairs, zillow_prices_long(as_of, trailing_months)).astype(
+        'float32'
+    )
+
+
+@prefetch.depends_on(zillow_prices_long, zillow_neighborhoods_df, geo.zipcodes_df)
+def housing_table(as_of=None, trailing_months=1):
+    """
+    Get the table built by build_housing_table, building it if needed.
+
+    Tables are cached on disk keyed by the versions of the Zillow and ZCTA source files.
+    """
+    return _housing_table(as_of, trailing_months)
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
+def _housing_table(as_of, trailing_months):
+    import pandas as pd
+
+    key = repr(
+        (
+            [
+                util.web_version(url)
+                for url in [
+                    _ZILLOW_NEIGHBORHOODS_URL,
+                    geo.ZIPCODES_URL,
+                    *(
+                        _zillow_url(agg, f'bdrmcnt_{nbed}')
+                        for agg in _ZILLOW_REGION_KEY_COLUMNS
+                        for nbed in range(1, 6)
+                    ),
+                ]
+            ],
+            str(as_of),
+            trailing_months,
+        )
+    )
+    path = _HOUSING_TABLE_DIR / (hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+    if path.exists():
+        return pd.read_pickle(path)
+
+    table = build_housing_table(as_of, trailing_months)
+    _HOUSING_TABLE_DIR.mkdir(parents=True, exist_ok=True)
+    with util.atomic_write_path(path) as tmp_path:
+        table.to_pickle(tmp_path)
+    return table
 
 
-def annual_value(loc):
-    shadow_prices = home_shadow_prices(loc)
+# %% tags=["active-ipynb"]
+# housing_table()
+
+
+# %%
+def annual_value_upper_bounds(boxes, as_of=None, trailing_months=1):
+    """
+    Find an upper bound on annual_value over all points in each box, e.g. for search.py.
+
+    A point's value only depends on the (neighborhood, ZCTA) pair it lands in, so the bound is the
+    value of the cheapest pair whose polygons may intersect the box.
+
+    Args:
+        boxes: Sequence of (south, west, north, east) in degrees.
+
+    Return: A numpy array with a bound for each box, or NaN for boxes where no point is supported.
+    """
+    import pandas as pd
+
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    table = housing_table(as_of, trailing_months)
+    tweak_ = tweak()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        min_shadow_prices = np.nanmin(
+            table.to_numpy(dtype=float) - np.array([tweak_[i] for i in range(1, 6)]),
+            axis=1,
+        )
+    pairs = pd.DataFrame(
+        {
+            'neighborhood': table.index.get_level_values('neighborhood'),
+            'zip': table.index.get_level_values('zip'),
+            'price': min_shadow_prices,
+        }
+    )
+
+    box_idxs, zip_idxs = geo._zipcodes_index().intersecting(boxes)
+    box_zips = pd.DataFrame(
+        {
+            'box': box_idxs,
+            'zip': geo.zipcodes_df().NAME20.astype(int).to_numpy()[zip_idxs],
+        }
+    )
+    box_idxs, nb_idxs = _zillow_neighborhoods_index().intersecting(boxes)
+    box_nbs = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    'box': box_idxs,
+                    'neighborhood': zillow_neighborhoods_df()
+                    .RegionID.astype(int)
+                    .to_numpy()[nb_idxs],
+                }
+            ),
+            # Points outside every neighborhood fall back to their ZIP
+            pd.DataFrame({'box': np.arange(len(boxes)), 'neighborhood': -1}),
+        ]
+    )
+
+    cheapest = (
+        box_zips.merge(pairs, on='zip')
+        .merge(box_nbs, on=['box', 'neighborhood'])
+        .groupby('box')
+        .price.min()
+        .reindex(np.arange(len(boxes)))
+        .to_numpy()
+    )
+    return -finance.capital_to_annual_dollars(cheapest)
+
+
+# %%
+def warm_up():
+    """
+    Load all of the datasets this module needs.
+
+    Nothing is loaded when the module is imported; datasets are otherwise loaded the first time
+    they are needed. Call this to pay the loading cost up front, e.g. before timing a run.
+    """
+    prefetch.prefetch(DATASETS)
+
+
+# %%
+FACTOR_NAME = 'Housing'
+SUPPORTED_REGION = 'us'
+DATASETS = [
+    housing_table,
+    zillow_latest_prices,
+    _zillow_neighborhoods_index,
+    geo._zipcodes_index,
+    service_area._us_outline,
+]
+
+
+def annual_value(loc, as_of=None, trailing_months=1):
+    shadow_prices = home_shadow_prices(loc, as_of, trailing_months)
     non_nan = [p for p in shadow_prices.values() if not np.isnan(p)]
 
     if not non_nan:
         raise UnsupportedCityException('Not able to compute any house prices')
 
     return -finance.capital_to_annual_dollars(min(non_nan))
+
+
+def annual_values(locs, as_of=None, trailing_months=1):
+    """
+    Batch version of annual_value.
+
+    Neighborhoods and ZIPs for all locations are resolved together and looked up in
+    housing_table(), so this is much faster than calling annual_value for each location.
+
+    Return: A numpy array with the annual value of each location, or NaN where annual_value would
+        raise UnsupportedCityException.
+    """
+    import pandas as pd
+
+    locs = list(locs)
+    latlons = np.array([loc.latlon for loc in locs], dtype=float).reshape(-1, 2)
+    ret = np.full(len(locs), np.nan)
+
+    points = np.flatnonzero(service_area.covers(SUPPORTED_REGION, latlons))
+    zipcodes = np.array(
+        [-1 if z is None else int(z) for z in geo.get_zipcodes(latlons[points])],
+        dtype=int,
+    )
+    points = points[zipcodes >= 0]
+    zipcodes = zipcodes[zipcodes >= 0]
+    neighborhoods = zillow_neighborhood_ids(latlons[points])
+
+    prices = (
+        housing_table(as_of, trailing_months)
+        .reindex(pd.MultiIndex.from_arrays([neighborhoods, zipcodes]))
+        .to_numpy(dtype=float)
+    )
+    tweak_ = tweak()
+    shadow_prices = prices - np.array([tweak_[i] for i in range(1, 6)])
+    with warnings.catch_warnings():
+        # nanmin warns for locations with no price for any bedroom count
+        warnings.simplefilter('ignore', RuntimeWarning)
+        min_shadow_prices = np.nanmin(shadow_prices, axis=1)
+
+    ret[points] = -finance.capital_to_annual_dollars(min_shadow_prices)
+    return ret
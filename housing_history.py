@@ -0,0 +1,227 @@
+# ---
+# jupyter:
+#   jupytext:
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.15.2
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %%
+"""
+Full history of the Zillow Home Value Index in one memory-mapped array.
+
+housing.py only needs the latest month of each ZHVI CSV. This module packs every month of every
+region and bedroom count into a single float32 array of shape (regions, months, bedrooms), stored in
+.cache and memory-mapped on load, so point-in-time, trailing-average and trend queries don't need
+to re-read any CSVs.
+"""
+
+import hashlib
+import housing
+import numpy as np
+import pandas as pd
+import pathlib
+import shutil
+import tempfile
+import util
+import warnings
+
+# %%
+_HISTORY_DIR = pathlib.Path(__file__).parent / '.cache' / 'zillow_history'
+_BEDROOMS = range(1, 6)
+
+
+def _sources():
+    return [
+        (aggregation, nbed)
+        for aggregation in housing._ZILLOW_REGION_KEY_COLUMNS
+        for nbed in _BEDROOMS
+    ]
+
+
+def _version():
+    """Identify the current version of the Zillow CSVs, so we rebuild when they change."""
+    urls = [housing._zillow_url(agg, f'bdrmcnt_{nbed}') for agg, nbed in _sources()]
+    key = repr([(url, util.web_version(url)) for url in urls])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+# %%
+def build_history(directory):
+    """
+    Build the history store from the full ZHVI CSVs and write it to directory.
+    """
+    directory = pathlib.Path(directory)
+    dfs = {
+        (aggregation, nbed): housing.load_zillow_df(
+            aggregation, f'bdrmcnt_{nbed}', n_months=None
+        )
+        for aggregation, nbed in _sources()
+    }
+
+    dates = sorted(
+        {c for df in dfs.values() for c in df.columns if housing._is_month_column(c)}
+    )
+    date_idxs = {date: i for i, date in enumerate(dates)}
+
+    regions = sorted(
+        {
+            (aggregation, int(region_id))
+            for (aggregation, _), df in dfs.items()
+            for region_id in df[housing._ZILLOW_REGION_KEY_COLUMNS[aggregation]]
+        }
+    )
+    region_idxs = {region: i for i, region in enumerate(regions)}
+
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = pathlib.Path(
+        tempfile.mkdtemp(
+            dir=directory.parent, prefix=directory.name + '.', suffix='.tmp'
+        )
+    )
+
+    prices = np.lib.format.open_memmap(
+        tmp_dir / 'prices.npy',
+        mode='w+',
+        dtype=np.float32,
+        shape=(len(regions), len(dates), len(_BEDROOMS)),
+    )
+    prices[:] = np.nan
+    for (aggregation, nbed), df in dfs.items():
+        # Reverse so that the first row for a region wins, like the lookups in housing.py
+        df = df.iloc[::-1]
+        key_column = housing._ZILLOW_REGION_KEY_COLUMNS[aggregation]
+        month_columns = [c for c in df.columns if housing._is_month_column(c)]
+        rows = np.array([region_idxs[(aggregation, int(r))] for r in df[key_column]])
+        cols = np.array([date_idxs[c] for c in month_columns])
+        prices[rows[:, None], cols[None, :], nbed - 1] = df[month_columns].to_numpy()
+    prices.flush()
+    del prices
+
+    np.save(tmp_dir / 'dates.npy', np.array(dates, dtype='datetime64[D]'))
+    np.save(tmp_dir / 'region_aggregations.npy', np.array([a for a, _ in regions]))
+    np.save(tmp_dir / 'region_ids.npy', np.array([i for _, i in regions]))
+
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        tmp_dir.rename(directory)
+    except OSError:
+        # Another process just built the same version
+        if not directory.exists():
+            raise
+        shutil.rmtree(tmp_dir)
+
+
+# %%
+class ZillowHistory:
+    """
+    Read-only view of a history store built by build_history.
+
+    Dates passed to queries can be anything np.datetime64 accepts (e.g. datetime.date or
+    '2020-06-30'); None means the latest month. A query at a date uses the last month on or before it.
+    """
+
+    def __init__(self, directory):
+        directory = pathlib.Path(directory)
+        self.prices = np.load(directory / 'prices.npy', mmap_mode='r')
+        self.dates = np.load(directory / 'dates.npy')
+        self.region_aggregations = np.load(directory / 'region_aggregations.npy')
+        self.region_ids = np.load(directory / 'region_ids.npy')
+        self._region_idxs = {
+            (str(agg), int(region_id)): i
+            for i, (agg, region_id) in enumerate(
+                zip(self.region_aggregations, self.region_ids)
+            )
+        }
+
+    def _date_idx(self, date):
+        if date is None:
+            return len(self.dates) - 1
+        idx = np.searchsorted(self.dates, np.datetime64(date, 'D'), side='right') - 1
+        if idx < 0:
+            raise KeyError(f'{date} is before the start of the Zillow history')
+        return int(idx)
+
+    def _window(self, region, bedrooms, months, date):
+        end = self._date_idx(date) + 1
+        return self.prices[
+            self._region_idxs[region], max(end - months, 0) : end, bedrooms - 1
+        ]
+
+    def series(self, aggregation, region_id, bedrooms):
+        """Return the full monthly price history of a region as a pandas Series."""
+        region = (aggregation, int(region_id))
+        return pd.Series(
+            self.prices[self._region_idxs[region], :, bedrooms - 1], index=self.dates
+        )
+
+    def price(self, aggregation, region_id, bedrooms, date=None):
+        """Price of a region at a date. Raises KeyError if the region isn't in the history."""
+        return float(self._window((aggregation, int(region_id)), bedrooms, 1, date)[0])
+
+    def trailing_mean(self, aggregation, region_id, bedrooms, months=12, date=None):
+        """Mean price over the trailing months up to and including date, skipping gaps."""
+        window = self._window((aggregation, int(region_id)), bedrooms, months, date)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return float(np.nanmean(window))
+
+    def trend(self, aggregation, region_id, bedrooms, months=12, date=None):
+        """
+        Annualized price growth over the trailing months, e.g. 0.05 means prices are rising 5% a
+        year. Computed from a least-squares fit of log price against time.
+        """
+        window = self._window((aggregation, int(region_id)), bedrooms, months, date)
+        t = np.arange(len(window))
+        ok = ~np.isnan(window)
+        if ok.sum() < 2:
+            return np.nan
+        slope = np.polyfit(t[ok], np.log(window[ok]), 1)[0]
+        return float(np.expm1(slope * 12))
+
+    def prices_long(self, date=None, trailing_months=1):
+        """
+        Prices of every region at a date, in the same long format as housing.zillow_prices_long.
+
+        Each price is the mean over the trailing_months months up to and including date. Regions
+        with no data in that window are left out.
+        """
+        end = self._date_idx(date) + 1
+        window = self.prices[:, max(end - trailing_months, 0) : end, :]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            means = np.nanmean(window, axis=1)
+
+        region_idxs, bedroom_idxs = np.nonzero(~np.isnan(means))
+        return pd.DataFrame(
+            {
+                'aggregation': self.region_aggregations[region_idxs].astype(str),
+                'region_id': self.region_ids[region_idxs].astype(int),
+                'bedrooms': bedroom_idxs + 1,
+                'price': means[region_idxs, bedroom_idxs].astype(float),
+            }
+        )
+
+
+@util.locked_cache
+def history():
+    """
+    Get the ZillowHistory for the current version of the Zillow data, building it if needed.
+    """
+    directory = _HISTORY_DIR / _version()
+    if not directory.exists():
+        build_history(directory)
+    return ZillowHistory(directory)
+
+
+# %% tags=["active-ipynb"]
+# history().trailing_mean('Zip', 94110, 2, months=12)
+
+# %% tags=["active-ipynb"]
+# history().trend('Zip', 94110, 2, months=60, date='2020-01-01')
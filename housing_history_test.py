@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import common  # noqa: F401 (import before housing to avoid a circular import via util)
+import housing
+import housing_history
+
+
+def _fake_zillow_df(aggregation, type, n_months=None):
+    nbed = int(type.removeprefix('bdrmcnt_'))
+    key = 'RegionID' if aggregation == 'Neighborhood' else 'RegionName'
+    return pd.DataFrame(
+        {
+            key: [7, 8],
+            'State': ['CA', 'NY'],
+            '2020-01-31': [100.0 * nbed, np.nan],
+            '2020-02-29': [110.0 * nbed, 50.0],
+            '2020-03-31': [121.0 * nbed, np.nan],
+        }
+    )
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(housing, 'load_zillow_df', _fake_zillow_df)
+    housing_history.build_history(tmp_path / 'history')
+    return housing_history.ZillowHistory(tmp_path / 'history')
+
+
+def test_price(history):
+    assert history.price('Zip', 7, 2) == 242
+    assert history.price('Zip', 7, 2, date='2020-02-15') == 200
+    assert history.price('Neighborhood', 7, 1, date='2020-02-29') == 110
+
+
+def test_trailing_mean_skips_missing_months(history):
+    assert history.trailing_mean('Zip', 7, 1, months=2) == pytest.approx(115.5)
+    assert history.trailing_mean('Zip', 8, 1, months=3) == 50
+
+
+def test_trend(history):
+    # Prices grow 10% a month
+    assert history.trend('Zip', 7, 3, months=3) == pytest.approx(1.1**12 - 1)
+
+
+def test_prices_long(history):
+    df = history.prices_long(date='2020-03-31', trailing_months=1)
+    assert set(df.aggregation) == {'Zip', 'Neighborhood'}
+    # Region 8 has no data in March
+    assert set(df.region_id) == {7}
+    assert len(df) == 10
+
+    df = history.prices_long(trailing_months=2)
+    zip8 = df[(df.aggregation == 'Zip') & (df.region_id == 8)]
+    assert zip8.price.tolist() == [50.0] * 5
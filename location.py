@@ -23,11 +23,7 @@ class Location(NamedTuple):
     lon: float
 
     def _repr_html_(self):
-        import folium
-
-        my_map = folium.Map(location=self.latlon, zoom_start=14)
-        folium.Marker(self.latlon, popup=self.name).add_to(my_map)
-        return my_map._repr_html_()
+        return folium_map([self])._repr_html_()
 
     @property
     def latlon(self):
@@ -42,6 +38,10 @@ class Location(NamedTuple):
         yield self.lat
         yield self.lon
 
+    def __reduce__(self):
+        # NamedTuple pickles by iterating over self, which we've overridden above
+        return self.__class__, (self.name, self.lat, self.lon)
+
     def __getitem__(self, idx):
         return [self.lat, self.lon][idx]
 
@@ -52,6 +52,34 @@ class Location(NamedTuple):
         return self.name
 
 
+def folium_map(locs=(), bounds=None, zoom_start=14):
+    """
+    Make a folium map with a marker for each location.
+
+    Args:
+        bounds: Optional (south, west, north, east) to fit the map to. Otherwise the map is
+            centered on the locations.
+    """
+    import folium
+
+    locs = list(locs)
+    if bounds is not None:
+        south, west, north, east = bounds
+        center = ((south + north) / 2, (west + east) / 2)
+    else:
+        center = (
+            sum(loc.lat for loc in locs) / len(locs),
+            sum(loc.lon for loc in locs) / len(locs),
+        )
+
+    my_map = folium.Map(location=center, zoom_start=zoom_start)
+    for loc in locs:
+        folium.Marker(loc.latlon, popup=loc.name).add_to(my_map)
+    if bounds is not None:
+        my_map.fit_bounds([[south, west], [north, east]])
+    return my_map
+
+
 class Polygon(DefaultReprMixin):
     def __init__(self, locs):
         self.locs = locs
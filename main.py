@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 import argparse
-import cProfile
+import functools
+import pathlib
 import sys
-import pdb
-import pstats
+import threading
+import time
 
-from common import configvar, locs
+from common import (
+    config_dir,
+    configvar,
+    invalidate_configvars,
+    locs,
+    logger,
+    override_configvars,
+    record_configvar_reads,
+)
 import city_result
+import executor
+import prefetch
+import result_store
+import tracing
+
+# Modules that import numpy are imported by the commands that use them, so that e.g. --help starts
+# quickly (see main_test.py)
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -15,6 +31,24 @@ parser.add_argument(
 parser.add_argument(
     '--profile', action='store_true', help='print out performance profile after run'
 )
+parser.add_argument(
+    '--trace',
+    metavar='FILE',
+    help='time each factor, dataset load and web request, print a table of the time spent per '
+    'factor after the run, and save a Chrome trace of every span to FILE (see tracing.py)',
+)
+parser.add_argument(
+    '--jobs',
+    type=int,
+    default=1,
+    help='number of parallel workers used to compute values (default: 1, i.e. serial)',
+)
+parser.add_argument(
+    '--backend',
+    choices=executor.BACKENDS,
+    default='auto',
+    help='run parallel work on threads, processes, or (auto) whatever each module prefers',
+)
 subparsers = parser.add_subparsers()
 
 ALL_MODULES = [
@@ -44,45 +78,139 @@ def factor_modules():
         """
 
 
-def compute_results(locs=locs.__dict__.values(), impute=False):
+def compute_results(
+    locs=locs.__dict__.values(),
+    impute=False,
+    jobs=1,
+    backend='auto',
+    incremental=False,
+    grid=False,
+):
     """
-    Compute CityResult with the values for each given city * module.
+    Compute the value of each factor for each given city.
+
+    Return: A result_set.ResultSet, sorted from lowest to highest total value.
 
-    Results are returned sorted from lowest to highest value.
+    See executor.compute_all for the meaning of jobs and backend.
+
+    Args:
+        incremental: If True, reuse the values stored in the result_store by previous runs for
+            cells whose configvars and code haven't changed since, and store the rest.
+        grid: If True, the locations are points of a dense grid, e.g. for a heatmap, so modules'
+            grid_annual_values or grid_raw_metrics functions are used. These trade exactness for
+            speed, e.g. by computing one value for a group of nearby points.
     """
     modules = [__import__(name) for name in factor_modules()]
-    city_results = []
-    for loc in locs:
-        result = city_result.CityResult(loc, modules)
-        result.compute()
-        city_results.append(result)
+    locs = list(locs)
+    store = result_store.ResultStore() if incremental else None
+
+    def is_stale(module, loc):
+        return store is None or store.get(module.__name__, loc) is result_store.MISSING
+
+    stale_modules = [m for m in modules if any(is_stale(m, loc) for loc in locs)]
+
+    # Load every module's data up front, concurrently, rather than on its first location. Worker
+    # processes load the data of the modules they compute themselves.
+    parent_modules = [
+        m
+        for m in stale_modules
+        if _batch_function(m, grid) is not None
+        or not executor.runs_in_processes(m, jobs, backend)
+    ]
+    with tracing.span('prefetch', tracing.PREFETCH):
+        prefetch.prefetch(prefetch.module_datasets(parent_modules))
+
+    # Modules with a batch annual_values (or, for linear modules, raw_metrics) function compute all
+    # locations at once
+    precomputed_values = [{} for _ in locs]
+    precomputed_reads = {}
+    for module in stale_modules:
+        batch = _batch_function(module, grid)
+        if batch is not None:
+            idxs = [i for i, loc in enumerate(locs) if is_stale(module, loc)]
+            with (
+                record_configvar_reads() as reads,
+                tracing.span(
+                    module.__name__,
+                    tracing.BATCH,
+                    module=module.__name__,
+                    locations=len(idxs),
+                ),
+            ):
+                values = batch([locs[i] for i in idxs])
+            for i, value in zip(idxs, values):
+                precomputed_values[i][module.__name__] = value
+            precomputed_reads[module.__name__] = reads
+
+    city_results = [
+        city_result.CityResult(loc, modules, values)
+        for loc, values in zip(locs, precomputed_values)
+    ]
+    cells = executor.compute_all(
+        city_results,
+        jobs=jobs,
+        backend=backend,
+        store=store,
+        precomputed_reads=precomputed_reads,
+    )
+    import result_set
+
+    results = result_set.ResultSet.from_cells(locs, modules, cells)
+    if store is not None and store.reused:
+        days = result_store.RESULT_TTL_SECONDS / (24 * 60 * 60)
+        logger.info(
+            f'Reused {len(store.reused):,} values stored by previous runs. They can be up to '
+            f'{days:g} days old, so they may not reflect changes to downloaded data.'
+        )
 
     if impute:
-        city_result.impute_missing_values_with_mean(city_results)
+        results = results.impute_missing_values_with_mean()
+
+    return results.sorted()
 
-    city_results.sort()
-    return city_results
+
+def _batch_function(module, grid):
+    name = 'raw_metrics' if city_result.is_linear(module) else 'annual_values'
+    if grid and hasattr(module, 'grid_' + name):
+        return getattr(module, 'grid_' + name)
+    return getattr(module, name, None)
 
 
 def compute_results_pd(*args, **kwargs):
     """
     Similar to compute_results but return results as a Pandas DataFrame.
     """
-    return city_result.to_pandas(compute_results(*args, **kwargs))
+    return compute_results(*args, **kwargs).to_pandas()
 
 
-def value_summary(args):
+def _cities(args):
     if args.cities == []:
         # Hardcoded list of cities that we fully support
-        cities = locs.__dict__.values()
-    else:
-        cities = args.cities
+        return locs.__dict__.values()
+    return [locs.__dict__[name] for name in args.cities]
+
 
-    city_results = compute_results(cities, impute=args.impute)
+def _add_incremental_argument(subparser):
+    subparser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Reuse the values stored by previous runs for cells whose code and configvars have '
+        'not changed. Stored values can be up to a week old, so they may miss changes to '
+        'downloaded data.',
+    )
+
+
+def value_summary(args):
+    results = compute_results(
+        _cities(args),
+        impute=args.impute,
+        jobs=args.jobs,
+        backend=args.backend,
+        incremental=args.incremental,
+    )
 
     print('All numbers annual benefit (higher is better). Best city first')
-    for result in reversed(city_results):
-        result.print()
+    results[::-1].print()
 
 
 subparser = subparsers.add_parser(
@@ -96,6 +224,333 @@ subparser.add_argument(
     action='store_true',
     help='Impute missing/unknown data using the mean of other cities',
 )
+_add_incremental_argument(subparser)
+
+
+def sensitivity_summary(args):
+    import sensitivity
+
+    df = sensitivity.analyze(
+        functools.partial(
+            compute_results,
+            _cities(args),
+            jobs=args.jobs,
+            backend=args.backend,
+            incremental=args.incremental,
+        ),
+        sensitivity.sensitivity_distributions(),
+        n_samples=args.samples,
+        seed=args.seed,
+    )
+    print(df.to_string(float_format=lambda x: f'{x:,.2f}'))
+
+
+subparser = subparsers.add_parser(
+    'sensitivity',
+    description='Vary the configvars in config/sensitivity_distributions.yaml and print how '
+    'likely each city is to come out on top',
+)
+subparser.set_defaults(func=sensitivity_summary)
+subparser.add_argument('cities', nargs='*')
+subparser.add_argument(
+    '--samples',
+    type=int,
+    default=20000,
+    help='number of Monte Carlo samples (default: 20000)',
+)
+subparser.add_argument('--seed', type=int, help='random seed, for reproducible results')
+_add_incremental_argument(subparser)
+
+
+def breakeven_summary(args):
+    from breakeven import breakeven
+
+    results = compute_results(
+        _cities(args),
+        impute=args.impute,
+        jobs=args.jobs,
+        backend=args.backend,
+        incremental=args.incremental,
+    )
+    df = breakeven(results)
+    if df.empty:
+        print('No weight of a linear factor changes the ranking')
+        return
+    for row in df.to_dict('records'):
+        print(
+            f'{row["Trailer"].upper()} overtakes {row["Leader"].upper()} if '
+            f'{row["Weight"]} goes {row["Direction"]} {row["Break-even"]:,.2f} '
+            f'(currently {row["Current"]:,.2f})'
+        )
+
+
+subparser = subparsers.add_parser(
+    'breakeven',
+    description='For each weight of a linear factor (e.g. value_of_transit), print the value at '
+    'which each pair of cities would swap places',
+)
+subparser.set_defaults(func=breakeven_summary)
+subparser.add_argument('cities', nargs='*')
+subparser.add_argument(
+    '--impute',
+    action='store_true',
+    help='Impute missing/unknown data using the mean of other cities',
+)
+_add_incremental_argument(subparser)
+
+
+def grid_heatmap(args):
+    import heatmap
+
+    overrides = {'factor_modules': args.factors} if args.factors else {}
+    with override_configvars(overrides):
+        hm = heatmap.score_grid(
+            functools.partial(
+                compute_results,
+                impute=args.impute,
+                jobs=args.jobs,
+                backend=args.backend,
+                grid=True,
+            ),
+            args.bbox,
+            args.resolution,
+        )
+
+    hm.save(args.out)
+    print(f'Saved {hm.total.shape[0]} x {hm.total.shape[1]} rasters to {args.out}')
+    if args.html:
+        hm.to_folium(locs=locs.__dict__.values()).save(args.html)
+        print(f'Saved map to {args.html}')
+
+
+subparser = subparsers.add_parser(
+    'heatmap',
+    description='Score a grid of locations over a bounding box and save the value of each factor '
+    'and the total as rasters. See heatmap.py for details.',
+)
+subparser.set_defaults(func=grid_heatmap)
+subparser.add_argument(
+    '--bbox',
+    type=float,
+    nargs=4,
+    required=True,
+    metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+    help='bounding box in degrees',
+)
+subparser.add_argument(
+    '--resolution',
+    type=float,
+    default=0.01,
+    help='size of each grid cell in degrees (default: 0.01, about 1 km)',
+)
+subparser.add_argument(
+    '--factors',
+    nargs='+',
+    help='factor modules to use instead of config/factor_modules.yaml, e.g. to leave out ones '
+    'that query a web service for every cell',
+)
+subparser.add_argument(
+    '--impute',
+    action='store_true',
+    help='Impute missing/unknown data using the mean of the other cells',
+)
+subparser.add_argument(
+    '--out',
+    default='heatmap.npz',
+    help='where to save the rasters (default: heatmap.npz)',
+)
+subparser.add_argument('--html', help='also save a map of the total to this HTML file')
+
+
+def top_k_search(args):
+    import search
+
+    overrides = {'factor_modules': args.factors} if args.factors else {}
+    with override_configvars(overrides):
+        results, n_scored = search.search(
+            functools.partial(
+                compute_results, jobs=args.jobs, backend=args.backend, grid=True
+            ),
+            [__import__(name) for name in factor_modules()],
+            args.bbox,
+            k=args.k,
+            resolution=args.resolution,
+            coarse_resolution=args.coarse_resolution,
+        )
+
+    df = results.to_pandas()
+    df.insert(0, 'Lat', [loc.lat for loc in results.locs])
+    df.insert(1, 'Lon', [loc.lon for loc in results.locs])
+    print(df.reset_index(drop=True).to_string(float_format=lambda x: f'{x:,.4f}'))
+    print(f'\nScored {n_scored:,} points')
+
+
+subparser = subparsers.add_parser(
+    'search',
+    description='Find the best points in a bounding box, scoring a coarse grid first and only '
+    'refining the cells that might beat the k-th best point. See search.py for details.',
+)
+subparser.set_defaults(func=top_k_search)
+subparser.add_argument(
+    '--bbox',
+    type=float,
+    nargs=4,
+    required=True,
+    metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+    help='bounding box in degrees',
+)
+subparser.add_argument(
+    '--k', type=int, default=10, help='number of points to find (default: 10)'
+)
+subparser.add_argument(
+    '--resolution',
+    type=float,
+    default=0.005,
+    help='size of the cells of the finest grid in degrees (default: 0.005, about 500 m)',
+)
+subparser.add_argument(
+    '--coarse-resolution',
+    type=float,
+    help='size of the cells of the first grid in degrees (default: 16 times --resolution)',
+)
+subparser.add_argument(
+    '--factors',
+    nargs='+',
+    help='factor modules to use instead of config/factor_modules.yaml',
+)
+
+
+def _config_file_states():
+    ret = {}
+    for path in config_dir().iterdir():
+        if path.is_file():
+            stat = path.stat()
+            ret[path.name] = (stat.st_mtime_ns, stat.st_size)
+    return ret
+
+
+def _reload_changed_configs(states):
+    """
+    Reload the configvars whose files changed since states was returned by _config_file_states.
+
+    Return: (new states, names of the changed files).
+    """
+    new_states = _config_file_states()
+    changed = {
+        name
+        for name in states.keys() | new_states.keys()
+        if states.get(name) != new_states.get(name)
+    }
+    if changed:
+        names = {pathlib.Path(name).stem for name in changed}
+        # .py configs can read other configs, so reload them on any change
+        names |= {
+            pathlib.Path(name).stem for name in new_states if name.endswith('.py')
+        }
+        invalidate_configvars(names)
+    return new_states, changed
+
+
+def watch(args):
+    states = None
+    try:
+        while True:
+            if states is None:
+                states, changed = _config_file_states(), True
+            else:
+                states, changed = _reload_changed_configs(states)
+                if changed:
+                    print(f'Changed: {", ".join(sorted(changed))}\n')
+            if changed:
+                try:
+                    value_summary(args)
+                except Exception:  # noqa: BLE001
+                    # Keep watching, e.g. so that a typo in a .py config can be fixed
+                    logger.exception('Failed to compute the summary')
+                print(f'Watching {config_dir()} for changes...')
+
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+subparser = subparsers.add_parser(
+    'watch',
+    description='Print a summary like the summary command, and print it again whenever a file in '
+    'config/ changes. Datasets and results stay loaded between runs, so reruns are fast.',
+)
+subparser.set_defaults(func=watch, incremental=True)
+subparser.add_argument('cities', nargs='*')
+subparser.add_argument(
+    '--impute',
+    action='store_true',
+    help='Impute missing/unknown data using the mean of other cities',
+)
+subparser.add_argument(
+    '--interval',
+    type=float,
+    default=0.5,
+    help='seconds between checks for changes to config files (default: 0.5)',
+)
+
+
+def run_daemon(args):
+    # Only imported here because http.server is slow to import
+    import daemon
+    import tiles
+
+    # Load all of the enabled modules' data before taking requests
+    prefetch.prefetch(
+        prefetch.module_datasets([__import__(name) for name in factor_modules()])
+    )
+
+    states = _config_file_states()
+    states_lock = threading.Lock()
+
+    def reload_changed_configs():
+        nonlocal states
+        with states_lock:
+            states, _ = _reload_changed_configs(states)
+
+    def compute(locs, impute=False):
+        reload_changed_configs()
+        return compute_results(
+            locs,
+            impute,
+            jobs=args.jobs,
+            backend=args.backend,
+            incremental=args.incremental,
+        )
+
+    def tile(z, x, y):
+        reload_changed_configs()
+        return tiles.tile(
+            functools.partial(
+                compute_results, jobs=args.jobs, backend=args.backend, grid=True
+            ),
+            [__import__(name) for name in factor_modules()],
+            z,
+            x,
+            y,
+            store=tiles.TileStore(),
+        )
+
+    port = daemon.DEFAULT_PORT if args.port is None else args.port
+    daemon.serve(compute, port=port, tile=tile)
+
+
+subparser = subparsers.add_parser(
+    'daemon',
+    description='Keep datasets loaded and serve scores and map tiles to other processes over '
+    'localhost HTTP. See daemon.py for the API and a client.',
+)
+subparser.set_defaults(func=run_daemon)
+subparser.add_argument(
+    '--port',
+    type=int,
+    help='port to listen on (default: 8765, daemon.DEFAULT_PORT)',
+)
+_add_incremental_argument(subparser)
 
 
 def main(args):
@@ -107,18 +562,39 @@ def main(args):
         sys.exit(1)
 
 
+def traced_main(args):
+    """
+    Run main while recording tracing spans, then print a table of them and save them to args.trace,
+    even if main fails or is interrupted.
+    """
+    with tracing.record() as trace:
+        try:
+            main(args)
+        finally:
+            print('\nTime spent per factor module (see tracing.Trace.factor_table)')
+            print(trace.factor_table().to_string(float_format=lambda x: f'{x:,.3f}'))
+            trace.save(args.trace)
+            print(f'Saved a Chrome trace to {args.trace}')
+
+
 if __name__ == '__main__' and not hasattr(sys, 'ps1'):
     args = parser.parse_args()
+    run = traced_main if args.trace else main
     try:
         if args.profile:
+            import cProfile
+            import pstats
+
             with cProfile.Profile() as pr:
-                main(args)
+                run(args)
             p = pstats.Stats(pr)
             p.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(50)
         else:
-            main(args)
+            run(args)
     except:  # noqa: E722
         if args.pdb:
+            import pdb
+
             pdb.post_mortem()
         else:
             raise
@@ -0,0 +1,65 @@
+import pathlib
+import subprocess
+import sys
+import time
+import types
+
+import main
+
+# Libraries that take a long time to import, and should only be imported by the code that uses them
+_HEAVY_MODULES = [
+    'pandas',
+    'geopandas',
+    'pyproj',
+    'geopy',
+    'requests',
+    'requests_cache',
+    'shapely',
+    'http.server',
+    'multiprocessing',
+]
+# Seconds that `main.py --help` may take, including starting Python
+_STARTUP_BUDGET_SECONDS = 0.3
+
+
+def test_heavy_libraries_are_imported_lazily():
+    code = f"""
+import main, {', '.join(main.ALL_MODULES)}
+
+import sys
+print(*[name for name in {_HEAVY_MODULES!r} if name in sys.modules])
+"""
+    imported = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=pathlib.Path(__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert imported.strip() == ''
+
+
+def test_startup_time():
+    def seconds():
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, 'main.py', '--help'],
+            cwd=pathlib.Path(__file__).parent,
+            capture_output=True,
+            check=True,
+        )
+        return time.perf_counter() - start
+
+    # The fastest of several runs, so that other load on the machine doesn't fail the test
+    assert min(seconds() for _ in range(5)) < _STARTUP_BUDGET_SECONDS
+
+
+def test_grid_batch_functions():
+    module = types.SimpleNamespace(
+        raw_metric=None, WEIGHT=None, raw_metrics='exact', grid_raw_metrics='grid'
+    )
+    assert main._batch_function(module, grid=False) == 'exact'
+    assert main._batch_function(module, grid=True) == 'grid'
+    # Named locations aren't approximated, even if that means computing them one at a time
+    del module.raw_metrics
+    assert main._batch_function(module, grid=False) is None
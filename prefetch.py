@@ -0,0 +1,114 @@
+"""
+Load the datasets that factor modules need before computing any values.
+
+Each factor module loads its data lazily, so without this the first location valued by each module
+stalls on a series of large downloads. Modules can instead list the datasets they need in a DATASETS
+module attribute, e.g.
+
+    DATASETS = [geo._counties_index, noaa.noaa_isd_history_csv_parsed]
+
+Each dataset is a zero-argument loader that caches its result, usually a util.locked_cache function
+or a functools.partial of one. A loader that calls other loaders declares them with @depends_on, so
+that prefetch() runs them first instead of loading the same data twice on different threads:
+
+    @prefetch.depends_on(_counties_df)
+    @util.locked_cache
+    def _counties_index():
+        return PolygonIndex(_counties_df().geometry)
+
+prefetch() then loads every dataset, running independent ones concurrently.
+"""
+
+import concurrent.futures
+import functools
+
+# Loading is dominated by downloads and parsing in native code, so threads overlap well
+DEFAULT_JOBS = 8
+
+
+def depends_on(*loaders):
+    """
+    Declare that the decorated dataset loader calls each of the given loaders.
+    """
+
+    def decorator(f):
+        f.dataset_dependencies = loaders
+        return f
+
+    return decorator
+
+
+def _key(loader):
+    # Partials are created on the fly, so compare them by what they call
+    if isinstance(loader, functools.partial):
+        return loader.func, loader.args, tuple(sorted(loader.keywords.items()))
+    return loader
+
+
+def _dependencies(loader):
+    if hasattr(loader, 'dataset_dependencies'):
+        return loader.dataset_dependencies
+    if isinstance(loader, functools.partial):
+        return _dependencies(loader.func)
+    return ()
+
+
+def dependency_graph(loaders):
+    """
+    Find all of the given loaders and their transitive dependencies.
+
+    Return: A dict of {key: (loader, set of keys of its dependencies)}.
+    """
+    graph = {}
+    pending = list(loaders)
+    while pending:
+        loader = pending.pop()
+        key = _key(loader)
+        if key in graph:
+            continue
+        deps = _dependencies(loader)
+        graph[key] = (loader, {_key(dep) for dep in deps})
+        pending.extend(deps)
+
+    return graph
+
+
+def prefetch(loaders, jobs=DEFAULT_JOBS):
+    """
+    Call each loader after its dependencies, running up to jobs loaders at a time.
+
+    The first exception raised by a loader is re-raised once running loaders have finished.
+    """
+    graph = dependency_graph(loaders)
+    waiting = {key: deps for key, (_, deps) in graph.items()}
+    done = set()
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        running = {}
+        while waiting or running:
+            for key in [key for key, deps in waiting.items() if deps <= done]:
+                del waiting[key]
+                running[pool.submit(graph[key][0])] = key
+
+            if not running:
+                raise ValueError(f'Dependency cycle among datasets: {list(waiting)}')
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                key = running.pop(future)
+                try:
+                    future.result()
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
+                done.add(key)
+
+
+def module_datasets(modules):
+    """
+    Return: The datasets declared by the given factor modules.
+    """
+    return [
+        dataset for module in modules for dataset in getattr(module, 'DATASETS', [])
+    ]
@@ -0,0 +1,32 @@
+import functools
+import pytest
+import threading
+
+import prefetch
+
+
+def test_prefetch_loads_dependencies_first_and_once():
+    calls = []
+    lock = threading.Lock()
+
+    def loader(name):
+        with lock:
+            calls.append(name)
+
+    raw = functools.partial(loader, 'raw')
+    index = prefetch.depends_on(raw)(functools.partial(loader, 'index'))
+    other = prefetch.depends_on(raw)(lambda: loader('other'))
+
+    # Partials with the same function and arguments are the same dataset
+    prefetch.prefetch([index, other, functools.partial(loader, 'raw')])
+
+    assert sorted(calls) == ['index', 'other', 'raw']
+    assert calls[0] == 'raw'
+
+
+def test_prefetch_reraises_loader_errors():
+    def fail():
+        raise RuntimeError('download failed')
+
+    with pytest.raises(RuntimeError, match='download failed'):
+        prefetch.prefetch([fail])
@@ -0,0 +1,255 @@
+"""
+The annual value of each factor for a set of locations, stored as a locations x factors array.
+"""
+
+from city_result import CityResult, Proxy, is_linear
+import enum
+import numpy as np
+
+
+class Status(enum.IntEnum):
+    OK = 0
+    UNSUPPORTED = 1
+    IMPUTED = 2
+    PROXY = 3
+
+
+class ResultSet:
+    """
+    Attributes:
+        locs: List of the Locations, one per row.
+        factors: List of the factor names (module FACTOR_NAMEs), one per column.
+        values: Float array of shape (len(locs), len(factors)) with the annual value of each
+            factor at each location, NaN where the factor is unsupported.
+        status: Array of Status values with the same shape as values.
+        weight_names: For each factor computed by a single linear module (see
+            city_result.is_linear), the name of the configvar it is weighted by, or else None.
+        metrics: Array with the same shape as values, with the raw metric of each factor that has
+            a weight and NaN elsewhere.
+        weights: Dict of {configvar name: value} with the value of each weight in weight_names.
+    """
+
+    def __init__(
+        self,
+        locs,
+        factors,
+        values,
+        status,
+        weight_names=None,
+        metrics=None,
+        weights=None,
+    ):
+        self.locs = list(locs)
+        self.factors = list(factors)
+        self.values = np.asarray(values, dtype=float).reshape(
+            len(self.locs), len(self.factors)
+        )
+        self.status = np.asarray(status, dtype=np.int8).reshape(self.values.shape)
+        self.weight_names = (
+            list(weight_names) if weight_names is not None else [None] * len(factors)
+        )
+        self.metrics = (
+            np.asarray(metrics, dtype=float).reshape(self.values.shape)
+            if metrics is not None
+            else np.full(self.values.shape, np.nan)
+        )
+        self.weights = dict(weights or {})
+
+    @classmethod
+    def from_cells(cls, locs, modules, cells):
+        """
+        Build a ResultSet from the value of each module at each location.
+
+        Modules with the same FACTOR_NAME are combined into one factor by averaging their supported
+        values. A factor computed by a single module keeps its status, so e.g. proxy values stay
+        marked as proxies.
+
+        Args:
+            cells: For each location, a list with the value (or raw metric, for linear modules) of
+                each module, as returned by CityResult.compute_value. Linear modules' weights are
+                read here.
+        """
+        module_values = np.full((len(locs), len(modules)), np.nan)
+        module_status = np.zeros((len(locs), len(modules)), dtype=np.int8)
+        for i, row in enumerate(cells):
+            for j, value in enumerate(row):
+                if value is CityResult.UNSUPPORTED:
+                    module_status[i, j] = Status.UNSUPPORTED
+                else:
+                    module_values[i, j] = value
+                    if isinstance(value, Proxy):
+                        module_status[i, j] = Status.PROXY
+
+        module_metrics = np.full(module_values.shape, np.nan)
+        weights = {}
+        for j, module in enumerate(modules):
+            if is_linear(module):
+                weights[module.WEIGHT.__name__] = module.WEIGHT()
+                module_metrics[:, j] = module_values[:, j]
+                module_values[:, j] *= weights[module.WEIGHT.__name__]
+
+        factors = list(dict.fromkeys(module.FACTOR_NAME for module in modules))
+        values = np.full((len(locs), len(factors)), np.nan)
+        status = np.zeros((len(locs), len(factors)), dtype=np.int8)
+        weight_names = [None] * len(factors)
+        metrics = np.full(values.shape, np.nan)
+        for k, factor in enumerate(factors):
+            cols = [j for j, m in enumerate(modules) if m.FACTOR_NAME == factor]
+            if len(cols) == 1:
+                values[:, k] = module_values[:, cols[0]]
+                status[:, k] = module_status[:, cols[0]]
+                if is_linear(modules[cols[0]]):
+                    weight_names[k] = modules[cols[0]].WEIGHT.__name__
+                    metrics[:, k] = module_metrics[:, cols[0]]
+                continue
+            supported = module_status[:, cols] != Status.UNSUPPORTED
+            counts = supported.sum(axis=1)
+            sums = np.where(supported, module_values[:, cols], 0).sum(axis=1)
+            values[:, k] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+            status[:, k] = np.where(counts > 0, Status.OK, Status.UNSUPPORTED)
+
+        return cls(locs, factors, values, status, weight_names, metrics, weights)
+
+    def __len__(self):
+        return len(self.locs)
+
+    def __getitem__(self, idx):
+        """
+        Select locations with anything that can index a numpy array, e.g. a slice or a list of
+        row numbers.
+        """
+        rows = np.arange(len(self))[idx]
+        return ResultSet(
+            [self.locs[i] for i in np.atleast_1d(rows)],
+            self.factors,
+            self.values[rows],
+            self.status[rows],
+            self.weight_names,
+            self.metrics[rows],
+            self.weights,
+        )
+
+    def select(self, locs):
+        """
+        Return: A copy with the rows of the given Locations, in the given order.
+        """
+        rows = {loc: i for i, loc in enumerate(self.locs)}
+        return self[[rows[loc] for loc in locs]]
+
+    @property
+    def unsupported(self):
+        return self.status == Status.UNSUPPORTED
+
+    @property
+    def imputed(self):
+        return self.status == Status.IMPUTED
+
+    @property
+    def proxy(self):
+        return self.status == Status.PROXY
+
+    @property
+    def totals(self):
+        """
+        The total annual value of each location. Unsupported factors count as 0.
+        """
+        return np.where(self.unsupported, 0, self.values).sum(axis=1)
+
+    def weight_slopes(self, name):
+        """
+        Return: The change in each location's total per unit change of the weight with the given
+            configvar name, i.e. the sum of the raw metrics of the factors it weighs. Unsupported
+            factors count as 0, as in totals.
+        """
+        cols = [k for k, w in enumerate(self.weight_names) if w == name]
+        return np.where(self.unsupported[:, cols], 0, self.metrics[:, cols]).sum(axis=1)
+
+    def sorted(self):
+        """
+        Return: A copy with the locations sorted from lowest to highest total.
+        """
+        return self[np.argsort(self.totals, kind='stable')]
+
+    def impute_missing_values_with_mean(self):
+        """
+        Return: A copy where each unsupported value is replaced with the mean value of that factor
+            over the locations that support it.
+        """
+        if self.imputed.any():
+            raise ValueError('Should not re-impute on already imputed results')
+
+        supported = ~self.unsupported
+        counts = np.maximum(supported.sum(axis=0), 1)
+        means = np.where(supported, self.values, 0).sum(axis=0) / counts
+        metric_means = np.where(supported, self.metrics, 0).sum(axis=0) / counts
+        fill = self.unsupported & supported.any(axis=0)
+        return ResultSet(
+            self.locs,
+            self.factors,
+            np.where(fill, means, self.values),
+            np.where(fill, Status.IMPUTED, self.status),
+            self.weight_names,
+            np.where(fill, metric_means, self.metrics),
+            self.weights,
+        )
+
+    def reweighted(self, weights):
+        """
+        Re-rank under different weights without recomputing any factor data.
+
+        Args:
+            weights: Dict of {configvar name: value}, e.g. {'value_of_transit': 3000}. Names that
+                aren't the weight of any factor are ignored.
+
+        Return: A copy with the values of the factors with those weights recomputed from their raw
+            metrics.
+        """
+        values = self.values.copy()
+        for k, name in enumerate(self.weight_names):
+            if name in weights:
+                values[:, k] = self.metrics[:, k] * weights[name]
+        return ResultSet(
+            self.locs,
+            self.factors,
+            values,
+            self.status,
+            self.weight_names,
+            self.metrics,
+            self.weights | {k: v for k, v in weights.items() if k in self.weights},
+        )
+
+    def to_pandas(self):
+        """
+        Return: A DataFrame indexed by location name with a column for each factor, with NaN for
+            unsupported values, and a Total column.
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(
+            self.values,
+            index=[loc.name.upper() for loc in self.locs],
+            columns=self.factors,
+        )
+        df['Total'] = self.totals
+        return df
+
+    def print(self):
+        for loc, values, status, total in zip(
+            self.locs, self.values, self.status, self.totals
+        ):
+            print(loc.name.upper())
+            for factor, value, s in zip(self.factors, values, status):
+                print(f'{factor + ":":16} ', end='')
+                if s == Status.UNSUPPORTED:
+                    print('UNSUPPORTED (total will be inaccurate)')
+                    continue
+                print(f'{value:8,.0f}', end='')
+                if s == Status.IMPUTED:
+                    print(' (IMPUTED)')
+                elif s == Status.PROXY:
+                    print(' (PROXY)')
+                else:
+                    print()
+
+            print(f'{"Total:":16} {total:8,.0f}')
+            print()
@@ -0,0 +1,78 @@
+import types
+
+import numpy as np
+import pytest
+
+from city_result import CityResult, Proxy
+import location
+from result_set import ResultSet, Status
+
+_U = CityResult.UNSUPPORTED
+
+
+def _module(name, factor):
+    return types.SimpleNamespace(__name__=name, FACTOR_NAME=factor)
+
+
+@pytest.fixture
+def results():
+    locs = [location.Location(name, 0, 0) for name in ['a', 'b', 'c']]
+    modules = [_module('m1', 'X'), _module('m2', 'X'), _module('m3', 'Y')]
+    cells = [
+        [1.0, 3.0, Proxy(10.0)],
+        [_U, 5.0, _U],
+        [_U, _U, 4.0],
+    ]
+    return ResultSet.from_cells(locs, modules, cells)
+
+
+def test_from_cells(results):
+    assert results.factors == ['X', 'Y']
+    np.testing.assert_array_equal(results.values, [[2, 10], [5, np.nan], [np.nan, 4]])
+    assert results.status.tolist() == [
+        [Status.OK, Status.PROXY],
+        [Status.OK, Status.UNSUPPORTED],
+        [Status.UNSUPPORTED, Status.OK],
+    ]
+    assert results.totals.tolist() == [12, 5, 4]
+
+
+def test_sorted(results):
+    assert [loc.name for loc in results.sorted().locs] == ['c', 'b', 'a']
+
+
+def test_impute(results):
+    imputed = results.impute_missing_values_with_mean()
+    assert imputed.values[1, 1] == 7
+    assert imputed.values[2, 0] == 3.5
+    assert imputed.imputed.sum() == 2
+    assert imputed.totals.tolist() == [12, 12, 7.5]
+    with pytest.raises(ValueError):
+        imputed.impute_missing_values_with_mean()
+
+
+def test_to_pandas(results):
+    df = results.to_pandas()
+    assert df.index.tolist() == ['A', 'B', 'C']
+    assert df.columns.tolist() == ['X', 'Y', 'Total']
+    assert np.isnan(df.loc['B', 'Y'])
+
+
+def test_reweighted():
+    module = types.SimpleNamespace(
+        __name__='linear',
+        FACTOR_NAME='X',
+        raw_metric=None,
+        WEIGHT=lambda: 100,
+    )
+    module.WEIGHT.__name__ = 'value_of_x'
+    locs = [location.Location(name, 0, 0) for name in ['a', 'b', 'c']]
+    results = ResultSet.from_cells(locs, [module], [[0.5], [0.25], [_U]])
+    assert results.weights == {'value_of_x': 100}
+    assert results.totals.tolist() == [50, 25, 0]
+
+    reweighted = results.impute_missing_values_with_mean().reweighted(
+        {'value_of_x': -4, 'value_of_y': 1}
+    )
+    assert reweighted.weights == {'value_of_x': -4}
+    assert reweighted.totals.tolist() == [-2, -1, -1.5]
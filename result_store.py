@@ -0,0 +1,147 @@
+"""
+Persistent store of the annual value of each (module, location) cell, for incremental reruns.
+
+Each stored value records the configvars that were read while computing it (see
+common.record_configvar_reads), with a fingerprint of each one's config file, and a hash of the
+source of the module and the local modules it uses. A stored value is reused as long as none of
+those have changed, so after editing one configvar only the cells that read it are recomputed.
+
+Changes to downloaded data aren't tracked, so stored values expire after RESULT_TTL_SECONDS.
+"""
+
+import city_result
+from common import (
+    config_fingerprint,
+    mark_configvars_read,
+    overridden_configvars,
+)
+import functools
+import pathlib
+import sys
+import types
+import util
+
+_REPO_ROOT = pathlib.Path(__file__).parent
+_STORE_DIR = _REPO_ROOT / '.cache' / 'result_store'
+RESULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Returned by ResultStore.get for cells that need to be recomputed
+MISSING = object()
+
+
+@functools.cache
+def _is_local(module):
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return False
+    path = pathlib.Path(path).resolve()
+    return path.is_relative_to(_REPO_ROOT) and not any(
+        part in ('venv', '.venv', 'site-packages') for part in path.parts
+    )
+
+
+def _local_dependencies(module):
+    """Find the local modules that module uses directly, by `import x` or `from x import y`."""
+    deps = set()
+    for value in vars(module).values():
+        if isinstance(value, types.ModuleType):
+            dep = value
+        else:
+            dep = sys.modules.get(getattr(value, '__module__', None) or '')
+        if dep is not None and dep is not module and _is_local(dep):
+            deps.add(dep)
+    return deps
+
+
+@functools.cache
+def source_hash(module_name):
+    """
+    Hash the source of a module and of every local module it transitively uses.
+    """
+    seen = {}
+    # city_result decides what is computed for each cell (e.g. raw metrics for linear modules)
+    pending = [sys.modules[module_name], city_result]
+    while pending:
+        module = pending.pop()
+        if module.__name__ in seen:
+            continue
+        seen[module.__name__] = module
+        pending.extend(_local_dependencies(module))
+        # Submodules of a package (e.g. climate.noaa) are part of its source
+        pending.extend(
+            m
+            for name, m in list(sys.modules.items())
+            if name.startswith(module.__name__ + '.') and _is_local(m)
+        )
+
+    import hashlib
+
+    h = hashlib.sha1()
+    for name in sorted(seen):
+        h.update(name.encode() + b'\0')
+        h.update(pathlib.Path(seen[name].__file__).read_bytes())
+    return h.hexdigest()
+
+
+class ResultStore:
+    """
+    Config fingerprints are read once per ResultStore, so create a new one for each run.
+    ResultStores share the underlying diskcache.Cache (see util.open_disk_cache), so this is cheap.
+
+    Attributes:
+        reused: Set of the keys of the cells whose stored value get has returned.
+    """
+
+    def __init__(self, directory=_STORE_DIR):
+        self._cache = util.open_disk_cache(directory)
+        self._fingerprints = {}
+        self.reused = set()
+
+    def _fingerprint(self, name):
+        if name not in self._fingerprints:
+            self._fingerprints[name] = config_fingerprint(name)
+        return self._fingerprints[name]
+
+    @staticmethod
+    def _key(module_name, loc):
+        return module_name, loc.name, loc.lat, loc.lon
+
+    def get(self, module_name, loc):
+        """
+        Return: The stored value of the cell, or MISSING if there is none, it is stale, or it reads
+            an overridden configvar. Returning a value counts as reading the configvars it was
+            computed from, for record_configvar_reads.
+        """
+        entry = self._cache.get(self._key(module_name, loc))
+        if entry is None or entry['source'] != source_hash(module_name):
+            return MISSING
+        if entry['configvars'].keys() & overridden_configvars():
+            return MISSING
+        if any(
+            self._fingerprint(name) != fingerprint
+            for name, fingerprint in entry['configvars'].items()
+        ):
+            return MISSING
+        mark_configvars_read(entry['configvars'])
+        self.reused.add(self._key(module_name, loc))
+        return entry['value']
+
+    def put(self, module_name, loc, value, configvar_reads):
+        """
+        Store the value of a cell along with the names of the configvars read to compute it.
+
+        Values computed with overridden configvars aren't stored.
+        """
+        if configvar_reads & overridden_configvars():
+            return
+        self._cache.set(
+            self._key(module_name, loc),
+            {
+                'value': value,
+                'source': source_hash(module_name),
+                'configvars': {
+                    name: self._fingerprint(name) for name in configvar_reads
+                },
+            },
+            expire=RESULT_TTL_SECONDS,
+        )
@@ -0,0 +1,78 @@
+import sys
+import time
+
+import pytest
+
+import common
+from common import override_configvars, record_configvar_reads
+import location
+import result_store
+
+_LOC = location.Location('a', 1.0, 2.0)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Read configvar fingerprints from files in tmp_path rather than config/
+    monkeypatch.setattr(
+        common,
+        '_config_paths',
+        lambda name: (tmp_path / (name + '.yaml'), tmp_path / (name + '.py')),
+    )
+    return result_store.ResultStore(tmp_path / 'store')
+
+
+def test_get_put(store):
+    assert store.get('location', _LOC) is result_store.MISSING
+    store.put('location', _LOC, 123.0, {'x'})
+    with record_configvar_reads() as reads:
+        assert store.get('location', _LOC) == 123.0
+    # Reusing a value counts as reading the configvars it was computed from
+    assert reads == {'x'}
+    assert store.reused == {('location', 'a', 1.0, 2.0)}
+    assert (
+        store.get('location', location.Location('b', 1.0, 2.0)) is result_store.MISSING
+    )
+
+
+def test_config_edit_invalidates(store, tmp_path):
+    (tmp_path / 'x.yaml').write_text('1\n')
+    store.put('location', _LOC, 123.0, {'x', 'y'})
+    (tmp_path / 'x.yaml').write_text('2\n')
+    # Fingerprints are only read once per store
+    assert store.get('location', _LOC) == 123.0
+    new_store = result_store.ResultStore(tmp_path / 'store')
+    assert new_store.get('location', _LOC) is result_store.MISSING
+
+
+def test_overridden_configvars_are_not_reused(store):
+    store.put('location', _LOC, 123.0, {'x'})
+    with override_configvars({'x': 5}):
+        assert store.get('location', _LOC) is result_store.MISSING
+        store.put('location', _LOC, 456.0, {'x'})
+    assert store.get('location', _LOC) == 123.0
+
+
+def test_source_edit_invalidates(store, monkeypatch):
+    store.put('location', _LOC, 123.0, set())
+    monkeypatch.setattr(result_store, 'source_hash', lambda module_name: 'edited')
+    assert store.get('location', _LOC) is result_store.MISSING
+
+
+def test_source_hash_covers_local_dependencies():
+    import sensitivity
+
+    deps = result_store._local_dependencies(sensitivity)
+    assert sys.modules['common'] in deps
+    assert sys.modules['numpy'] not in deps
+    assert result_store.source_hash('sensitivity') != result_store.source_hash(
+        'geohash'
+    )
+
+
+def test_values_expire(store, monkeypatch):
+    monkeypatch.setattr(result_store, 'RESULT_TTL_SECONDS', 0.1)
+    store.put('location', _LOC, 123.0, set())
+    assert store.get('location', _LOC) == 123.0
+    time.sleep(0.2)
+    assert store.get('location', _LOC) is result_store.MISSING
@@ -0,0 +1,204 @@
+"""
+Find the best-scoring points in a region without scoring every point of a fine grid.
+
+The search works coarse to fine. It scores the centers of a coarse grid of cells, then splits each
+cell into four and scores the children, but only for cells that might contain a point that beats
+the k-th best point found so far. Whether a cell might is decided by estimating the best value of
+each factor over the cell:
+
+- Factor modules can give true upper bounds with annual_value_upper_bounds(boxes), like housing,
+  whose value only depends on which (neighborhood, ZIP) pair a point is in.
+- Other factors are estimated from the range of values scored around the cell: the cell's value
+  plus the spread of the values of it and its neighbors (e.g. its sibling cells, which share a
+  parent). This is not a bound. Many factors are constant over large areas (e.g. everything served
+  by one weather station) or change smoothly, so it usually works, but a factor that spikes inside
+  a cell without showing up at any nearby cell center can be missed.
+
+So the search is exact, i.e. finds the same points as scoring every point of the fine grid, only if
+every factor has annual_value_upper_bounds. Otherwise it's a heuristic, and a warning is logged
+saying which factors it's a heuristic for.
+
+Points where any factor is unsupported are never returned, since their totals would be misleading.
+"""
+
+import city_result
+from common import logger
+import location
+import numpy as np
+from result_set import ResultSet
+
+
+def _cell_locations(lats, lons):
+    return [
+        location.Location(f'{lat:.6f},{lon:.6f}', float(lat), float(lon))
+        for lat, lon in zip(lats, lons)
+    ]
+
+
+def _neighborhood_ranges(rows, cols, values):
+    """
+    Find the max and min of values over each cell's 3 x 3 neighborhood of scored cells.
+
+    Args:
+        rows, cols: Integer grid positions of the scored cells.
+        values: Array of shape (len(rows), n) with NaN where a value is missing.
+
+    Return: (maxes, mins, counts), where maxes and mins are arrays like values, NaN where the
+        whole neighborhood is NaN, and counts has the number of non-NaN values in each
+        neighborhood.
+    """
+    row0, col0 = rows.min(), cols.min()
+    grid = np.full(
+        (rows.max() - row0 + 3, cols.max() - col0 + 3, values.shape[1]), np.nan
+    )
+    grid[rows - row0 + 1, cols - col0 + 1] = values
+
+    maxes = np.full(values.shape, np.nan)
+    mins = np.full(values.shape, np.nan)
+    counts = np.zeros(values.shape, dtype=int)
+    for dr in (0, 1, 2):
+        for dc in (0, 1, 2):
+            neighbor = grid[rows - row0 + dr, cols - col0 + dc]
+            maxes = np.fmax(maxes, neighbor)
+            mins = np.fmin(mins, neighbor)
+            counts += ~np.isnan(neighbor)
+    return maxes, mins, counts
+
+
+def _bounded_module(modules, factor):
+    """
+    Return: The module that computes factor, if it gives upper bounds for it, else None.
+    """
+    factor_modules = [m for m in modules if m.FACTOR_NAME == factor]
+    if (
+        len(factor_modules) == 1
+        and hasattr(factor_modules[0], 'annual_value_upper_bounds')
+        and not city_result.is_linear(factor_modules[0])
+    ):
+        return factor_modules[0]
+    return None
+
+
+def estimate_best_totals(results, modules, rows, cols, boxes):
+    """
+    Estimate the best total of any supported point in each of a level's cells.
+
+    Factors with annual_value_upper_bounds are bounded; the rest are estimated, see the module
+    docstring.
+
+    Args:
+        results: ResultSet of the cell centers.
+        modules: The factor modules used to compute results.
+        rows, cols: Integer grid positions of the cells at this level.
+        boxes: Array of (south, west, north, east) of each cell.
+
+    Return: A numpy array with an estimate for each cell, -inf for cells that can't contain a
+        supported point.
+    """
+    values = np.where(results.unsupported, np.nan, results.values)
+    maxes, mins, counts = _neighborhood_ranges(rows, cols, values)
+    # The cell's own value plus the spread around it, or the best value nearby if the cell's center
+    # is unsupported. A single value says nothing about the spread, so that's no bound at all.
+    bounds = np.where(np.isnan(values), maxes, values) + (maxes - mins)
+    bounds[counts == 1] = np.inf
+
+    for k, factor in enumerate(results.factors):
+        module = _bounded_module(modules, factor)
+        if module is not None:
+            bounds[:, k] = module.annual_value_upper_bounds(boxes)
+
+    return np.where(np.isnan(bounds).any(axis=1), -np.inf, bounds.sum(axis=1))
+
+
+def search(compute, modules, bounds, k=10, resolution=0.01, coarse_resolution=None):
+    """
+    Find the k best points in a bounding box, down to a grid of the given resolution.
+
+    Args:
+        compute: A function like main.compute_results, called as compute(locs), that returns a
+            ResultSet.
+        modules: The factor modules that compute uses.
+        bounds: (south, west, north, east) in degrees.
+        resolution: Size in degrees of the cells of the finest grid. The points searched are the
+            centers of its cells, and of the coarser cells that contain them.
+        coarse_resolution: Size of the cells of the first grid that is scored. It's rounded to
+            resolution times a power of 2. Defaults to 16 * resolution.
+
+    Return: (results, n_scored), where results is a ResultSet of the best points, best first, and
+        n_scored is the number of points that were scored. The results can miss some of the best
+        points unless every factor has annual_value_upper_bounds, see the module docstring.
+    """
+    south, west, north, east = bounds
+    if not (south < north and west < east and resolution > 0):
+        raise ValueError(f'Bad search bounds {bounds} or resolution {resolution}')
+    coarse_resolution = coarse_resolution or 16 * resolution
+    n_levels = max(0, round(np.log2(coarse_resolution / resolution)))
+    size = resolution * 2**n_levels
+
+    # Cells are identified by their row and column in the grid of their level, from the northwest
+    n_rows = int(np.ceil((north - south) / size - 1e-9))
+    n_cols = int(np.ceil((east - west) / size - 1e-9))
+    rows, cols = np.divmod(np.arange(n_rows * n_cols), n_cols)
+
+    unbounded = sorted(
+        {
+            m.FACTOR_NAME
+            for m in modules
+            if _bounded_module(modules, m.FACTOR_NAME) is None
+        }
+    )
+    if unbounded and n_levels:
+        logger.warning(
+            f'Search results are approximate: {", ".join(unbounded)} have no upper bounds, '
+            'so some of the best points can be missed'
+        )
+
+    found = []
+    n_scored = 0
+    for level in range(n_levels + 1):
+        lats = north - (rows + 0.5) * size
+        lons = west + (cols + 0.5) * size
+        # Coarse cells can stick out of the bounding box, and then their children can be entirely
+        # outside it
+        overlaps = (lats + size / 2 > south) & (lons - size / 2 < east)
+        rows, cols, lats, lons = (
+            rows[overlaps],
+            cols[overlaps],
+            lats[overlaps],
+            lons[overlaps],
+        )
+        if not len(rows):
+            break
+
+        locs = _cell_locations(lats, lons)
+        results = compute(locs).select(locs)
+        n_scored += len(locs)
+        found.append(
+            results[~results.unsupported.any(axis=1) & (lats >= south) & (lons <= east)]
+        )
+        best = np.concatenate([r.totals for r in found])
+        kth_best = np.sort(best)[-k] if len(best) >= k else -np.inf
+        logger.info(
+            f'Scored {len(locs):,} cells of {size:g} degrees; k-th best is {kth_best:,.0f}'
+        )
+        if level == n_levels:
+            break
+
+        boxes = np.stack(
+            [lats - size / 2, lons - size / 2, lats + size / 2, lons + size / 2], axis=1
+        )
+        promising = estimate_best_totals(results, modules, rows, cols, boxes) > kth_best
+        rows, cols = rows[promising], cols[promising]
+        # Split each promising cell into four
+        rows = (2 * rows[:, None] + [0, 0, 1, 1]).ravel()
+        cols = (2 * cols[:, None] + [0, 1, 0, 1]).ravel()
+        size /= 2
+
+    locs = [loc for r in found for loc in r.locs]
+    results = ResultSet(
+        locs,
+        found[0].factors,
+        np.concatenate([r.values for r in found]),
+        np.concatenate([r.status for r in found]),
+    )
+    return results.sorted()[::-1][:k], n_scored
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+import types
+
+from city_result import CityResult
+import heatmap
+from result_set import ResultSet
+import search
+
+
+def _bump(loc):
+    # A smooth hill peaking at (10.125, 20.725)
+    return 1000 - 2000 * np.hypot(loc.lat - 10.125, loc.lon - 20.725)
+
+
+def _step(loc):
+    # Unsupported in the south, and worth more in the west
+    if loc.lat < 10.05:
+        return CityResult.UNSUPPORTED
+    return 100.0 if loc.lon < 20.5 else 0.0
+
+
+def _step_upper_bounds(boxes):
+    boxes = np.asarray(boxes)
+    return np.where(
+        boxes[:, 2] < 10.05, np.nan, np.where(boxes[:, 1] < 20.5, 100.0, 0.0)
+    )
+
+
+_MODULES = [
+    types.SimpleNamespace(__name__='bump', FACTOR_NAME='Bump', annual_value=_bump),
+    types.SimpleNamespace(
+        __name__='step',
+        FACTOR_NAME='Step',
+        annual_value=_step,
+        annual_value_upper_bounds=_step_upper_bounds,
+    ),
+]
+
+
+def _compute(locs):
+    cells = [[m.annual_value(loc) for m in _MODULES] for loc in locs]
+    return ResultSet.from_cells(locs, _MODULES, cells).sorted()
+
+
+def test_search():
+    bounds = (10, 20, 10.4, 21)
+    results, n_scored = search.search(
+        _compute, _MODULES, bounds, k=5, resolution=0.01, coarse_resolution=0.08
+    )
+
+    _, _, locs = heatmap.grid_locations(bounds, 0.01)
+    exhaustive = _compute(locs)
+    exhaustive = exhaustive[~exhaustive.unsupported.any(axis=1)]
+    assert n_scored < len(locs) / 4
+
+    assert len(results) == 5
+    assert results.totals[0] == pytest.approx(exhaustive.totals.max())
+    assert results.totals[0] == pytest.approx(1000)
+    assert (results.totals >= np.sort(exhaustive.totals)[-5] - 1e-9).all()
+    assert not results.unsupported.any()
+    assert all(10 <= loc.lat <= 10.4 and 20 <= loc.lon <= 21 for loc in results.locs)
+
+
+def _spike(loc):
+    # Worth a lot in one cell of the finest grid, which no coarser cell center is near
+    return 500.0 if 10.36 < loc.lat < 10.37 and 20.03 < loc.lon < 20.04 else 0.0
+
+
+def _spike_upper_bounds(boxes):
+    boxes = np.asarray(boxes)
+    touches = (
+        (boxes[:, 0] < 10.37)
+        & (boxes[:, 2] > 10.36)
+        & (boxes[:, 1] < 20.04)
+        & (boxes[:, 3] > 20.03)
+    )
+    return np.where(touches, 500.0, 0.0)
+
+
+def test_search_with_upper_bounds_is_exact():
+    modules = [
+        _MODULES[1],
+        types.SimpleNamespace(
+            __name__='spike',
+            FACTOR_NAME='Spike',
+            annual_value=_spike,
+            annual_value_upper_bounds=_spike_upper_bounds,
+        ),
+    ]
+
+    def compute(locs):
+        cells = [[m.annual_value(loc) for m in modules] for loc in locs]
+        return ResultSet.from_cells(locs, modules, cells).sorted()
+
+    bounds = (10, 20, 10.4, 21)
+    results, n_scored = search.search(
+        compute, modules, bounds, k=3, resolution=0.01, coarse_resolution=0.08
+    )
+
+    _, _, locs = heatmap.grid_locations(bounds, 0.01)
+    exhaustive = compute(locs)
+    exhaustive = exhaustive[~exhaustive.unsupported.any(axis=1)]
+    assert n_scored < len(locs) / 2
+    np.testing.assert_allclose(results.totals, np.sort(exhaustive.totals)[::-1][:3])
+    assert results.totals[0] == 600
+
+
+def test_neighborhood_ranges():
+    rows = np.array([0, 0, 1, 5])
+    cols = np.array([0, 1, 1, 5])
+    values = np.array([[1.0], [3.0], [np.nan], [7.0]])
+    maxes, mins, counts = search._neighborhood_ranges(rows, cols, values)
+    np.testing.assert_array_equal(maxes[:, 0], [3, 3, 3, 7])
+    np.testing.assert_array_equal(mins[:, 0], [1, 1, 1, 7])
+    np.testing.assert_array_equal(counts[:, 0], [2, 2, 2, 1])
@@ -0,0 +1,202 @@
+"""
+Monte Carlo sensitivity analysis: how likely is each location to come out on top when the
+configvars you're unsure about are drawn from distributions instead of fixed?
+
+The factor values are only computed a few times, by treating each location's total as linear in
+each configvar. For weights of linear modules (see city_result.is_linear) that's exact, and the raw
+metrics are the slopes. Other configvars are probed on either side of their nominal value, which
+gives their slopes and checks that they are linear, with a warning when they aren't. Each sample
+is then just a matrix product.
+"""
+
+from common import configvar, logger, override_configvars
+import numpy as np
+
+
+@configvar(type=lambda x: x)
+def sensitivity_distributions():
+    """
+    Distributions of the configvars to vary in a sensitivity analysis (main.py sensitivity).
+
+    Each key is the name of a configvar with a single number as its value. Each value gives a
+    distribution and its parameters, which can be one of:
+
+        distribution: normal, with mean and std
+        distribution: lognormal, with median and sigma (the standard deviation of the log)
+        distribution: uniform, with low and high
+        distribution: triangular, with low, mode and high
+
+    Example config:
+
+        value_of_good_weather_day:
+            distribution: normal
+            mean: 20
+            std: 5
+        annual_income:
+            distribution: uniform
+            low: 80000
+            high: 150000
+    """
+
+
+_DISTRIBUTIONS = {
+    'normal': (
+        ['mean', 'std'],
+        lambda p: p['mean'],
+        lambda rng, n, p: rng.normal(p['mean'], p['std'], n),
+    ),
+    'lognormal': (
+        ['median', 'sigma'],
+        lambda p: p['median'],
+        lambda rng, n, p: p['median'] * np.exp(rng.normal(0, p['sigma'], n)),
+    ),
+    'uniform': (
+        ['low', 'high'],
+        lambda p: (p['low'] + p['high']) / 2,
+        lambda rng, n, p: rng.uniform(p['low'], p['high'], n),
+    ),
+    'triangular': (
+        ['low', 'mode', 'high'],
+        lambda p: p['mode'],
+        lambda rng, n, p: rng.triangular(p['low'], p['mode'], p['high'], n),
+    ),
+}
+
+
+def _parse_distribution(name, spec):
+    try:
+        params, _, _ = _DISTRIBUTIONS[spec['distribution']]
+    except (KeyError, TypeError):
+        raise ValueError(
+            f'{name} needs a distribution, one of {list(_DISTRIBUTIONS)}; got {spec!r}'
+        )
+    missing = [p for p in params if p not in spec]
+    if missing:
+        raise ValueError(
+            f'{name} has a {spec["distribution"]} distribution, which needs {missing}'
+        )
+    return spec['distribution'], {p: float(spec[p]) for p in params}
+
+
+def nominal_values(distributions):
+    """
+    Return: A dict with a central value (the mean, median or mode) of each distribution.
+    """
+    ret = {}
+    for name, spec in distributions.items():
+        kind, params = _parse_distribution(name, spec)
+        ret[name] = _DISTRIBUTIONS[kind][1](params)
+    return ret
+
+
+def draw_samples(distributions, n_samples, seed=None):
+    """
+    Return: An array of shape (n_samples, len(distributions)), with a column of samples for each
+        configvar, in the order of distributions.
+    """
+    rng = np.random.default_rng(seed)
+    columns = []
+    for name, spec in distributions.items():
+        kind, params = _parse_distribution(name, spec)
+        columns.append(_DISTRIBUTIONS[kind][2](rng, n_samples, params))
+    return np.stack(columns, axis=1).reshape(n_samples, len(distributions))
+
+
+def linearize(compute, nominal):
+    """
+    Fit each location's total as a linear function of the given configvars.
+
+    Args:
+        compute: A function like main.compute_results that takes no arguments and returns a
+            ResultSet. It is called once with every configvar overridden to its nominal value, and
+            twice more for each configvar (other than the weights of linear modules), with just that
+            configvar raised and lowered by half its nominal value.
+        nominal: Dict of {configvar name: nominal value}.
+
+    Return: (results, slopes), where results is the ResultSet at the nominal values and slopes is
+        an array of shape (len(nominal), len(results)) with the change in each location's total per
+        unit change of each configvar. A warning is logged for each configvar whose slopes differ
+        below and above its nominal value, since the analysis is then only approximate.
+    """
+    with override_configvars(nominal):
+        results = compute()
+
+    slopes = np.zeros((len(nominal), len(results)))
+    for k, (name, value) in enumerate(nominal.items()):
+        if name in results.weights:
+            slopes[k] = results.weight_slopes(name)
+            continue
+
+        delta = abs(value) / 2 or 1.0
+        probes = []
+        for probe_value in (value - delta, value + delta):
+            with override_configvars(nominal | {name: probe_value}):
+                probes.append(compute().select(results.locs).totals)
+        below = (results.totals - probes[0]) / delta
+        above = (probes[1] - results.totals) / delta
+        slopes[k] = (above + below) / 2
+
+        nonlinear = ~np.isclose(below, above, rtol=0.01, atol=1e-9)
+        if nonlinear.any():
+            locs = [loc.name for loc, bad in zip(results.locs, nonlinear) if bad]
+            logger.warning(
+                f'Totals are not linear in {name} between {value - delta:g} and '
+                f'{value + delta:g} for {", ".join(locs)}, so the sensitivity analysis is '
+                'only approximate'
+            )
+
+    return results, slopes
+
+
+def rank_probabilities(totals):
+    """
+    Args:
+        totals: Array of shape (n_samples, n_locations) with the total of each location in each
+            sample.
+
+    Return: An array of shape (n_locations, n_locations) where entry [i, r] is the fraction of
+        samples in which location i ranks r-th from the top (0 = best).
+    """
+    n_samples, n_locs = totals.shape
+    order = np.argsort(-totals, axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(
+        ranks, order, np.broadcast_to(np.arange(n_locs), order.shape), axis=1
+    )
+    counts = np.bincount(
+        (np.arange(n_locs) * n_locs + ranks).ravel(), minlength=n_locs * n_locs
+    )
+    return counts.reshape(n_locs, n_locs) / n_samples
+
+
+def analyze(compute, distributions, n_samples=20000, seed=None):
+    """
+    Run a sensitivity analysis.
+
+    Args:
+        compute: See linearize.
+        distributions: Dict in the format of sensitivity_distributions().
+
+    Return: A DataFrame with a row per location, best first, giving the probability that it ranks
+        best, its expected rank (1 = best), and percentiles of its total.
+    """
+    import pandas as pd
+
+    nominal = nominal_values(distributions)
+    results, slopes = linearize(compute, nominal)
+
+    samples = draw_samples(distributions, n_samples, seed)
+    totals = results.totals + (samples - np.array(list(nominal.values()))) @ slopes
+
+    probs = rank_probabilities(totals)
+    df = pd.DataFrame(
+        {
+            'P(best)': probs[:, 0],
+            'Expected rank': probs @ np.arange(1, len(results) + 1),
+            'Total (5%)': np.percentile(totals, 5, axis=0),
+            'Total (median)': np.median(totals, axis=0),
+            'Total (95%)': np.percentile(totals, 95, axis=0),
+        },
+        index=[loc.name.upper() for loc in results.locs],
+    )
+    return df.sort_values('Expected rank')
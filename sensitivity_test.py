@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from fake_factors import fake_factor_weight, linear_module
+import location
+from result_set import ResultSet, Status
+import sensitivity
+
+_LOCS = [location.Location(name, 0, 0) for name in ['a', 'b']]
+
+
+def _compute():
+    # a is worth 10 more than b, but b gains 2 per unit of weight more than a
+    w = fake_factor_weight()
+    results = ResultSet(_LOCS, ['X'], [[10 + w], [3 * w]], np.full((2, 1), Status.OK))
+    return results.sorted()
+
+
+def test_linearize(caplog):
+    results, slopes = sensitivity.linearize(_compute, {'fake_factor_weight': 4})
+    assert slopes.shape == (1, 2)
+    by_name = dict(zip([loc.name for loc in results.locs], slopes[0]))
+    assert by_name == pytest.approx({'a': 1, 'b': 3})
+    assert not caplog.records
+
+
+def test_linearize_warns_when_not_linear(caplog):
+    def compute():
+        w = fake_factor_weight()
+        return ResultSet(_LOCS, ['X'], [[w], [w * w]], np.full((2, 1), Status.OK))
+
+    _, slopes = sensitivity.linearize(compute, {'fake_factor_weight': 4})
+    # Probing on both sides gives the derivative at the nominal value
+    assert slopes.tolist() == [[1, 8]]
+    assert 'not linear in fake_factor_weight between 2 and 6 for b,' in caplog.text
+
+
+def test_linearize_uses_metrics_of_linear_modules():
+    module = linear_module()
+    calls = []
+
+    def compute():
+        calls.append(fake_factor_weight())
+        return ResultSet.from_cells(_LOCS, [module], [[1.0], [3.0]])
+
+    results, slopes = sensitivity.linearize(compute, {'fake_factor_weight': 4})
+    assert calls == [4]
+    assert results.totals.tolist() == [4, 12]
+    assert slopes.tolist() == [[1, 3]]
+
+
+def test_analyze():
+    # b wins when the weight is above 5, which happens 3/4 of the time
+    df = sensitivity.analyze(
+        _compute,
+        {'fake_factor_weight': {'distribution': 'uniform', 'low': 0, 'high': 20}},
+        n_samples=20000,
+        seed=0,
+    )
+    assert df.index.tolist() == ['B', 'A']
+    assert df.loc['B', 'P(best)'] == pytest.approx(0.75, abs=0.02)
+    assert df.loc['A', 'Expected rank'] == pytest.approx(1.75, abs=0.02)
+
+
+def test_rank_probabilities():
+    totals = np.array([[1, 2, 3], [3, 2, 1]])
+    probs = sensitivity.rank_probabilities(totals)
+    np.testing.assert_array_equal(probs, [[0.5, 0, 0.5], [0, 1, 0], [0.5, 0, 0.5]])
+
+
+def test_bad_distribution():
+    with pytest.raises(ValueError, match='needs'):
+        sensitivity.nominal_values({'x': {'distribution': 'normal', 'mean': 1}})
@@ -0,0 +1,68 @@
+"""
+Cheap checks of whether a location is inside the region that a factor module supports.
+
+Factor modules that only work in some region declare it with a SUPPORTED_REGION module attribute,
+e.g. SUPPORTED_REGION = 'us'. Modules without the attribute are assumed to work everywhere. Checking
+a location against a small simplified outline up front lets us reject it before loading large
+datasets or making network calls.
+"""
+
+from common import UnsupportedCityException
+import geo
+import util
+import tracing
+
+# How far outside the outline points are still accepted, in degrees (about 10 km). The 20m Census
+# outline is generalized, so coastal points can be a few km outside it.
+_OUTLINE_MARGIN = 0.1
+
+
+@util.locked_cache
+@tracing.traced(tracing.DATASET)
+def _us_outline():
+    import geopandas
+    import numpy as np
+    import shapely
+
+    with util.web_get_to_file(
+        'https://www2.census.gov/geo/tiger/GENZ2020/shp/cb_2020_us_nation_20m.zip',
+        suffix='.zip',
+    ) as f:
+        df = geopandas.read_file('zip://' + str(f.name))
+    outline = shapely.buffer(
+        np.asarray(df.geometry, dtype=object), _OUTLINE_MARGIN, quad_segs=2
+    )
+    # Use a coarse tolerance; we only test the outer tier, which contains the buffered outline, so
+    # this only accepts more points off the coast.
+    return geo.PolygonIndex(outline, tolerance=0.05)
+
+
+_REGION_OUTLINES = {
+    'us': _us_outline,
+}
+
+
+def covers(region, latlons):
+    """
+    Check whether each point is in the given region.
+
+    Return: A numpy bool array. Points up to about 0.25 degrees outside the region's outline may be
+        reported as covered. Points inside the region are only rejected if they are more than
+        _OUTLINE_MARGIN from its outline, e.g. on small islands that the outline leaves out.
+    """
+    return _REGION_OUTLINES[region]().may_contain(latlons)
+
+
+def check_region(region, loc):
+    """Raise UnsupportedCityException if loc is not in region."""
+    if not covers(region, [loc.latlon])[0]:
+        raise UnsupportedCityException(
+            f'{loc} is outside the supported region {region!r}'
+        )
+
+
+def check_module(module, loc):
+    """Raise UnsupportedCityException if loc is not in the module's SUPPORTED_REGION."""
+    region = getattr(module, 'SUPPORTED_REGION', None)
+    if region is not None:
+        check_region(region, loc)
@@ -0,0 +1,248 @@
+"""
+A pyramid of z/x/y map tiles of scores, computed on demand and cached on disk, for browsing
+results on a map.
+
+Tiles use the usual web map scheme (as in OpenStreetMap or folium). Each tile is a TILE_CELLS x
+TILE_CELLS grid of locations, evenly spaced in the map's projection, scored like any other locations.
+Panning and zooming around an area that has been viewed before only reads tiles from the store;
+missing or stale tiles are scored as they are requested.
+
+Like result_store, each stored tile records the configvars that were read while scoring it and the
+source hash of each factor module, and is rescored once any of them change. Tiles store the raw
+metrics of linear factors (see city_result.is_linear), so changing their weights, e.g.
+value_of_walkability, doesn't require rescoring any tile.
+
+To browse tiles, run `./main.sh daemon` and add tiles.folium_layer(...) to a folium map.
+"""
+
+import city_result
+from common import (
+    config_fingerprint,
+    overridden_configvars,
+    record_configvar_reads,
+)
+import heatmap
+import location
+import math
+import numpy as np
+import pathlib
+from result_set import ResultSet
+import result_store
+import threading
+import util
+
+_TILES_DIR = pathlib.Path(__file__).parent / '.cache' / 'tiles'
+# Number of grid cells along each side of a tile
+TILE_CELLS = 16
+# Pixels along each side of the PNG of a tile
+TILE_PIXELS = 256
+
+
+def tile_bounds(z, x, y):
+    """
+    Return: (south, west, north, east) of tile x, y at zoom z, in degrees.
+    """
+    n = 2**z
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+def tile_for(lat, lon, z):
+    """
+    Return: (x, y) of the tile at zoom z that contains the point.
+    """
+    n = 2**z
+    mercator_y = math.asinh(math.tan(math.radians(lat)))
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - mercator_y / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_locations(z, x, y):
+    """
+    Return: A Location for each cell of a tile, from the northwest cell in row-major order. Cell
+        centers are evenly spaced in Web Mercator, like the tile's pixels.
+    """
+    n = 2**z
+    offsets = (np.arange(TILE_CELLS) + 0.5) / TILE_CELLS
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    lons = (x + offsets) / n * 360 - 180
+    return [
+        location.Location(f'{lat:.6f},{lon:.6f}', float(lat), float(lon))
+        for lat in lats
+        for lon in lons
+    ]
+
+
+class TileStore:
+    """
+    Config fingerprints are read once per TileStore, so create a new one whenever config files may
+    have changed, e.g. for each request. TileStores share the underlying diskcache.Cache (see
+    util.open_disk_cache), so this is cheap.
+    """
+
+    def __init__(self, directory=_TILES_DIR):
+        self._cache = util.open_disk_cache(directory)
+        self._fingerprints = {}
+
+    def _fingerprint(self, name):
+        if name not in self._fingerprints:
+            self._fingerprints[name] = config_fingerprint(name)
+        return self._fingerprints[name]
+
+    @staticmethod
+    def _key(modules, z, x, y):
+        return tuple(m.__name__ for m in modules), TILE_CELLS, z, x, y
+
+    def get(self, modules, z, x, y):
+        """
+        Return: The stored ResultSet of the tile's cells in tile_locations order, reweighted with
+            the current weights of linear factors, or result_store.MISSING if there is none, it is
+            stale, or it reads an overridden configvar.
+        """
+        entry = self._cache.get(self._key(modules, z, x, y))
+        if entry is None:
+            return result_store.MISSING
+        if any(
+            result_store.source_hash(m.__name__) != entry['sources'][m.__name__]
+            for m in modules
+        ):
+            return result_store.MISSING
+        if entry['configvars'].keys() & overridden_configvars():
+            return result_store.MISSING
+        if any(
+            self._fingerprint(name) != fingerprint
+            for name, fingerprint in entry['configvars'].items()
+        ):
+            return result_store.MISSING
+
+        results = ResultSet(
+            tile_locations(z, x, y),
+            entry['factors'],
+            entry['values'],
+            entry['status'],
+            entry['weight_names'],
+            entry['metrics'],
+            entry['weights'],
+        )
+        return results.reweighted(_weights(modules))
+
+    def put(self, modules, z, x, y, results, configvar_reads):
+        """
+        Store a tile's ResultSet, along with the names of the configvars read to compute it.
+
+        Tiles computed with overridden configvars (other than weights of linear factors) aren't
+        stored.
+        """
+        # Stored tiles are reweighted when read, so they don't depend on these
+        configvar_reads = configvar_reads - set(results.weight_names)
+        if configvar_reads & overridden_configvars():
+            return
+        self._cache.set(
+            self._key(modules, z, x, y),
+            {
+                'factors': results.factors,
+                'values': results.values,
+                'status': results.status,
+                'weight_names': results.weight_names,
+                'metrics': results.metrics,
+                'weights': results.weights,
+                'sources': {
+                    m.__name__: result_store.source_hash(m.__name__) for m in modules
+                },
+                'configvars': {
+                    name: self._fingerprint(name) for name in configvar_reads
+                },
+            },
+            expire=result_store.RESULT_TTL_SECONDS,
+        )
+
+
+def _weights(modules):
+    return {m.WEIGHT.__name__: m.WEIGHT() for m in modules if city_result.is_linear(m)}
+
+
+# Tiles are scored one at a time, so that a map requesting many tiles at once doesn't score the
+# same tile twice
+_scoring_lock = threading.Lock()
+
+
+def tile(compute, modules, z, x, y, store=None):
+    """
+    Get the scores of a tile's cells, from the store if possible.
+
+    Args:
+        compute: A function like main.compute_results, called as compute(locs), that returns a
+            ResultSet.
+        modules: The factor modules that compute uses.
+        store: Optional TileStore. Tiles that aren't in it are scored and written back to it.
+
+    Return: A ResultSet with the cells in tile_locations order.
+    """
+    if store is not None:
+        results = store.get(modules, z, x, y)
+        if results is not result_store.MISSING:
+            return results
+
+    with _scoring_lock:
+        # Another request may have scored the tile while we waited
+        if store is not None:
+            results = store.get(modules, z, x, y)
+            if results is not result_store.MISSING:
+                return results
+
+        locs = tile_locations(z, x, y)
+        with record_configvar_reads() as reads:
+            results = compute(locs).select(locs)
+        if store is not None:
+            store.put(modules, z, x, y, results, reads)
+        return results
+
+
+def tile_png(results, layer, vmin, vmax):
+    """
+    Render a layer of a tile's ResultSet as a PNG, colored like heatmap.colorize.
+
+    Return: The PNG file's bytes.
+    """
+    import branca.utilities
+
+    raster = heatmap.layer_values(results, layer).reshape(TILE_CELLS, TILE_CELLS)
+    scale = TILE_PIXELS // TILE_CELLS
+    pixels = np.repeat(
+        np.repeat(heatmap.colorize(raster, vmin, vmax), scale, 0), scale, 1
+    )
+    return branca.utilities.write_png(pixels)
+
+
+def folium_layer(layer, vmin, vmax, url=None, opacity=0.6):
+    """
+    Make a folium layer that shows tiles from a running daemon.
+
+    Args:
+        layer: A factor name, or 'Total'.
+        vmin, vmax: Values shown as the worst and best colors. Use the same ones for every tile so
+            that colors are comparable.
+        url: URL of the daemon, by default daemon.DEFAULT_URL.
+
+    Example usage:
+        my_map = location.folium_map([locs.seattle])
+        tiles.folium_layer('Total', -60000, -20000).add_to(my_map)
+        heatmap.legend('Total', -60000, -20000).add_to(my_map)
+    """
+    import daemon
+    import folium
+    import urllib.parse
+
+    url = url or daemon.DEFAULT_URL
+    return folium.TileLayer(
+        tiles=f'{url}/tiles/{urllib.parse.quote(layer)}/{{z}}/{{x}}/{{y}}.png'
+        f'?vmin={vmin}&vmax={vmax}',
+        attr='NestCB',
+        name=layer,
+        overlay=True,
+        opacity=opacity,
+    )
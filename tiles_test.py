@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import types
+
+import city_result
+from common import mark_configvars_read, override_configvars
+from fake_factors import linear_module
+from result_set import ResultSet
+import result_store
+import tiles
+
+
+def _other_value(loc):
+    mark_configvars_read(['_tiles_test_config'])
+    return loc.lon
+
+
+_LINEAR = linear_module('tiles_test_linear', 'Linear', raw_metric=lambda loc: loc.lat)
+_OTHER = types.SimpleNamespace(
+    __name__='tiles_test_other', FACTOR_NAME='Other', annual_value=_other_value
+)
+_MODULES = [_LINEAR, _OTHER]
+
+
+def test_tile_locations():
+    south, west, north, east = tiles.tile_bounds(10, 164, 357)
+    assert tiles.tile_for(47.6, -122.3, 10) == (164, 357)
+    assert south < 47.6 < north and west < -122.3 < east
+
+    locs = tiles.tile_locations(10, 164, 357)
+    assert len(locs) == tiles.TILE_CELLS**2
+    assert all(south < loc.lat < north and west < loc.lon < east for loc in locs)
+    # Row-major from the northwest corner
+    assert locs[0].lat > locs[-1].lat and locs[0].lon < locs[1].lon
+
+
+@pytest.fixture
+def fingerprints(monkeypatch):
+    fingerprints = {'_tiles_test_config': 'a'}
+    monkeypatch.setattr(result_store, 'source_hash', lambda module_name: 'source')
+    monkeypatch.setattr(
+        tiles, 'config_fingerprint', lambda name: fingerprints.get(name)
+    )
+    return fingerprints
+
+
+def test_tile(tmp_path, fingerprints):
+    calls = []
+
+    def compute(locs):
+        calls.append(len(locs))
+        cells = [city_result.CityResult(loc, _MODULES).compute_values() for loc in locs]
+        return ResultSet.from_cells(locs, _MODULES, cells).sorted()
+
+    with override_configvars({'fake_factor_weight': 2}):
+        results = tiles.tile(compute, _MODULES, 10, 164, 357, tiles.TileStore(tmp_path))
+    locs = tiles.tile_locations(10, 164, 357)
+    assert results.locs == locs
+    np.testing.assert_allclose(results.values, [[2 * loc.lat, loc.lon] for loc in locs])
+
+    # Changing the weight just reweights the stored tile
+    with override_configvars({'fake_factor_weight': 3}):
+        results = tiles.tile(compute, _MODULES, 10, 164, 357, tiles.TileStore(tmp_path))
+    assert calls == [len(locs)]
+    np.testing.assert_allclose(results.values[:, 0], [3 * loc.lat for loc in locs])
+
+    # Changing another configvar that was read rescores the tile
+    fingerprints['_tiles_test_config'] = 'b'
+    with override_configvars({'fake_factor_weight': 3}):
+        tiles.tile(compute, _MODULES, 10, 164, 357, tiles.TileStore(tmp_path))
+    assert calls == [len(locs)] * 2
+
+
+def test_stores_share_cache(tmp_path):
+    # The daemon creates a TileStore per request, without opening the cache again
+    assert tiles.TileStore(tmp_path)._cache is tiles.TileStore(tmp_path)._cache
+
+
+def test_tile_png():
+    locs = tiles.tile_locations(10, 164, 357)
+    results = ResultSet(
+        locs,
+        ['X'],
+        np.arange(len(locs), dtype=float),
+        np.zeros(len(locs)),
+    )
+    png = tiles.tile_png(results, 'Total', 0, len(locs))
+    assert png.startswith(b'\x89PNG')
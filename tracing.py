@@ -0,0 +1,253 @@
+"""
+Time where factor evaluation spends its time, as nested spans.
+
+Spans are recorded around the computation of each (module, location) cell, each batch
+annual_values or raw_metrics call, each dataset load, each util.web_get and each call of a
+util.cache_on_disk function. Spans are only recorded inside a record() block, and cost next to
+nothing otherwise.
+
+Run e.g. `./main.sh --trace trace.json summary` to print a table of where each factor module's time
+went, and save every span as a Chrome trace, which can be opened in https://ui.perfetto.dev or
+chrome://tracing to see what each thread and process was doing when. From a notebook:
+
+    with tracing.record() as trace:
+        main.compute_results()
+    trace.factor_table()
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+# Span categories
+CELL = 'cell'
+BATCH = 'batch'
+WEB = 'web'
+DATASET = 'dataset'
+DISK_CACHE = 'disk cache'
+# Waiting for prefetch.prefetch, whose dataset loads run on other threads
+PREFETCH = 'prefetch'
+
+
+class Span(NamedTuple):
+    name: str
+    category: str
+    # Wall clock time in microseconds, so that spans from different processes line up
+    start_us: int
+    duration_us: int
+    pid: int
+    tid: int
+    args: dict
+    # Name of the factor module that the span is for, if any, e.g. from an enclosing CELL span
+    module: Optional[str]
+    # False if the span is inside another span of the same category
+    outermost: bool
+
+
+class Trace:
+    """
+    Attributes:
+        spans: List of the recorded Spans, in the order they ended.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, spans):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def chrome_trace(self):
+        """
+        Return: The spans in the Chrome trace event format, as a JSON-serializable dict.
+        """
+        return {
+            'traceEvents': [
+                {
+                    'name': span.name,
+                    'cat': span.category,
+                    'ph': 'X',
+                    'ts': span.start_us,
+                    'dur': span.duration_us,
+                    'pid': span.pid,
+                    'tid': span.tid,
+                    'args': span.args | {'module': span.module},
+                }
+                for span in self.spans
+            ],
+            'displayTimeUnit': 'ms',
+        }
+
+    def save(self, path):
+        """
+        Write the spans to a Chrome trace JSON file.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def factor_table(self):
+        """
+        Summarize where each factor module's time went.
+
+        Each time column adds up the spans of one category, leaving out spans inside another span of
+        the same category. Columns overlap, e.g. a download while loading a dataset counts toward
+        both Web and Datasets. Work that isn't for any one module, like prefetching datasets, is in
+        the '(no module)' row.
+
+        Return: A DataFrame indexed by module name, with the slowest modules first.
+        """
+        import pandas as pd
+
+        columns = {
+            BATCH: 'Batch (s)',
+            WEB: 'Web (s)',
+            DATASET: 'Datasets (s)',
+            DISK_CACHE: 'Disk cache (s)',
+        }
+        rows = {}
+        for span in self.spans:
+            row = rows.setdefault(
+                span.module or '(no module)',
+                {
+                    'Cells': 0,
+                    'Cells (s)': 0.0,
+                    'Slowest cell (s)': 0.0,
+                    'Slowest location': None,
+                }
+                | {column: 0.0 for column in columns.values()},
+            )
+            seconds = span.duration_us / 1e6
+            if span.category == CELL:
+                row['Cells'] += 1
+                row['Cells (s)'] += seconds
+                if seconds >= row['Slowest cell (s)']:
+                    row['Slowest cell (s)'] = seconds
+                    row['Slowest location'] = span.args.get('location')
+            elif span.category in columns and span.outermost:
+                row[columns[span.category]] += seconds
+
+        df = pd.DataFrame.from_dict(rows, orient='index')
+        total = df['Cells (s)'] + df['Batch (s)']
+        return df.loc[total.sort_values(ascending=False, kind='stable').index]
+
+
+# The Trace that spans are added to, shared by every thread, or None when not recording
+_trace = None
+# The module and categories of the spans that enclose the current code
+_enclosing = contextvars.ContextVar('_enclosing', default=(None, frozenset()))
+_NOT_RECORDING = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def record():
+    """
+    Record the spans of every thread inside the with block.
+
+    Spans inside a nested with block also count for the enclosing one.
+
+    Yields: A Trace with the spans recorded so far.
+    """
+    global _trace
+    trace = Trace()
+    enclosing_trace, _trace = _trace, trace
+    try:
+        yield trace
+    finally:
+        _trace = enclosing_trace
+        if enclosing_trace is not None:
+            enclosing_trace.add(trace.spans)
+
+
+def recording():
+    """
+    Return: Whether a record block is active.
+    """
+    return _trace is not None
+
+
+def add(spans):
+    """
+    Add spans that were recorded elsewhere, e.g. in a worker process, to the active record block.
+    """
+    if _trace is not None:
+        _trace.add(spans)
+
+
+@contextlib.contextmanager
+def _span(trace, name, category, module, args):
+    enclosing_module, enclosing_categories = _enclosing.get()
+    module = module or enclosing_module
+    token = _enclosing.set((module, enclosing_categories | {category}))
+    start_us = time.time_ns() // 1000
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration_us = (time.perf_counter_ns() - start) // 1000
+        _enclosing.reset(token)
+        trace.add(
+            [
+                Span(
+                    name,
+                    category,
+                    start_us,
+                    duration_us,
+                    os.getpid(),
+                    threading.get_ident(),
+                    args,
+                    module,
+                    category not in enclosing_categories,
+                )
+            ]
+        )
+
+
+def span(name, category, module=None, **args):
+    """
+    Time the with block as a span, if a record block is active.
+
+    Example usage:
+        with tracing.span(url, tracing.WEB, cached=False):
+            resp = session.get(url)
+
+    Args:
+        name: What the span is, e.g. a URL or a function name.
+        category: What kind of work the span is, e.g. WEB.
+        module: Name of the factor module the work is for. Spans inside the with block inherit it.
+        args: Details to show in the trace viewer, e.g. location='seattle'.
+    """
+    trace = _trace
+    if trace is None:
+        return _NOT_RECORDING
+    return _span(trace, name, category, module, args)
+
+
+def traced(category):
+    """
+    Decorator that records each call of the decorated function as a span.
+
+    To only time dataset loads that actually happen, put it below @util.locked_cache or @functools.cache.
+    """
+
+    def decorator(f):
+        name = f'{f.__module__}.{f.__qualname__}'
+
+        @functools.wraps(f)
+        def decorated(*args, **kwargs):
+            if _trace is None:
+                return f(*args, **kwargs)
+            call_args = [repr(arg) for arg in args] + [
+                f'{k}={v!r}' for k, v in kwargs.items()
+            ]
+            with span(name, category, call=', '.join(call_args)):
+                return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
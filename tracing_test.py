@@ -0,0 +1,74 @@
+import json
+import types
+
+from city_result import CityResult
+import executor
+import location
+import tracing
+
+
+@tracing.traced(tracing.DATASET)
+def _load_dataset(name):
+    with tracing.span(f'https://example.com/{name}', tracing.WEB):
+        return name
+
+
+def _annual_value(loc):
+    _load_dataset('inner')
+    return loc.lat
+
+
+_MODULE = types.SimpleNamespace(
+    __name__='tracing_test_module', FACTOR_NAME='Test', annual_value=_annual_value
+)
+_LOCS = [location.Location('a', 1.0, 2.0), location.Location('b', 3.0, 4.0)]
+
+
+def test_spans():
+    assert not tracing.recording()
+    with tracing.record() as trace:
+        _load_dataset('outer')
+        executor.compute_all([CityResult(loc, [_MODULE]) for loc in _LOCS], jobs=2)
+    assert not tracing.recording()
+
+    by_name = {}
+    for span in trace.spans:
+        by_name.setdefault(span.name, []).append(span)
+    assert [span.args['location'] for span in by_name['tracing_test_module']] == [
+        'a',
+        'b',
+    ]
+    # Spans inside a cell are attributed to its module
+    assert {span.module for span in by_name['https://example.com/inner']} == {
+        'tracing_test_module'
+    }
+    (outer,) = by_name['https://example.com/outer']
+    assert outer.module is None
+    (outer_load,) = [
+        span for span in by_name['tracing_test._load_dataset'] if span.module is None
+    ]
+    assert outer_load.args['call'] == "'outer'"
+    # Spans nest in time like they do in the code
+    assert outer_load.start_us <= outer.start_us
+    assert outer.start_us + outer.duration_us <= (
+        outer_load.start_us + outer_load.duration_us
+    )
+
+    table = trace.factor_table()
+    assert table.loc['tracing_test_module', 'Cells'] == 2
+    assert table.loc['tracing_test_module', 'Slowest location'] in ('a', 'b')
+    assert table.loc['(no module)', 'Cells'] == 0
+
+    events = json.loads(json.dumps(trace.chrome_trace()))['traceEvents']
+    assert len(events) == len(trace.spans)
+    assert all(event['ph'] == 'X' for event in events)
+
+
+def test_not_recording():
+    with tracing.span('ignored', tracing.WEB):
+        pass
+    with tracing.record() as trace:
+        with tracing.record() as inner:
+            _load_dataset('x')
+    # Spans count for every enclosing record block
+    assert len(inner.spans) == len(trace.spans) == 2
@@ -35,10 +35,15 @@ def value_of_transit():
 
 # %%
 FACTOR_NAME = 'Transit'
+WEIGHT = value_of_transit
+
+
+def raw_metric(loc):
+    return walkscore.transit_score(loc) / 100
 
 
 def annual_value(loc):
-    return value_of_transit() * walkscore.transit_score(loc) / 100
+    return WEIGHT() * raw_metric(loc)
 
 
 # %% tags=["active-ipynb"]
@@ -1,10 +1,13 @@
 from common import logger
-import requests_cache
 import time
-import diskcache
+import functools
+import geohash
+import os
 import pathlib
 import tempfile
+import threading
 import contextlib
+import tracing
 
 
 def run(f):
@@ -19,20 +22,64 @@ class DefaultReprMixin:
         return '{}({})'.format(self.__class__.__name__, ', '.join(pieces))
 
 
-requests_cache_session = requests_cache.CachedSession('.cache/http_cache.sqlite')
+def locked_cache(f):
+    """
+    Like functools.cache, but safe to call from several threads at once.
+
+    While one thread computes the value for some arguments, other threads calling with the same
+    arguments wait for it instead of loading the same data again. Exceptions aren't cached.
+    """
+    cache = {}
+    locks = {}
+    locks_lock = threading.Lock()
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        if key in cache:
+            return cache[key]
+        with locks_lock:
+            lock = locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in cache:
+                cache[key] = f(*args, **kwargs)
+        return cache[key]
+
+    def cache_clear():
+        with locks_lock:
+            cache.clear()
+            locks.clear()
+
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+@locked_cache
+def requests_cache_session():
+    """
+    Return: The requests_cache.CachedSession used by web_get, opened on first use.
+    """
+    import requests
+    import requests_cache
+
+    # This dumb hack seems necessary when tethering on my phone.
+    # https://stackoverflow.com/a/46972341/785404
+    requests.packages.urllib3.util.connection.HAS_IPV6 = False
+    return requests_cache.CachedSession('.cache/http_cache.sqlite')
 
 
 def web_get(url):
     """
     Perform a HTTP(S) GET and log if it wasn't cached.
     """
-    is_cached = requests_cache_session.cache.contains(url=url)
+    is_cached = requests_cache_session().cache.contains(url=url)
 
     if not is_cached:
         start_time = time.time()
         logger.info(f'fetching {url} ...')
 
-    ret = requests_cache_session.get(url)
+    with tracing.span(url, tracing.WEB, cached=is_cached):
+        ret = requests_cache_session().get(url)
 
     if not is_cached:
         logger.info(
@@ -42,6 +89,34 @@ def web_get(url):
     return ret
 
 
+# Seconds that web_version reuses a URL's version before asking the server again
+_WEB_VERSION_TTL_SECONDS = 24 * 60 * 60
+
+
+def web_version(url):
+    """
+    Get a string identifying the current version of the resource at a URL.
+
+    Uses the ETag (or failing that the Last-Modified) header from a HEAD request, which goes through
+    the HTTP cache like web_get, but expires after a day so that new versions are noticed. Returns
+    None if the server provides neither header.
+    """
+    session = requests_cache_session()
+    with tracing.span(url, tracing.WEB, method='HEAD'):
+        resp = session.head(
+            url, allow_redirects=True, expire_after=_WEB_VERSION_TTL_SECONDS
+        )
+        if resp.expires is None:
+            # Cached without an expiry, before web_version set one
+            resp = session.head(
+                url,
+                allow_redirects=True,
+                expire_after=_WEB_VERSION_TTL_SECONDS,
+                force_refresh=True,
+            )
+    return resp.headers.get('ETag') or resp.headers.get('Last-Modified')
+
+
 @contextlib.contextmanager
 def web_get_to_file(url, binary=True, suffix=None):
     """
@@ -61,6 +136,27 @@ def web_get_to_file(url, binary=True, suffix=None):
         yield f
 
 
+@contextlib.contextmanager
+def atomic_write_path(path):
+    """
+    Write a file so that readers, and other threads or processes writing it at the same time,
+    never see a partially written file.
+
+    This is a context manager that yields a unique temporary path in the same directory, with the
+    same suffix as path. The temporary file replaces path when the with block exits without error.
+    """
+    path = pathlib.Path(path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=path.stem + '.', suffix='.tmp' + path.suffix
+    )
+    os.close(fd)
+    try:
+        yield pathlib.Path(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        pathlib.Path(tmp_path).unlink(missing_ok=True)
+
+
 # taken from https://docs.python.org/3/howto/logging-cookbook.html
 class LoggingContext:
     def __init__(self, logger, level=None, handler=None, close=True):
@@ -86,8 +182,116 @@ class LoggingContext:
         # implicit return of None => don't swallow exceptions
 
 
-# See https://github.com/grantjenks/python-diskcache/issues/204
-diskcache.core.DBNAME = 'computation_cache.db'
-cache_on_disk = diskcache.Cache(
-    directory=pathlib.Path(__file__).parent / '.cache'
-).memoize()
+def open_disk_cache(directory):
+    """
+    Return: The diskcache.Cache stored in directory. It's opened once per process and shared by
+        every thread, e.g. the daemon's request handlers. diskcache is only imported here, because
+        it is slow to import.
+    """
+    return _open_disk_cache(str(directory))
+
+
+@locked_cache
+def _open_disk_cache(directory):
+    import diskcache
+
+    # See https://github.com/grantjenks/python-diskcache/issues/204
+    diskcache.core.DBNAME = 'computation_cache.db'
+    return diskcache.Cache(directory)
+
+
+@locked_cache
+def _disk_cache():
+    # Opened on first use, so that importing util (and every module that caches on disk) is fast
+    return open_disk_cache(pathlib.Path(__file__).parent / '.cache')
+
+
+def cache_on_disk(f):
+    """
+    Memoize a function on disk, like diskcache.Cache.memoize.
+    """
+    memoized = None
+
+    @tracing.traced(tracing.DISK_CACHE)
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        nonlocal memoized
+        if memoized is None:
+            memoized = _disk_cache().memoize()(f)
+        return memoized(*args, **kwargs)
+
+    return decorated
+
+
+def cache_on_disk_spatially(precision=6, tolerance_km=0.0, same_result=None):
+    """
+    Like cache_on_disk, but for functions of a location whose result is spatially smooth.
+
+    The decorated function must take a location (anything indexable as (lat, lon), e.g. a
+    location.Location) as its first argument. Results are keyed on the lat/lon, so the location's
+    name doesn't matter. A cached result for a different point is reused if that point is in the
+    same or a neighboring geohash cell, is within tolerance_km, and
+    same_result(latlon, cached_latlon, cached_result) returns True. Pass a same_result that proves
+    the answer is unchanged (e.g. the point is inside the polygon that was returned) to make reuse
+    exact; if it's None, any point within tolerance_km is reused.
+
+    Args:
+        precision: Geohash precision; see geohash.encode. tolerance_km should be no larger than the
+            cell size or some nearby points won't be found.
+        tolerance_km: Maximum distance to a point whose result will be reused.
+        same_result: Optional function (latlon, cached_latlon, cached_result) -> bool.
+    """
+
+    def decorator(f):
+        key_prefix = ('cache_on_disk_spatially', f.__module__, f.__qualname__)
+        missing = object()
+
+        def cell_entries(cell):
+            # Each cell has a count of its entries, which are keyed individually so that adding one
+            # doesn't rewrite the others
+            for i in range(_disk_cache().get(key_prefix + (cell, 'count'), 0)):
+                # None if another process has counted the entry but not written it yet
+                entry = _disk_cache().get(key_prefix + (cell, i))
+                if entry is not None:
+                    yield entry
+
+        @tracing.traced(tracing.DISK_CACHE)
+        @functools.wraps(f)
+        def decorated(loc, *args, **kwargs):
+            latlon = (float(loc[0]), float(loc[1]))
+            extra_args = (args, tuple(sorted(kwargs.items())))
+            cell = geohash.encode(*latlon, precision=precision)
+
+            result = _disk_cache().get(key_prefix + (latlon, extra_args), missing)
+            if result is not missing:
+                return result
+
+            if tolerance_km > 0:
+                from haversine import haversine
+
+                for neighbor_cell in [cell, *geohash.neighbors(cell)]:
+                    for cached_latlon, cached_args in cell_entries(neighbor_cell):
+                        if (
+                            cached_args != extra_args
+                            or haversine(latlon, cached_latlon) > tolerance_km
+                        ):
+                            continue
+                        result = _disk_cache().get(
+                            key_prefix + (cached_latlon, cached_args)
+                        )
+                        if same_result is None or same_result(
+                            latlon, cached_latlon, result
+                        ):
+                            return result
+
+            result = f(loc, *args, **kwargs)
+            _disk_cache().set(key_prefix + (latlon, extra_args), result)
+            if tolerance_km > 0:
+                i = _disk_cache().incr(key_prefix + (cell, 'count')) - 1
+                _disk_cache().set(key_prefix + (cell, i), (latlon, extra_args))
+
+            return result
+
+        return decorated
+
+    return decorator
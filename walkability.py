@@ -35,10 +35,15 @@ def value_of_walkability():
 
 # %%
 FACTOR_NAME = 'Walkability'
+WEIGHT = value_of_walkability
+
+
+def raw_metric(loc):
+    return walkscore.walk_score(loc) / 100
 
 
 def annual_value(loc):
-    return value_of_walkability() * walkscore.walk_score(loc) / 100
+    return WEIGHT() * raw_metric(loc)
 
 
 # %% tags=["active-ipynb"]